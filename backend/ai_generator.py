@@ -4,90 +4,88 @@ Correctly uses OpenAI for GPT models and Anthropic for Claude
 """
 
 import os
+import random
+import time
 from dotenv import load_dotenv
 
+from conversation import user_text
+from metrics import provider_requests, provider_seconds, provider_tokens
+from providers import get_client
+from response_parser import parse_response
+from resilience import FAILOVER, call_with_failover, health
+
 load_dotenv()
 
-def generate_with_ai(prompt, model_id):
+ANTHROPIC_MODELS = {
+    'kiwi-4.5': 'claude-sonnet-4-20250514',
+    'kiwi-opus': 'claude-opus-4-20250514'
+}
+
+OPENAI_MODELS = {
+    'gpt-4': 'gpt-4-turbo-preview',
+    'gpt-3.5': 'gpt-3.5-turbo'
+}
+
+MODEL_PROVIDERS = {
+    **{model_id: 'anthropic' for model_id in ANTHROPIC_MODELS},
+    **{model_id: 'openai' for model_id in OPENAI_MODELS}
+}
+
+# Bump when the prompt template changes so cached replies are not reused
+PROMPT_VERSION = 1
+
+CACHE_POINT = {"type": "ephemeral"}
+
+def build_messages(prompt, context=None):
     """
-    Generate code using AI models
+    (system, messages) in Anthropic's format. Prior turns come first and never
+    change between follow-ups, so the end of the system prompt and the last
+    prior turn are marked as prompt-cache breakpoints.
     """
-    
-    # Anthropic (Claude) - GlobalAssist models
-    if model_id in ['kiwi-4.5', 'kiwi-opus']:
-        try:
-            from anthropic import Anthropic
-            client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
-            
-            model_map = {
-                'kiwi-4.5': 'claude-sonnet-4-20250514',
-                'kiwi-opus': 'claude-opus-4-20250514'
-            }
-            
-            response = client.messages.create(
-                model=model_map[model_id],
-                max_tokens=2000,
-                messages=[{
-                    "role": "user",
-                    "content": f"Generate clean, production-ready code for: {prompt}\n\nProvide the code and a brief explanation."
-                }]
-            )
-            
-            content = response.content[0].text
-            
-            # Parse response
-            if "```" in content:
-                parts = content.split("```")
-                code = parts[1].strip()
-                if code.startswith(('python', 'javascript', 'java', 'cpp')):
-                    code = '\n'.join(code.split('\n')[1:])
-                explanation = parts[2] if len(parts) > 2 else "Code generated successfully"
-            else:
-                code = content
-                explanation = "Code generated successfully"
-            
-            return {'code': code, 'explanation': explanation}
-        except Exception as e:
-            print(f"Anthropic error: {e}")
-    
-    # OpenAI (GPT) - FIXED: Using correct OpenAI client!
-    elif model_id in ['gpt-4', 'gpt-3.5']:
-        try:
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            
-            model_map = {
-                'gpt-4': 'gpt-4-turbo-preview',
-                'gpt-3.5': 'gpt-3.5-turbo'  # FIXED: Correct model name
-            }
-            
-            response = client.chat.completions.create(
-                model=model_map[model_id],
-                messages=[{
-                    "role": "user",
-                    "content": f"Generate clean, production-ready code for: {prompt}\n\nProvide the code and a brief explanation."
-                }],
-                max_tokens=2000
-            )
-            
-            content = response.choices[0].message.content
-            
-            if "```" in content:
-                parts = content.split("```")
-                code = parts[1].strip()
-                if code.startswith(('python', 'javascript', 'java', 'cpp', 'c++')):
-                    code = '\n'.join(code.split('\n')[1:])
-                explanation = parts[2] if len(parts) > 2 else "Code generated successfully with OpenAI"
-            else:
-                code = content
-                explanation = "Code generated successfully with OpenAI"
-            
-            return {'code': code, 'explanation': explanation}
-        except Exception as e:
-            print(f"OpenAI error: {e}")
-            print(f"Make sure OPENAI_API_KEY is set in .env file")
-    
-    # Fallback - Demo response
+    system = None
+    messages = []
+    if context:
+        if context['summary']:
+            system = [{"type": "text", "text": context['summary'], "cache_control": CACHE_POINT}]
+        for user, assistant in context['turns']:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        if messages:
+            messages[-1]['content'] = [{"type": "text", "text": messages[-1]['content'], "cache_control": CACHE_POINT}]
+    messages.append({"role": "user", "content": user_text(prompt, context['attachments'] if context else ())})
+    return system, messages
+
+def openai_messages(system, messages):
+    """The same conversation for OpenAI, which caches identical prefixes by itself"""
+    out = [{"role": "system", "content": system[0]['text']}] if system else []
+    for message in messages:
+        content = message['content']
+        if isinstance(content, list):
+            content = ''.join(block['text'] for block in content)
+        out.append({"role": message['role'], "content": content})
+    return out
+
+def anthropic_request(prompt, model_id, context):
+    system, messages = build_messages(prompt, context)
+    request = {'model': ANTHROPIC_MODELS[model_id], 'max_tokens': 2000, 'messages': messages}
+    if system:
+        request['system'] = system
+    return request
+
+def openai_request(prompt, model_id, context):
+    request = {
+        'model': OPENAI_MODELS[model_id],
+        'messages': openai_messages(*build_messages(prompt, context)),
+        'max_tokens': 2000
+    }
+    if context and context.get('conversation_id'):
+        # Routes a conversation's requests to the same prompt cache
+        request['extra_body'] = {'prompt_cache_key': context['conversation_id']}
+    return request
+
+DEMO_EXPLANATION = 'This is a demo response. Add ANTHROPIC_API_KEY or OPENAI_API_KEY to your .env file to enable real AI code generation.'
+
+def demo_response(prompt):
     return {
         'code': f'''# Code for: {prompt}
 
@@ -102,5 +100,194 @@ def main():
 if __name__ == "__main__":
     main()
 ''',
-        'explanation': 'This is a demo response. Add ANTHROPIC_API_KEY or OPENAI_API_KEY to your .env file to enable real AI code generation.'
+        'explanation': DEMO_EXPLANATION,
+        'demo': True
     }
+
+def is_demo(result):
+    """True for the placeholder reply, which must never be cached"""
+    return result.get('demo') or result.get('explanation', '').strip() == DEMO_EXPLANATION
+
+# ============================================
+# PROVIDER CALLS (raise on failure)
+# ============================================
+
+def record_usage(provider, tokens_in, tokens_out, cache_read=0, cache_write=0):
+    provider_tokens.inc(provider, 'in', amount=tokens_in or 0)
+    provider_tokens.inc(provider, 'out', amount=tokens_out or 0)
+    provider_tokens.inc(provider, 'cache_read', amount=cache_read or 0)
+    provider_tokens.inc(provider, 'cache_write', amount=cache_write or 0)
+
+def record_anthropic_usage(usage):
+    # input_tokens excludes the cached part of the prompt
+    record_usage('anthropic', usage.input_tokens, usage.output_tokens,
+                 getattr(usage, 'cache_read_input_tokens', 0), getattr(usage, 'cache_creation_input_tokens', 0))
+
+def record_openai_usage(usage):
+    # prompt_tokens includes the cached part of the prompt
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', 0) or 0
+    record_usage('openai', usage.prompt_tokens - cached, usage.completion_tokens, cached)
+
+def _call_anthropic(prompt, model_id, context=None):
+    client = get_client('anthropic')
+    response = client.messages.create(**anthropic_request(prompt, model_id, context))
+    record_anthropic_usage(response.usage)
+    return parse_response(response.content[0].text)
+
+def _call_openai(prompt, model_id, context=None):
+    client = get_client('openai')
+    response = client.chat.completions.create(**openai_request(prompt, model_id, context))
+    if response.usage:
+        record_openai_usage(response.usage)
+    return parse_response(response.choices[0].message.content, "Code generated successfully with OpenAI")
+
+def _stream_anthropic(prompt, model_id, context=None):
+    client = get_client('anthropic')
+    with client.messages.stream(**anthropic_request(prompt, model_id, context)) as stream:
+        for text in stream.text_stream:
+            yield text
+        record_anthropic_usage(stream.get_final_message().usage)
+
+def _stream_openai(prompt, model_id, context=None):
+    client = get_client('openai')
+    stream = client.chat.completions.create(**openai_request(prompt, model_id, context), stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+PROVIDER_CALLS = {
+    'anthropic': _call_anthropic,
+    'openai': _call_openai
+}
+
+PROVIDER_STREAMS = {
+    'anthropic': _stream_anthropic,
+    'openai': _stream_openai
+}
+
+
+def use_stub_providers(latency=0.1, jitter=0.0, fail_rate=0.0, providers=('anthropic', 'openai')):
+    """
+    Replace real providers with local stubs (tests, benchmarks, offline dev).
+    Each call sleeps latency +/- jitter seconds and fails with probability fail_rate.
+    """
+    def reply(prompt, model_id, context):
+        time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+        if random.random() < fail_rate:
+            raise RuntimeError(f'stub provider failure for {model_id}')
+        turns = len(context['turns']) if context else 0
+        files = len(context['attachments']) if context else 0
+        return f"```python\n# {model_id}: {prompt}\nprint('stub')\n```\nStub reply for {prompt} after {turns} prior turns, with {files} files."
+
+    def call(prompt, model_id, context=None):
+        return parse_response(reply(prompt, model_id, context))
+
+    def stream(prompt, model_id, context=None):
+        text = reply(prompt, model_id, context)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
+    for provider in providers:
+        PROVIDER_CALLS[provider] = call
+        PROVIDER_STREAMS[provider] = stream
+
+if os.getenv('AI_STUB_PROVIDERS') == '1':
+    use_stub_providers(
+        latency=float(os.getenv('AI_STUB_LATENCY_MS', 100)) / 1000,
+        jitter=float(os.getenv('AI_STUB_JITTER_MS', 0)) / 1000,
+        fail_rate=float(os.getenv('AI_STUB_FAIL_RATE', 0))
+    )
+
+
+def failover_chain(model_id, allowed=None):
+    """The requested model followed by its configured fallbacks, limited to `allowed` (None: any model)"""
+    chain = [model_id] + [m for m in FAILOVER.get(model_id, []) if allowed is None or m in allowed]
+    return [m for m in dict.fromkeys(chain) if m in MODEL_PROVIDERS]
+
+def _call_model(prompt, model_id, context):
+    """One provider call, with the model that answered recorded in the result"""
+    result = PROVIDER_CALLS[MODEL_PROVIDERS[model_id]](prompt, model_id, context)
+    return {**result, 'model_used': model_id}
+
+# ============================================
+# PUBLIC API
+# ============================================
+
+def generate_with_ai(prompt, model_id, context=None, fallback=True, allowed=None):
+    """
+    Generate code using AI models.
+    context (from conversation.build_context) carries the prior turns of a
+    conversation. Walks the failover chain (skipping providers with an open
+    circuit, hedging slow calls if AI_HEDGE=1) and falls back to the demo
+    response, or raises the last error if fallback is False. Fallbacks outside
+    `allowed` (the models the user's plan includes) are never tried.
+    The result's 'model_used' is the model that answered, which after a
+    failover or hedge is not the requested one (the demo response has none).
+    """
+    candidates = [(MODEL_PROVIDERS[m], _call_model, (prompt, m, context)) for m in failover_chain(model_id, allowed)]
+    if candidates:
+        try:
+            return call_with_failover(candidates)
+        except Exception as e:
+            if not fallback:
+                raise
+            print(f"AI provider error: {e}")
+            print("Make sure ANTHROPIC_API_KEY / OPENAI_API_KEY are set in .env file")
+    
+    # Fallback - Demo response
+    return demo_response(prompt)
+
+
+def stream_with_ai(prompt, model_id, context=None, served=None, allowed=None):
+    """
+    Stream a generation as text deltas.
+    Yields str chunks. Fails over to the next model in the chain if a provider
+    errors (or ends the stream) before sending anything; falls back to the demo
+    response in a single chunk if every provider fails. An error after the
+    first chunk is re-raised, since the reply can't be resumed elsewhere. If
+    `served` (a dict) is given, served['model'] is set to the model whose text
+    is being streamed. `allowed` limits the fallbacks as in generate_with_ai.
+    """
+    for candidate in failover_chain(model_id, allowed):
+        provider = MODEL_PROVIDERS[candidate]
+        h = health(provider)
+        if not h.breaker.allow():
+            provider_requests.inc(provider, 'stream', 'rejected')
+            continue
+        
+        h.calls += 1
+        start = time.monotonic()
+        sent = False
+        try:
+            for text in PROVIDER_STREAMS[provider](prompt, candidate, context):
+                if not sent and served is not None:
+                    served['model'] = candidate
+                sent = True
+                yield text
+            if not sent:
+                raise ValueError('empty reply')
+        except GeneratorExit:
+            # Client went away; the provider itself was fine
+            h.breaker.record_success()
+            provider_requests.inc(provider, 'stream', 'cancelled')
+            raise
+        except Exception as e:
+            print(f"{provider} stream error: {e}")
+            h.errors += 1
+            h.breaker.record_failure()
+            provider_requests.inc(provider, 'stream', 'error')
+            if sent:
+                raise
+            continue
+        
+        elapsed = time.monotonic() - start
+        h.latency.record(elapsed)
+        h.breaker.record_success()
+        provider_seconds.observe(provider, 'stream', value=elapsed)
+        provider_requests.inc(provider, 'stream', 'ok')
+        return
+    
+    # Fallback - Demo response as a single fenced block
+    demo = demo_response(prompt)
+    yield f"```python\n{demo['code']}```\n{demo['explanation']}"
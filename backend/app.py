@@ -3,66 +3,194 @@ GlobalAssist - Simple Backend with JSON File Storage
 Fixed: OpenAI integration + OAuth (Google & GitHub)
 """
 
-from flask import Flask, request, jsonify, redirect
+from flask import Flask, Response, request, jsonify, redirect, g, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
+import gzip
+import hashlib
 import json
 import os
 from datetime import datetime, timedelta
 import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import requests
+import atexit
+
+from ai_generator import PROMPT_VERSION, generate_with_ai, is_demo, stream_with_ai
+from cache import GenerationCache, cache_key
+from conversation import build_context, has_context, new_conversation_id
+from dispatcher import Overloaded, dispatcher
+from history_record import HistoryRecord
+from jobs import JobFailed, JobQueue
+from metrics import registry
+from passwords import HashingBusy, hasher
+from providers import preload as preload_providers, warm_up
+from quota import QuotaExceeded, QuotaManager
+from response_parser import ResponseParser
+from resilience import health_stats
+from search import SearchIndex
+from storage import SCHEMA_VERSION, DuplicateKey, JournaledTable, Table, VersionCounter, migrate, writer
+from tokens import decode_access_token, denylist, issue_access_token, revoke_access_token, session_id
+from uploads import MAX_FILES, UploadStore, file_kind
 
 load_dotenv()
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
+app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    # Never sign tokens with a published default. A random key works (gunicorn
+    # forks its workers after this), but access tokens stop verifying on
+    # restart and clients go through /api/auth/refresh.
+    print("FLASK_SECRET_KEY is not set; using a random key for this run")
+    app.config['SECRET_KEY'] = secrets.token_urlsafe(32)
 
 # Enable CORS
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "http://localhost:3000"]}})
+CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "http://localhost:3000"]}},
+     expose_headers=['ETag', 'Retry-After'])
 
 # JSON Files for storage
 DATA_DIR = 'data'
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 HISTORY_FILE = os.path.join(DATA_DIR, 'history.json')
 SESSIONS_FILE = os.path.join(DATA_DIR, 'sessions.json')
+QUOTAS_FILE = os.path.join(DATA_DIR, 'quotas.json')
+DENYLIST_FILE = os.path.join(DATA_DIR, 'denylist.log')
+JOBS_FILE = os.path.join(DATA_DIR, 'jobs.json')
+UPLOADS_FILE = os.path.join(DATA_DIR, 'uploads.json')
+UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')
+
+# Set by gunicorn.conf.py: this process only loads the app, workers are forked from it
+PREFORK = os.getenv('GLOBALASSIST_PREFORK') == '1'
 
 # Create data directory
 os.makedirs(DATA_DIR, exist_ok=True)
 
-# Initialize JSON files if they don't exist
+# Initialize JSON files if they don't exist, and migrate legacy list files
 def init_files():
-    for file in [USERS_FILE, HISTORY_FILE, SESSIONS_FILE]:
+    for file in [USERS_FILE, HISTORY_FILE, SESSIONS_FILE, UPLOADS_FILE, JOBS_FILE]:
         if not os.path.exists(file):
             with open(file, 'w') as f:
-                json.dump([], f)
+                json.dump({'schema': SCHEMA_VERSION, 'next_id': 1, 'records': []}, f)
+        elif migrate(file):
+            print(f"Migrated {file} to indexed storage")
 
 init_files()
 
-# Helper functions
-def read_json(filename):
-    with open(filename, 'r') as f:
-        return json.load(f)
+# Indexed tables (loaded once, kept in memory)
+users_table = Table(USERS_FILE, unique=('email',))
+sessions_table = Table(SESSIONS_FILE, key='token', unique=('sid',), multi=('user_id',))
+history_table = JournaledTable(HISTORY_FILE, multi=('user_id', 'conversation_id'),
+                               fsync=os.getenv('HISTORY_FSYNC') == '1', record_type=HistoryRecord)
+
+uploads_table = Table(UPLOADS_FILE, multi=('user_id', 'sha256'))
+jobs_table = JournaledTable(JOBS_FILE, multi=('user_id', 'status'))
+
+# Uploaded files by content hash, with their extracted text
+upload_store = UploadStore(UPLOADS_DIR)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=upload_store.after_fork)
 
-def write_json(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+# Full-text index over history, kept in sync with every history change
+search_index = SearchIndex()
+history_table.on_change(search_index.handle)
 
+# Bumped on every change to a user's history; drives the history ETags
+history_versions = VersionCounter('user_id')
+history_table.on_change(history_versions.handle)
+
+# Per-user rate limits and monthly message quotas, checked in memory
+quotas = QuotaManager(QUOTAS_FILE)
+atexit.register(quotas.save)
+
+# Revoked access tokens, shared by every worker through one append-only file
+denylist.attach(DENYLIST_FILE)
+
+# Helper functions
 def get_user_by_email(email):
-    users = read_json(USERS_FILE)
-    return next((u for u in users if u['email'] == email), None)
+    return users_table.find('email', email)
 
 def get_user_by_id(user_id):
-    users = read_json(USERS_FILE)
-    return next((u for u in users if u['id'] == user_id), None)
+    return users_table.get(user_id)
 
-def verify_token(token):
-    sessions = read_json(SESSIONS_FILE)
-    session = next((s for s in sessions if s['token'] == token), None)
+def create_session(user_id):
+    """Store a long-lived refresh session and return its token"""
+    token = secrets.token_urlsafe(32)
+    sessions_table.insert({
+        'user_id': user_id,
+        'token': token,
+        'sid': session_id(token),
+        'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat()
+    })
+    return token
+
+def issue_tokens(user_id):
+    """Return (access_token, refresh_token) for a fresh login"""
+    refresh_token = create_session(user_id)
+    access_token = issue_access_token(user_id, app.config['SECRET_KEY'], sid=session_id(refresh_token))
+    return access_token, refresh_token
+
+def verify_session(token):
+    session = sessions_table.get(token)
     if session and datetime.fromisoformat(session['expires_at']) > datetime.utcnow():
-        return session['user_id']
+        return session
     return None
 
+def verify_token(token):
+    """Verify a signed access token in memory - no storage read"""
+    payload = decode_access_token(token, app.config['SECRET_KEY'])
+    if payload:
+        g.token_payload = payload
+        return payload['sub']
+    return None
+
+# Background sweep of expired sessions and denylist entries
+SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 600))
+
+def sweep_expired():
+    now = datetime.utcnow()
+    removed = sessions_table.delete_where(lambda s: datetime.fromisoformat(s['expires_at']) <= now)
+    denylist.prune()
+    job_queue.prune()
+    return removed
+
+def _sweeper():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            sweep_expired()
+        except Exception as e:
+            print(f"Session sweep error: {e}")
+
+def start_background_tasks():
+    """
+    Everything that owns threads, child processes or sockets. Runs at import,
+    or in each worker right after the fork when a prefork server preloads the app.
+    """
+    # Fork the password hashing and text extraction workers before any background threads exist
+    hasher.start()
+    upload_store.start()
+    
+    history_table.start_compactor(
+        interval=int(os.getenv('HISTORY_COMPACT_INTERVAL', 300)),
+        min_ops=int(os.getenv('HISTORY_COMPACT_MIN_OPS', 1000))
+    )
+    jobs_table.start_compactor()
+    quotas.start_persistence(interval=int(os.getenv('QUOTA_SAVE_INTERVAL', 30)))
+    job_queue.start()
+    threading.Thread(target=_sweeper, name='session-sweeper', daemon=True).start()
+    
+    # Build provider clients and open their connection pools before the first request
+    if os.getenv('AI_WARM_UP', '1') == '1':
+        threading.Thread(target=warm_up, name='provider-warm-up', daemon=True).start()
+
+def shutdown():
+    """Drain on worker exit: flush queued writes and merge quota counters"""
+    writer.close()
+    quotas.save()
+
 def require_auth(f):
     def wrapper(*args, **kwargs):
         auth_header = request.headers.get('Authorization')
@@ -78,10 +206,49 @@ def require_auth(f):
     wrapper.__name__ = f.__name__
     return wrapper
 
+# Conditional GET: responses carry an ETag, and a matching If-None-Match gets
+# an empty 304. Bodies above GZIP_MIN_BYTES are gzipped for clients that accept it.
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', 1024))
+
+def precompute_json(data):
+    """Serialize a static payload once: (body, gzipped body, etag)"""
+    body = json.dumps(data, separators=(',', ':')).encode()
+    return body, gzip.compress(body), hashlib.sha256(body).hexdigest()[:16]
+
+def not_modified(etag, cache_control):
+    """304 response if the client already has this version, else None"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept-Encoding')
+        return response
+    return None
+
+def etag_response(body, etag, cache_control, gzipped=None):
+    response = not_modified(etag, cache_control)
+    if response is not None:
+        return response
+    
+    response = Response(body, mimetype='application/json')
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+        response.set_data(gzipped or gzip.compress(body, 5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
 # ============================================
 # AUTHENTICATION ROUTES
 # ============================================
 
+def busy_response(error):
+    return jsonify({
+        'error': 'Server is busy, please retry shortly',
+        'retry_after': error.retry_after
+    }), 503, {'Retry-After': str(error.retry_after)}
+
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.json
@@ -96,34 +263,33 @@ def register():
     if get_user_by_email(email):
         return jsonify({'error': 'Email already registered'}), 400
     
+    try:
+        password_hash = hasher.hash(password)
+    except HashingBusy as e:
+        return busy_response(e)
+    
     # Create user
-    users = read_json(USERS_FILE)
     user = {
-        'id': len(users) + 1,
         'email': email,
-        'password_hash': generate_password_hash(password),
+        'password_hash': password_hash,
         'full_name': full_name,
         'subscription_tier': 'free',
         'subscription_status': 'active',
         'created_at': datetime.utcnow().isoformat()
     }
-    users.append(user)
-    write_json(USERS_FILE, users)
+    try:
+        users_table.insert(user)
+    except DuplicateKey:
+        # Registered by a concurrent request while we were hashing
+        return jsonify({'error': 'Email already registered'}), 400
     
     # Create session
-    token = secrets.token_urlsafe(32)
-    sessions = read_json(SESSIONS_FILE)
-    sessions.append({
-        'user_id': user['id'],
-        'token': token,
-        'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat()
-    })
-    write_json(SESSIONS_FILE, sessions)
+    access_token, refresh_token = issue_tokens(user['id'])
     
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
     return jsonify({
-        'access_token': token,
-        'refresh_token': token,
+        'access_token': access_token,
+        'refresh_token': refresh_token,
         'user': user_data
     }), 201
 
@@ -137,26 +303,57 @@ def login():
         return jsonify({'error': 'Email and password required'}), 400
     
     user = get_user_by_email(email)
-    if not user or not check_password_hash(user['password_hash'], password):
+    if not user:
         return jsonify({'error': 'Invalid email or password'}), 401
     
+    try:
+        valid, new_hash = hasher.verify(user['password_hash'], password)
+    except HashingBusy as e:
+        return busy_response(e)
+    if not valid:
+        return jsonify({'error': 'Invalid email or password'}), 401
+    
+    # Hash parameters changed since this password was stored: upgrade it now
+    if new_hash:
+        users_table.update(user['id'], password_hash=new_hash)
+    
     # Create session
-    token = secrets.token_urlsafe(32)
-    sessions = read_json(SESSIONS_FILE)
-    sessions.append({
-        'user_id': user['id'],
-        'token': token,
-        'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat()
-    })
-    write_json(SESSIONS_FILE, sessions)
+    access_token, refresh_token = issue_tokens(user['id'])
     
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
     return jsonify({
-        'access_token': token,
-        'refresh_token': token,
+        'access_token': access_token,
+        'refresh_token': refresh_token,
         'user': user_data
     }), 200
 
+@app.route('/api/auth/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token (the stored session) for a new access token"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    refresh_token = auth_header.split(' ')[1]
+    session = verify_session(refresh_token)
+    if not session:
+        return jsonify({'error': 'Invalid or expired refresh token'}), 401
+    
+    access_token = issue_access_token(session['user_id'], app.config['SECRET_KEY'], sid=session_id(refresh_token))
+    return jsonify({'access_token': access_token, 'refresh_token': refresh_token}), 200
+
+@app.route('/api/auth/logout', methods=['POST'])
+@require_auth
+def logout(user_id):
+    payload = g.token_payload
+    revoke_access_token(payload)
+    
+    session = sessions_table.find('sid', payload.get('sid'))
+    if session:
+        sessions_table.delete(session['token'])
+    
+    return jsonify({'message': 'Logged out'}), 200
+
 @app.route('/api/auth/me', methods=['GET'])
 @require_auth
 def get_me(user_id):
@@ -165,7 +362,7 @@ def get_me(user_id):
         return jsonify({'error': 'User not found'}), 404
     
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-    return jsonify({'user': user_data}), 200
+    return jsonify({'user': user_data, 'quota': quotas.usage(user_id, user['subscription_tier'])}), 200
 
 # ============================================
 # OAUTH ROUTES (Google & GitHub)
@@ -215,9 +412,7 @@ def google_callback():
         user = get_user_by_email(email)
         
         if not user:
-            users = read_json(USERS_FILE)
             user = {
-                'id': len(users) + 1,
                 'email': email,
                 'password_hash': '',
                 'full_name': user_info.get('name', ''),
@@ -226,21 +421,16 @@ def google_callback():
                 'oauth_provider': 'google',
                 'created_at': datetime.utcnow().isoformat()
             }
-            users.append(user)
-            write_json(USERS_FILE, users)
+            try:
+                users_table.insert(user)
+            except DuplicateKey:
+                user = get_user_by_email(user['email'])
         
         # Create session
-        token = secrets.token_urlsafe(32)
-        sessions = read_json(SESSIONS_FILE)
-        sessions.append({
-            'user_id': user['id'],
-            'token': token,
-            'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat()
-        })
-        write_json(SESSIONS_FILE, sessions)
+        access_token, refresh_token = issue_tokens(user['id'])
         
         # Redirect to frontend with token
-        return redirect(f'http://localhost:5173/auth-success?token={token}')
+        return redirect(f'http://localhost:5173/auth-success?token={access_token}&refresh_token={refresh_token}')
     
     except Exception as e:
         print(f'Google OAuth error: {e}')
@@ -295,9 +485,7 @@ def github_callback():
         user = get_user_by_email(primary_email)
         
         if not user:
-            users = read_json(USERS_FILE)
             user = {
-                'id': len(users) + 1,
                 'email': primary_email,
                 'password_hash': '',
                 'full_name': user_info.get('name', user_info.get('login', '')),
@@ -306,21 +494,16 @@ def github_callback():
                 'oauth_provider': 'github',
                 'created_at': datetime.utcnow().isoformat()
             }
-            users.append(user)
-            write_json(USERS_FILE, users)
+            try:
+                users_table.insert(user)
+            except DuplicateKey:
+                user = get_user_by_email(user['email'])
         
         # Create session
-        token = secrets.token_urlsafe(32)
-        sessions = read_json(SESSIONS_FILE)
-        sessions.append({
-            'user_id': user['id'],
-            'token': token,
-            'expires_at': (datetime.utcnow() + timedelta(days=30)).isoformat()
-        })
-        write_json(SESSIONS_FILE, sessions)
+        access_token, refresh_token = issue_tokens(user['id'])
         
         # Redirect to frontend with token
-        return redirect(f'http://localhost:5173/auth-success?token={token}')
+        return redirect(f'http://localhost:5173/auth-success?token={access_token}&refresh_token={refresh_token}')
     
     except Exception as e:
         print(f'GitHub OAuth error: {e}')
@@ -330,17 +513,180 @@ def github_callback():
 # AI MODEL ROUTES
 # ============================================
 
+MODELS = [
+    {'id': 'kiwi-4.5', 'name': 'GlobalAssist 4.5', 'description': 'Fast and smart', 'tier': 'free', 'provider': 'anthropic'},
+    {'id': 'kiwi-opus', 'name': 'GlobalAssist Opus', 'description': 'Most intelligent', 'tier': 'pro', 'provider': 'anthropic'},
+    {'id': 'gpt-4', 'name': 'GPT-4 Turbo', 'description': 'OpenAI flagship', 'tier': 'pro', 'provider': 'openai'},
+    {'id': 'gpt-3.5', 'name': 'GPT-3.5 Turbo', 'description': 'Fast and efficient', 'tier': 'free', 'provider': 'openai'},
+    {'id': 'codellama', 'name': 'CodeLlama 34B', 'description': 'Open source', 'tier': 'free', 'provider': 'huggingface'},
+    {'id': 'gemini-pro', 'name': 'Gemini Pro', 'description': 'Google AI', 'tier': 'pro', 'provider': 'google'}
+]
+
+MODEL_PROVIDERS = {m['id']: m['provider'] for m in MODELS}
+
+MODELS_PAYLOAD = precompute_json({'models': MODELS})
+
 @app.route('/api/ai/models', methods=['GET'])
 def get_models():
-    models = [
-        {'id': 'kiwi-4.5', 'name': 'GlobalAssist 4.5', 'description': 'Fast and smart', 'tier': 'free', 'provider': 'anthropic'},
-        {'id': 'kiwi-opus', 'name': 'GlobalAssist Opus', 'description': 'Most intelligent', 'tier': 'pro', 'provider': 'anthropic'},
-        {'id': 'gpt-4', 'name': 'GPT-4 Turbo', 'description': 'OpenAI flagship', 'tier': 'pro', 'provider': 'openai'},
-        {'id': 'gpt-3.5', 'name': 'GPT-3.5 Turbo', 'description': 'Fast and efficient', 'tier': 'free', 'provider': 'openai'},
-        {'id': 'codellama', 'name': 'CodeLlama 34B', 'description': 'Open source', 'tier': 'free', 'provider': 'huggingface'},
-        {'id': 'gemini-pro', 'name': 'Gemini Pro', 'description': 'Google AI', 'tier': 'pro', 'provider': 'google'}
-    ]
-    return jsonify({'models': models}), 200
+    body, gzipped, etag = MODELS_PAYLOAD
+    return etag_response(body, etag, 'public, max-age=300', gzipped)
+
+PREMIUM_MODELS = ['kiwi-opus', 'gpt-4', 'gemini-pro']
+
+def allowed_models(user):
+    """Models the user's plan includes (None: all); failover never leaves this set"""
+    if user['subscription_tier'] == 'free':
+        return {m for m in MODEL_PROVIDERS if m not in PREMIUM_MODELS}
+    return None
+
+generation_cache = GenerationCache()
+
+def cache_bypassed(data):
+    """Clients skip the cache with {"cache": false} or Cache-Control: no-cache"""
+    return data.get('cache') is False or 'no-cache' in request.headers.get('Cache-Control', '')
+
+def build_history_entry(user_id, prompt, model_id, result, conversation_id=None, file_ids=None):
+    metadata = {'prompt': prompt, 'explanation': result.get('explanation', ''), 'language': result.get('language', '')}
+    if file_ids:
+        metadata['file_ids'] = file_ids
+    return {
+        'user_id': user_id,
+        'conversation_id': conversation_id or new_conversation_id(),
+        'type': 'chat',
+        'title': prompt[:100],
+        'content': result['code'],
+        'model_used': result.get('model_used', model_id),
+        'metadata': metadata,
+        'created_at': datetime.utcnow().isoformat()
+    }
+
+def save_history_entry(user_id, prompt, model_id, result, context=None):
+    """context: the request's context from request_context(), for its conversation and files"""
+    if context is None:
+        return history_table.insert(build_history_entry(user_id, prompt, model_id, result))
+    file_ids = [a['id'] for a in context['attachments']]
+    return history_table.insert(build_history_entry(user_id, prompt, model_id, result, context['conversation_id'], file_ids))
+
+def load_attachments(user_id, file_ids):
+    """The user's uploads with their extracted text, in order; unknown ids are skipped"""
+    attachments = []
+    for file_id in file_ids:
+        record = uploads_table.get(file_id)
+        if record is None or record['user_id'] != user_id:
+            continue
+        text = upload_store.text(record['sha256'], record['kind'])
+        attachments.append({
+            'id': record['id'],
+            'filename': record['filename'],
+            'sha256': record['sha256'],
+            'text': text if text is not None else '(No text could be extracted from this file)'
+        })
+    return attachments
+
+def entry_attachments(entry):
+    return load_attachments(entry['user_id'], (entry.get('metadata') or {}).get('file_ids', []))
+
+def conversation_context(user_id, conversation_id):
+    """
+    Prior turns for a follow-up (see conversation.py). None if the conversation
+    doesn't exist or isn't the user's; a fresh conversation has no context.
+    """
+    if conversation_id is None:
+        return build_context(new_conversation_id(), [])
+    if not isinstance(conversation_id, str):
+        return None
+    # Decompressed once each here; building the context reads every field
+    entries = [h.to_dict() for h in history_table.group('conversation_id', conversation_id) if h['user_id'] == user_id]
+    if not entries:
+        return None
+    return build_context(conversation_id, entries, attachments_for=entry_attachments)
+
+def request_context(user_id, data):
+    """
+    Earlier turns and attached files for a generate request.
+    Returns (context, None) or (None, error response).
+    """
+    context = conversation_context(user_id, data.get('conversation_id'))
+    if context is None:
+        return None, (jsonify({'error': 'Conversation not found'}), 404)
+    
+    file_ids = data.get('file_ids') or []
+    if not isinstance(file_ids, list) or not all(isinstance(i, int) for i in file_ids) or len(file_ids) > MAX_FILES:
+        return None, (jsonify({'error': f'file_ids must be a list of at most {MAX_FILES} upload ids'}), 400)
+    context['attachments'] = load_attachments(user_id, file_ids)
+    if len(context['attachments']) != len(file_ids):
+        return None, (jsonify({'error': 'File not found'}), 404)
+    return context, None
+
+def generation_key(model_id, prompt, context):
+    """Cache key for a prompt; attached files count by name and content hash"""
+    files = ''.join(f"\0{a['filename']}:{a['sha256']}" for a in context['attachments']) if context else ''
+    return cache_key(model_id, prompt + files, PROMPT_VERSION)
+
+def run_generation(prompt, model_id, bypass_cache=False, context=None, fallback=True, allowed=None):
+    """
+    Cache lookup, then a provider call under the dispatcher's limits, failing
+    over only to models in `allowed` (see allowed_models).
+    Returns (result, cached); raises Overloaded when the provider queue is full,
+    and provider errors instead of answering with the demo reply if fallback is False.
+    Follow-ups in a conversation depend on earlier turns and skip the cache.
+    """
+    # Serve identical prompts from the cache
+    follow_up = has_context(context)
+    key = generation_key(model_id, prompt, context)
+    result = None if bypass_cache or follow_up else generation_cache.get(key)
+    cached = result is not None
+    
+    # Generate code using ai_generator.py
+    if not cached:
+        try:
+            # Runs on the dispatcher loop under the requested provider's concurrency
+            # limit. A failover or hedge call to another provider runs inside that
+            # slot without taking one of its own (waiting for a second slot while
+            # holding the first could deadlock two saturated providers).
+            result = dispatcher.run(MODEL_PROVIDERS[model_id], generate_with_ai, prompt, model_id, context, fallback, allowed)
+            # Only answers from the requested model belong under its cache key
+            if not follow_up and not is_demo(result) and result.get('model_used') == model_id:
+                generation_cache.set(key, {k: result[k] for k in ('code', 'explanation', 'language', 'blocks') if k in result})
+        except Overloaded:
+            raise
+        except Exception as e:
+            if not fallback:
+                raise
+            print(f"AI generation error: {e}")
+            result = {
+                'code': f'''# Generated code for: {prompt}
+
+def main():
+    """
+    AI-generated code example
+    """
+    print("Hello from GlobalAssist!")
+    return True
+
+if __name__ == "__main__":
+    main()
+''',
+                'explanation': 'This is a demo response. Add your API keys to .env to enable AI code generation.'
+            }
+    
+    return result, cached
+
+def overloaded_response(error):
+    return jsonify({
+        'error': 'AI service is busy, please retry shortly',
+        'retry_after': error.retry_after
+    }), 503, {'Retry-After': str(error.retry_after)}
+
+def quota_response(error):
+    return jsonify({
+        'error': str(error),
+        'quota': error.info,
+        'retry_after': error.retry_after
+    }), 429, {'Retry-After': str(error.retry_after)}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.route('/api/ai/generate', methods=['POST'])
 @require_auth
@@ -353,68 +699,415 @@ def generate_code(user_id):
     if not prompt:
         return jsonify({'error': 'Prompt required'}), 400
     
+    if model_id not in MODEL_PROVIDERS:
+        return jsonify({'error': 'Unknown model'}), 400
+    
     # Check subscription for premium models
-    premium_models = ['kiwi-opus', 'gpt-4', 'gemini-pro']
-    if model_id in premium_models and user['subscription_tier'] == 'free':
+    if model_id in PREMIUM_MODELS and user['subscription_tier'] == 'free':
         return jsonify({'error': 'Upgrade to Pro to use this model', 'upgrade_required': True}), 403
     
-    # Generate code using ai_generator.py
+    context, error = request_context(user_id, data)
+    if error:
+        return error
+    
     try:
-        from ai_generator import generate_with_ai
-        result = generate_with_ai(prompt, model_id)
-    except Exception as e:
-        print(f"AI generation error: {e}")
-        result = {
-            'code': f'''# Generated code for: {prompt}
-
-def main():
-    """
-    AI-generated code example
-    """
-    print("Hello from GlobalAssist!")
-    return True
-
-if __name__ == "__main__":
-    main()
-''',
-            'explanation': 'This is a demo response. Add your API keys to .env to enable AI code generation.'
-        }
+        quota = quotas.acquire(user_id, user['subscription_tier'])
+    except QuotaExceeded as e:
+        return quota_response(e)
     
-    # Save to history
-    history = read_json(HISTORY_FILE)
-    history_entry = {
-        'id': len(history) + 1,
-        'user_id': user_id,
-        'type': 'chat',
-        'title': prompt[:100],
-        'content': result['code'],
-        'model_used': model_id,
-        'metadata': {'prompt': prompt, 'explanation': result.get('explanation', '')},
-        'created_at': datetime.utcnow().isoformat()
-    }
-    history.append(history_entry)
-    write_json(HISTORY_FILE, history)
+    if wants_job(data):
+        job = job_queue.enqueue(user_id, {
+            'prompt': prompt,
+            'model': model_id,
+            'conversation_id': context['conversation_id'],
+            'new_conversation': data.get('conversation_id') is None,
+            'file_ids': [a['id'] for a in context['attachments']],
+            'cache': not cache_bypassed(data)
+        })
+        return jsonify({'job': job_summary(job), 'quota': quota}), 202, {'Location': f"/api/ai/jobs/{job['id']}"}
+    
+    try:
+        result, cached = run_generation(prompt, model_id, bypass_cache=cache_bypassed(data), context=context,
+                                        allowed=allowed_models(user))
+    except Overloaded as e:
+        quotas.refund(user_id)
+        return overloaded_response(e)
+    
+    history_entry = save_history_entry(user_id, prompt, model_id, result, context)
     
     return jsonify({
         'success': True,
         'code': result['code'],
         'explanation': result.get('explanation', ''),
-        'model_used': model_id,
-        'history_id': history_entry['id']
+        'blocks': result.get('blocks', []),
+        'model_used': history_entry['model_used'],
+        'history_id': history_entry['id'],
+        'conversation_id': history_entry['conversation_id'],
+        'cached': cached,
+        'quota': quota
     }), 200
 
+# ----- background jobs -----
+
+JOB_MAX_WAIT = int(os.getenv('JOB_MAX_WAIT', 30))
+
+def wants_job(data):
+    """Clients ask for a job with {"job": true} or Prefer: respond-async"""
+    return data.get('job') is True or 'respond-async' in request.headers.get('Prefer', '')
+
+def job_summary(job):
+    return {k: job.get(k) for k in ('id', 'status', 'attempts', 'error', 'result', 'created_at', 'updated_at', 'finished_at')}
+
+def run_job(job, last_attempt):
+    """Same generation as /api/ai/generate; provider errors are retried, the last attempt may use the demo reply"""
+    data = job['request']
+    user_id = job['user_id']
+    user = get_user_by_id(user_id)
+    if user is None:
+        raise JobFailed('User not found')
+    if data['new_conversation']:
+        context = build_context(data['conversation_id'], [])
+    else:
+        context = conversation_context(user_id, data['conversation_id'])
+        if context is None:
+            raise JobFailed('Conversation not found')
+    context['attachments'] = load_attachments(user_id, data['file_ids'])
+    
+    result, cached = run_generation(data['prompt'], data['model'], bypass_cache=not data['cache'],
+                                    context=context, fallback=last_attempt, allowed=allowed_models(user))
+    return {'result': result, 'cached': cached, 'context': context}
+
+def commit_job(job, outcome):
+    """Write the history entry once the job is known not to be cancelled"""
+    data = job['request']
+    result = outcome['result']
+    history_entry = save_history_entry(job['user_id'], data['prompt'], data['model'], result, outcome['context'])
+    return {
+        'code': result['code'],
+        'explanation': result.get('explanation', ''),
+        'blocks': result.get('blocks', []),
+        'model_used': history_entry['model_used'],
+        'history_id': history_entry['id'],
+        'conversation_id': history_entry['conversation_id'],
+        'cached': outcome['cached']
+    }
+
+def finish_job(job):
+    if job['status'] != 'succeeded':
+        quotas.refund(job['user_id'])
+
+job_queue = JobQueue(jobs_table, run_job, commit=commit_job, on_finish=finish_job)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=job_queue.after_fork)
+
+@app.route('/api/ai/jobs/<int:job_id>', methods=['GET'])
+@require_auth
+def get_job(user_id, job_id):
+    """Job status; ?wait=N holds the request up to N seconds for the job to finish"""
+    job = jobs_table.get(job_id)
+    if not job or job['user_id'] != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    wait = min(max(request.args.get('wait', 0, type=float), 0), JOB_MAX_WAIT)
+    if wait:
+        job = job_queue.wait(job_id, wait)
+    return jsonify({'job': job_summary(job)}), 200
+
+@app.route('/api/ai/jobs/<int:job_id>', methods=['DELETE'])
+@require_auth
+def cancel_job(user_id, job_id):
+    job = jobs_table.get(job_id)
+    if not job or job['user_id'] != user_id:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job': job_summary(job_queue.cancel(job_id))}), 200
+
+BATCH_MAX_ITEMS = int(os.getenv('AI_BATCH_MAX_ITEMS', 500))
+BATCH_RETRIES = 3
+
+batch_pool = ThreadPoolExecutor(max_workers=int(os.getenv('AI_BATCH_WORKERS', 8)), thread_name_prefix='ai-batch')
+
+def run_batch_item(prompt, model_id, bypass_cache, allowed):
+    """Batch items wait out a full provider queue instead of failing straight away"""
+    for attempt in range(BATCH_RETRIES + 1):
+        try:
+            return run_generation(prompt, model_id, bypass_cache, allowed=allowed)
+        except Overloaded as e:
+            if attempt == BATCH_RETRIES:
+                raise
+            time.sleep(min(e.retry_after, 10))
+
+@app.route('/api/ai/generate/batch', methods=['POST'])
+@require_auth
+def generate_code_batch(user_id):
+    """
+    Run many prompts concurrently: {"items": [{"prompt": "...", "model": "gpt-3.5"}, ...],
+    "model": "<default model>"}. Returns one result per item, in order; failed
+    items carry an error instead of aborting the batch.
+    """
+    user = get_user_by_id(user_id)
+    data = request.json
+    items = data.get('items')
+    default_model = data.get('model', 'kiwi-4.5')
+    bypass_cache = cache_bypassed(data)
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+    
+    results = [None] * len(items)
+    futures = {}
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {'prompt': item}
+        prompt = item.get('prompt') if isinstance(item, dict) else None
+        model_id = item.get('model', default_model) if isinstance(item, dict) else default_model
+        
+        if not prompt:
+            results[index] = {'index': index, 'success': False, 'error': 'Prompt required'}
+        elif model_id not in MODEL_PROVIDERS:
+            results[index] = {'index': index, 'success': False, 'error': 'Unknown model'}
+        elif model_id in PREMIUM_MODELS and user['subscription_tier'] == 'free':
+            results[index] = {'index': index, 'success': False, 'error': 'Upgrade to Pro to use this model', 'upgrade_required': True}
+        else:
+            futures[index] = (prompt, model_id)
+    
+    # Every runnable item counts as one message against the monthly quota
+    if futures:
+        try:
+            quota = quotas.acquire(user_id, user['subscription_tier'], count=len(futures))
+        except QuotaExceeded as e:
+            return quota_response(e)
+    else:
+        quota = quotas.usage(user_id, user['subscription_tier'])
+    
+    allowed = allowed_models(user)
+    for index, (prompt, model_id) in futures.items():
+        futures[index] = (prompt, model_id, batch_pool.submit(run_batch_item, prompt, model_id, bypass_cache, allowed))
+    
+    entries = []
+    for index, (prompt, model_id, future) in futures.items():
+        try:
+            result, cached = future.result()
+        except Overloaded as e:
+            quotas.refund(user_id)
+            results[index] = {'index': index, 'success': False, 'error': 'AI service is busy', 'retry_after': e.retry_after}
+            continue
+        except Exception as e:
+            print(f"Batch item error: {e}")
+            quotas.refund(user_id)
+            results[index] = {'index': index, 'success': False, 'error': 'Generation failed'}
+            continue
+        
+        entries.append((index, build_history_entry(user_id, prompt, model_id, result)))
+        results[index] = {
+            'index': index,
+            'success': True,
+            'code': result['code'],
+            'explanation': result.get('explanation', ''),
+            'blocks': result.get('blocks', []),
+            'model_used': result.get('model_used', model_id),
+            'cached': cached
+        }
+    
+    # All history entries land in one storage commit
+    history_table.insert_many([entry for _, entry in entries])
+    for index, entry in entries:
+        results[index]['history_id'] = entry['id']
+        results[index]['conversation_id'] = entry['conversation_id']
+    
+    succeeded = sum(1 for r in results if r['success'])
+    quota = quotas.usage(user_id, user['subscription_tier'])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded, 'quota': quota}), 200
+
+@app.route('/api/ai/generate/stream', methods=['POST'])
+@require_auth
+def generate_code_stream(user_id):
+    """Same as /api/ai/generate, but streams text deltas as Server-Sent Events"""
+    user = get_user_by_id(user_id)
+    data = request.json
+    prompt = data.get('prompt')
+    model_id = data.get('model', 'kiwi-4.5')
+    
+    if not prompt:
+        return jsonify({'error': 'Prompt required'}), 400
+    
+    if model_id not in MODEL_PROVIDERS:
+        return jsonify({'error': 'Unknown model'}), 400
+    
+    if model_id in PREMIUM_MODELS and user['subscription_tier'] == 'free':
+        return jsonify({'error': 'Upgrade to Pro to use this model', 'upgrade_required': True}), 403
+    
+    context, error = request_context(user_id, data)
+    if error:
+        return error
+    conversation_id = context['conversation_id']
+    
+    try:
+        quota = quotas.acquire(user_id, user['subscription_tier'])
+    except QuotaExceeded as e:
+        return quota_response(e)
+    
+    follow_up = has_context(context)
+    key = generation_key(model_id, prompt, context)
+    cached = None if cache_bypassed(data) or follow_up else generation_cache.get(key)
+    
+    def cached_events():
+        history_entry = save_history_entry(user_id, prompt, model_id, cached, context)
+        yield sse_event('delta', {'text': cached['code']})
+        yield sse_event('done', {
+            **cached,
+            'model_used': model_id,
+            'history_id': history_entry['id'],
+            'conversation_id': conversation_id,
+            'cached': True,
+            'quota': quota
+        })
+    
+    def events():
+        parser = ResponseParser()
+        served = {}
+        received = False
+        finished = False
+        history_entry = None
+        try:
+            for text in stream_with_ai(prompt, model_id, context, served, allowed_models(user)):
+                received = True
+                # Parsed as it arrives; the final result needs no second pass
+                parser.feed(text)
+                yield sse_event('delta', {'text': text})
+            finished = received
+        except Exception as e:
+            print(f"AI stream error: {e}")
+        finally:
+            # Persist on completion, on error and when the client disconnects
+            if received:
+                result = parser.close()
+                if not finished:
+                    result['explanation'] = (result['explanation'] + '\n\n(Generation was interrupted)').strip()
+                if 'model' in served:
+                    result['model_used'] = served['model']
+                history_entry = save_history_entry(user_id, prompt, model_id, result, context)
+                if finished and not follow_up and not is_demo(result) and served.get('model') == model_id:
+                    generation_cache.set(key, result)
+        
+        if not finished:
+            # A failed or empty generation doesn't count against the quota
+            quotas.refund(user_id)
+            yield sse_event('error', {'error': 'Generation failed'})
+            return
+        
+        yield sse_event('done', {
+            'code': result['code'],
+            'explanation': result.get('explanation', ''),
+            'blocks': result.get('blocks', []),
+            'model_used': history_entry['model_used'],
+            'history_id': history_entry['id'],
+            'conversation_id': conversation_id,
+            'cached': False,
+            'quota': quota
+        })
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if cached:
+        return Response(stream_with_context(cached_events()), mimetype='text/event-stream', headers=headers)
+    
+    try:
+        release = dispatcher.acquire(MODEL_PROVIDERS[model_id])
+    except Overloaded as e:
+        quotas.refund(user_id)
+        return overloaded_response(e)
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+    response.call_on_close(release)
+    return response
+
+# ============================================
+# UPLOAD ROUTES
+# ============================================
+
+def upload_summary(record):
+    return {**record, 'text_status': upload_store.text_status(record['sha256'], record['kind'])}
+
+@app.route('/api/uploads', methods=['POST'])
+@require_auth
+def upload_files(user_id):
+    """
+    multipart/form-data with one or more files. Each file is streamed to disk;
+    content already stored is kept once, and re-uploading returns the same id.
+    Pass the ids as "file_ids" to /api/ai/generate.
+    """
+    if request.mimetype != 'multipart/form-data':
+        return jsonify({'error': 'Expected multipart/form-data'}), 400
+    
+    try:
+        stored = upload_store.receive(request.environ)
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
+    
+    if not stored:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    records = []
+    new_records = []
+    for filename, content_type, size, digest in stored:
+        existing = next((u for u in uploads_table.group('sha256', digest)
+                         if u['user_id'] == user_id and u['filename'] == filename), None)
+        if existing is None:
+            existing = {
+                'user_id': user_id,
+                'filename': filename,
+                'content_type': content_type,
+                'kind': file_kind(filename, content_type),
+                'size': size,
+                'sha256': digest,
+                'created_at': datetime.utcnow().isoformat()
+            }
+            new_records.append(existing)
+        records.append(existing)
+    uploads_table.insert_many(new_records)
+    
+    # Start reading the text now, so it's ready by the time the prompt is sent
+    for record in records:
+        upload_store.extract(record['sha256'], record['kind'])
+    
+    return jsonify({'files': [upload_summary(r) for r in records]}), 201
+
+@app.route('/api/uploads/<int:upload_id>', methods=['GET'])
+@require_auth
+def get_upload(user_id, upload_id):
+    record = uploads_table.get(upload_id)
+    if not record or record['user_id'] != user_id:
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify({'file': upload_summary(record)}), 200
+
+@app.route('/api/uploads/<int:upload_id>', methods=['DELETE'])
+@require_auth
+def delete_upload(user_id, upload_id):
+    record = uploads_table.get(upload_id)
+    if record and record['user_id'] == user_id:
+        uploads_table.delete(upload_id)
+        # The content is shared by everyone who uploaded it
+        if not uploads_table.count('sha256', record['sha256']):
+            upload_store.remove(record['sha256'])
+    return jsonify({'message': 'File deleted'}), 200
+
 # ============================================
 # PAYMENT ROUTES
 # ============================================
 
+PLANS = [
+    {'id': 'free', 'name': 'Free', 'price': 0, 'billing': 'forever', 'features': ['50 messages/month', 'Basic models', '30-day history']},
+    {'id': 'pro_monthly', 'name': 'Pro Monthly', 'price': 19, 'billing': 'monthly', 'features': ['1,000 messages/month', 'All models', 'Unlimited history']},
+    {'id': 'pro_yearly', 'name': 'Pro Yearly', 'price': 190, 'billing': 'yearly', 'savings': 'Save $38!', 'features': ['1,000 messages/month', 'All models', 'Unlimited history']}
+]
+
+PLANS_PAYLOAD = precompute_json({'plans': PLANS})
+
 @app.route('/api/payment/plans', methods=['GET'])
 def get_plans():
-    plans = [
-        {'id': 'free', 'name': 'Free', 'price': 0, 'billing': 'forever', 'features': ['50 messages/month', 'Basic models', '30-day history']},
-        {'id': 'pro_monthly', 'name': 'Pro Monthly', 'price': 19, 'billing': 'monthly', 'features': ['1,000 messages/month', 'All models', 'Unlimited history']},
-        {'id': 'pro_yearly', 'name': 'Pro Yearly', 'price': 190, 'billing': 'yearly', 'savings': 'Save $38!', 'features': ['1,000 messages/month', 'All models', 'Unlimited history']}
-    ]
-    return jsonify({'plans': plans}), 200
+    body, gzipped, etag = PLANS_PAYLOAD
+    return etag_response(body, etag, 'public, max-age=300', gzipped)
 
 @app.route('/api/payment/create-checkout', methods=['POST'])
 @require_auth
@@ -425,23 +1118,108 @@ def create_checkout(user_id):
 # HISTORY ROUTES
 # ============================================
 
+MAX_PAGE_SIZE = 100
+
+HISTORY_CACHE_CONTROL = 'private, no-cache'
+
+def history_etag(user_id):
+    """Changes whenever the user's history or the query does, without reading the history"""
+    history_table.refresh()
+    raw = f'{user_id}:{history_versions.version(user_id)}:{request.full_path}'
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+def history_summary(entry):
+    """List projection: everything except the generated content and metadata (never decompressed)"""
+    summary = {k: entry[k] for k in entry.keys() if k not in ('content', 'metadata')}
+    summary['preview'] = entry.preview
+    return summary
+
 @app.route('/api/history/<history_type>', methods=['GET'])
 @require_auth
 def get_history(user_id, history_type):
-    history = read_json(HISTORY_FILE)
-    user_history = [h for h in history if h['user_id'] == user_id]
+    """
+    Newest first. Pass ?cursor=<next_cursor> for the next page
+    (?page=N is also accepted for simple clients). Polling clients send
+    If-None-Match and get a 304 until the history changes.
+    """
+    etag = history_etag(user_id)
+    unchanged = not_modified(etag, HISTORY_CACHE_CONTROL)
+    if unchanged is not None:
+        return unchanged
     
-    if history_type != 'all':
-        user_history = [h for h in user_history if h['type'] == history_type]
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor', type=int)
+    page = request.args.get('page', 1, type=int)
     
-    return jsonify({'history': user_history, 'total': len(user_history)}), 200
+    where = None if history_type == 'all' else (lambda h: h['type'] == history_type)
+    
+    if cursor is None and page > 1:
+        # Offset pages still only walk this user's index
+        skipped, cursor = history_table.page('user_id', user_id, limit=(page - 1) * per_page, where=where)
+        if cursor is None:
+            body = json.dumps({'history': [], 'total': len(skipped), 'next_cursor': None}).encode()
+            return etag_response(body, etag, HISTORY_CACHE_CONTROL)
+    
+    entries, next_cursor = history_table.page('user_id', user_id, before=cursor, limit=per_page, where=where)
+    
+    if where is None:
+        total = history_table.count('user_id', user_id)
+    else:
+        total = sum(1 for h in history_table.group('user_id', user_id) if where(h))
+    
+    body = json.dumps({
+        'history': [history_summary(h) for h in entries],
+        'total': total,
+        'next_cursor': next_cursor
+    }, separators=(',', ':')).encode()
+    return etag_response(body, etag, HISTORY_CACHE_CONTROL)
+
+@app.route('/api/history/search', methods=['GET'])
+@require_auth
+def search_history(user_id):
+    """Ranked full-text search over the caller's history: ?q=&page=&per_page="""
+    query = request.args.get('q', '').strip()
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_PAGE_SIZE)
+    page = max(request.args.get('page', 1, type=int), 1)
+    
+    if not query:
+        return jsonify({'error': 'Query required'}), 400
+    
+    # The index follows the table, which picks up other workers' entries on refresh
+    history_table.refresh()
+    matches, total = search_index.search(user_id, query, limit=per_page, offset=(page - 1) * per_page)
+    
+    results = []
+    for history_id, score in matches:
+        entry = history_table.get(history_id)
+        if entry:
+            results.append({**history_summary(entry), 'score': score})
+    
+    return jsonify({'history': results, 'total': total, 'page': page, 'per_page': per_page}), 200
+
+@app.route('/api/history/<int:history_id>', methods=['GET'])
+@require_auth
+def get_history_item(user_id, history_id):
+    entry = history_table.get(history_id)
+    if not entry or entry['user_id'] != user_id:
+        return jsonify({'error': 'History not found'}), 404
+    return jsonify({'history': entry.to_dict()}), 200
+
+@app.route('/api/conversations/<conversation_id>', methods=['GET'])
+@require_auth
+def get_conversation(user_id, conversation_id):
+    """Every turn of a conversation, oldest first"""
+    entries = [h for h in history_table.group('conversation_id', conversation_id) if h['user_id'] == user_id]
+    if not entries:
+        return jsonify({'error': 'Conversation not found'}), 404
+    return jsonify({'conversation_id': conversation_id, 'turns': [e.to_dict() for e in entries]}), 200
 
 @app.route('/api/history/<int:history_id>', methods=['DELETE'])
 @require_auth
 def delete_history(user_id, history_id):
-    history = read_json(HISTORY_FILE)
-    history = [h for h in history if not (h['id'] == history_id and h['user_id'] == user_id)]
-    write_json(HISTORY_FILE, history)
+    entry = history_table.get(history_id)
+    if entry and entry['user_id'] == user_id:
+        history_table.delete(history_id)
     return jsonify({'message': 'History deleted'}), 200
 
 # ============================================
@@ -459,28 +1237,120 @@ def get_profile(user_id):
 @require_auth
 def update_profile(user_id):
     data = request.json
-    users = read_json(USERS_FILE)
+    changes = {k: data[k] for k in ('full_name', 'email') if k in data}
     
-    for user in users:
-        if user['id'] == user_id:
-            if 'full_name' in data:
-                user['full_name'] = data['full_name']
-            if 'email' in data:
-                user['email'] = data['email']
-            break
+    if 'email' in changes:
+        owner = get_user_by_email(changes['email'])
+        if owner and owner['id'] != user_id:
+            return jsonify({'error': 'Email already registered'}), 400
     
-    write_json(USERS_FILE, users)
-    user = get_user_by_id(user_id)
+    try:
+        user = users_table.update(user_id, **changes)
+    except DuplicateKey:
+        return jsonify({'error': 'Email already registered'}), 400
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
     return jsonify({'user': user_data}), 200
 
+# ============================================
+# METRICS
+# ============================================
+
+http_seconds = registry.histogram('globalassist_http_request_seconds', 'Request latency by route', ('method', 'route'))
+http_requests = registry.counter('globalassist_http_requests_total', 'Requests by route and status', ('method', 'route', 'status'))
+http_errors = registry.counter('globalassist_http_errors_total', 'Responses with a 5xx status', ('method', 'route'))
+
+def storage_file_sizes():
+    """Bytes per data file; directories (uploads, cache) report the total of the files inside"""
+    sizes = {}
+    for name in os.listdir(DATA_DIR):
+        if name.endswith(('.lock', '.tmp', '.bak')):
+            continue
+        path = os.path.join(DATA_DIR, name)
+        if os.path.isdir(path):
+            sizes[name] = directory_size(path)
+            continue
+        try:
+            sizes[name] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def cache_lookups():
+    stats = generation_cache.stats()
+    return {'hit': stats['hits'] - stats['disk_hits'], 'disk_hit': stats['disk_hits'], 'miss': stats['misses']}
+
+def provider_load():
+    load = {}
+    for provider, stats in dispatcher.stats().items():
+        load[(provider, 'running')] = stats['running']
+        load[(provider, 'waiting')] = stats['waiting']
+    return load
+
+registry.gauge('globalassist_storage_file_bytes', 'Size of each data file', ('file',), callback=storage_file_sizes)
+registry.counter('globalassist_cache_lookups_total', 'Generation cache lookups by result', ('result',), callback=cache_lookups)
+registry.gauge('globalassist_cache_hit_ratio', 'Generation cache hit rate since start', callback=lambda: {(): generation_cache.stats()['hit_rate']})
+registry.gauge('globalassist_cache_entries', 'Entries in the in-memory generation cache', callback=lambda: {(): generation_cache.stats()['size']})
+registry.gauge('globalassist_provider_inflight', 'Provider calls running or queued', ('provider', 'state'), callback=provider_load)
+registry.counter('globalassist_storage_commits_total', 'Group commits written', callback=lambda: {(): writer.commits})
+registry.counter('globalassist_storage_commit_errors_total', 'Group commits that failed', callback=lambda: {(): writer.errors})
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_seconds.observe(request.method, route, value=time.perf_counter() - start)
+        http_requests.inc(request.method, route, str(response.status_code))
+        if response.status_code >= 500:
+            http_errors.inc(request.method, route)
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 # ============================================
 # HEALTH CHECK
 # ============================================
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ok'}), 200
+    return jsonify({
+        'status': 'ok',
+        'cache': generation_cache.stats(),
+        'providers': dispatcher.stats(),
+        'provider_health': health_stats(),
+        'storage': writer.stats(),
+        'jobs': job_queue.stats(),
+        'worker': os.getpid()
+    }), 200
+
+if PREFORK:
+    # Share the SDK modules with the workers copy-on-write; clients are built per worker
+    preload_providers()
+elif __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    # Under `python app.py` the debug reloader runs this file twice: a watcher
+    # process that only restarts the server, and the server child
+    # (WERKZEUG_RUN_MAIN=true). Only the child may own workers and files.
+    start_background_tasks()
 
 if __name__ == '__main__':
     print("""
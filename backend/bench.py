@@ -0,0 +1,436 @@
+"""
+GlobalAssist - Benchmark Suite
+Seeds synthetic data at a chosen scale, serves the app on a local port with
+stub AI providers, and measures throughput and latency percentiles per endpoint.
+
+    python bench.py run --users 10k --history 100k --sessions 10k --output before.json
+    python bench.py run --scale 1m --latency-ms 200 --concurrency 32
+    python bench.py compare before.json after.json
+    python bench.py storage --entries 20k
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_PASSWORD = 'bench-password'
+SCENARIOS = ['register', 'login', 'me', 'generate', 'history', 'delete']
+
+
+def parse_count(value):
+    """'1k' -> 1000, '1m' -> 1000000"""
+    value = str(value).strip().lower()
+    for suffix, factor in (('k', 1000), ('m', 1000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+# ============================================
+# SEEDING
+# ============================================
+
+def write_table(filename, records, count):
+    """Stream records into the versioned envelope without holding them all in memory"""
+    with open(filename, 'w') as f:
+        f.write('{"schema":2,"next_id":%d,"records":[' % (count + 1))
+        for i, record in enumerate(records):
+            if i:
+                f.write(',')
+            f.write(json.dumps(record, separators=(',', ':')))
+        f.write(']}')
+
+def seed(data_dir, users, history, sessions):
+    """
+    users: bench-<n>@example.com, all with BENCH_PASSWORD.
+    history: entry k belongs to user ((k - 1) % users) + 1.
+    """
+    from werkzeug.security import generate_password_hash
+
+    os.makedirs(data_dir, exist_ok=True)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+    created = now.isoformat()
+    expires = (now + timedelta(days=30)).isoformat()
+
+    write_table(os.path.join(data_dir, 'users.json'), (
+        {
+            'id': n,
+            'email': f'bench-{n}@example.com',
+            'password_hash': password_hash,
+            'full_name': f'Bench User {n}',
+            'subscription_tier': 'pro' if n % 10 == 0 else 'free',
+            'subscription_status': 'active',
+            'created_at': created
+        }
+        for n in range(1, users + 1)
+    ), users)
+
+    write_table(os.path.join(data_dir, 'history.json'), (
+        {
+            'id': k,
+            'user_id': (k - 1) % users + 1,
+            'type': 'chat',
+            'title': f'Write a function number {k}',
+            'content': f'def function_{k}(values):\n    return sorted(values)[:{k % 50 + 1}]\n',
+            'model_used': 'kiwi-4.5',
+            'metadata': {'prompt': f'Write a function number {k}', 'explanation': 'Sorts and slices the input.'},
+            'created_at': created
+        }
+        for k in range(1, history + 1)
+    ), history)
+
+    write_table(os.path.join(data_dir, 'sessions.json'), (
+        {
+            'user_id': (s - 1) % users + 1,
+            'token': f'bench-session-{s}',
+            'sid': f'{s:016x}',
+            'expires_at': expires
+        }
+        for s in range(1, sessions + 1)
+    ), sessions)
+
+
+# ============================================
+# LOAD GENERATION
+# ============================================
+
+def start_server(args):
+    """Import the app with stub providers and limits lifted, serve it on a free port"""
+    os.environ['AI_STUB_PROVIDERS'] = '1'
+    os.environ['AI_STUB_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['AI_STUB_JITTER_MS'] = str(args.jitter_ms)
+    os.environ['AI_STUB_FAIL_RATE'] = str(args.fail_rate)
+    os.environ.setdefault('AI_WARM_UP', '0')
+    for name in ('QUOTA_FREE_MONTHLY', 'QUOTA_PRO_MONTHLY', 'RATE_FREE_BURST', 'RATE_PRO_BURST'):
+        os.environ.setdefault(name, '1000000000')
+    for name in ('RATE_FREE_PER_MINUTE', 'RATE_PRO_PER_MINUTE'):
+        os.environ.setdefault(name, '1000000000')
+
+    sys.path.insert(0, BACKEND_DIR)
+    started = time.perf_counter()
+    import app as backend
+    load_seconds = time.perf_counter() - started
+
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}', load_seconds
+
+
+class Worker:
+    """One simulated client: its own HTTP session and a seeded user to act as"""
+
+    def __init__(self, index, base_url, user_id, seeded_ids=()):
+        import requests
+        self.index = index
+        self.base_url = base_url
+        self.user_id = user_id
+        self.email = f'bench-{user_id}@example.com'
+        self.http = requests.Session()
+        self.headers = {}
+        # Deleted newest first: entries from the generate scenario, then seeded ones
+        self.history_ids = list(seeded_ids)
+
+    def login(self):
+        r = self.http.post(f'{self.base_url}/api/auth/login', json={'email': self.email, 'password': BENCH_PASSWORD})
+        r.raise_for_status()
+        self.headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+
+    # ----- scenarios -----
+
+    def register(self, i):
+        email = f'new-{self.index}-{i}-{uuid.uuid4().hex[:8]}@example.com'
+        return self.http.post(f'{self.base_url}/api/auth/register', json={'email': email, 'password': BENCH_PASSWORD})
+
+    def login_request(self, i):
+        return self.http.post(f'{self.base_url}/api/auth/login', json={'email': self.email, 'password': BENCH_PASSWORD})
+
+    def me(self, i):
+        return self.http.get(f'{self.base_url}/api/auth/me', headers=self.headers)
+
+    def generate(self, i):
+        prompt = f'bench prompt {self.index}-{i}-{uuid.uuid4().hex[:8]}'
+        r = self.http.post(f'{self.base_url}/api/ai/generate', json={'prompt': prompt, 'cache': False}, headers=self.headers)
+        if r.ok:
+            self.history_ids.append(r.json()['history_id'])
+        return r
+
+    def history(self, i):
+        return self.http.get(f'{self.base_url}/api/history/all', params={'per_page': 20}, headers=self.headers)
+
+    def delete(self, i):
+        history_id = self.history_ids.pop() if self.history_ids else 0
+        return self.http.delete(f'{self.base_url}/api/history/{history_id}', headers=self.headers)
+
+
+def run_scenario(workers, name, requests_total):
+    method = {'login': 'login_request'}.get(name, name)
+    per_worker = [requests_total // len(workers) + (1 if w < requests_total % len(workers) else 0)
+                  for w in range(len(workers))]
+
+    def drive(worker, count):
+        latencies, errors = [], 0
+        for i in range(count):
+            start = time.perf_counter()
+            try:
+                ok = getattr(worker, method)(i).ok
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += 0 if ok else 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        outcomes = list(pool.map(drive, workers, per_worker))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for lats, _ in outcomes for l in lats)
+    errors = sum(e for _, e in outcomes)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    users = parse_count(args.users or args.scale)
+    history = parse_count(args.history or args.scale)
+    sessions = parse_count(args.sessions or args.scale)
+    scenarios = args.scenarios.split(',') if args.scenarios else SCENARIOS
+    concurrency = min(args.concurrency, users)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix='globalassist-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    started = time.perf_counter()
+    seed('data', users, history, sessions)
+    seed_seconds = time.perf_counter() - started
+    print(f"Seeded {users} users, {history} history entries, {sessions} sessions in {seed_seconds:.1f}s ({workdir})",
+          file=sys.stderr)
+
+    server, base_url, load_seconds = start_server(args)
+    workers = [
+        Worker(index, base_url, user_id=index + 1, seeded_ids=range(index + 1, history + 1, users)[:1000])
+        for index in range(concurrency)
+    ]
+    for worker in workers:
+        worker.login()
+
+    results = {}
+    for name in scenarios:
+        results[name] = run_scenario(workers, name, args.requests)
+        r = results[name]
+        print(f"{name:>9}: {r['throughput_rps']:>9} req/s  p50 {r['p50_ms']}ms  p95 {r['p95_ms']}ms  "
+              f"p99 {r['p99_ms']}ms  errors {r['errors']}", file=sys.stderr)
+
+    server.shutdown()
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'users': users,
+            'history': history,
+            'sessions': sessions,
+            'requests_per_scenario': args.requests,
+            'concurrency': concurrency,
+            'stub_latency_ms': args.latency_ms,
+            'stub_jitter_ms': args.jitter_ms,
+            'stub_fail_rate': args.fail_rate,
+            'seed_seconds': round(seed_seconds, 3),
+            'startup_seconds': round(load_seconds, 3)
+        },
+        'results': results
+    }
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def compare(args):
+    """Print per-scenario changes between two result files (negative latency delta = faster)"""
+    with open(args.before) as f:
+        before = json.load(f)['results']
+    with open(args.after) as f:
+        after = json.load(f)['results']
+
+    def change(old, new):
+        if not old or new is None:
+            return 'n/a'
+        return f'{(new - old) / old * 100:+.1f}%'
+
+    print(f"{'scenario':>9}  {'req/s':>16}  {'p50':>8}  {'p95':>8}  {'p99':>8}")
+    for name in [s for s in SCENARIOS if s in before and s in after]:
+        old, new = before[name], after[name]
+        print(f"{name:>9}  {old['throughput_rps']:>7}->{new['throughput_rps']:<8}  "
+              f"{change(old['p50_ms'], new['p50_ms']):>8}  {change(old['p95_ms'], new['p95_ms']):>8}  "
+              f"{change(old['p99_ms'], new['p99_ms']):>8}")
+
+
+# ============================================
+# HISTORY STORAGE
+# ============================================
+
+SAMPLE_CODE = {
+    'python': (
+        'def {name}(items):\n'
+        '    """\n    Args:\n        items: list of values\n\n    Returns:\n        the {n} largest values, sorted\n    """\n'
+        '    if not items:\n        return []\n    result = []\n'
+        '    for item in sorted(items, reverse=True):\n'
+        '        if item is not None:\n            result.append(item)\n'
+        '        if len(result) == {n}:\n            break\n    return result\n\n\n'
+        'if __name__ == "__main__":\n    print({name}([3, 1, 4, 1, 5, 9, 2, 6]))\n'),
+    'javascript': (
+        "import React, {{ useState, useEffect }} from 'react'\n\n"
+        'export default function {name}() {{\n'
+        '  const [items, setItems] = useState([])\n  const [error, setError] = useState(null)\n\n'
+        '  useEffect(() => {{\n'
+        "    fetch('/api/items?limit={n}')\n"
+        '      .then((response) => response.json())\n'
+        '      .then((data) => setItems(data.items))\n'
+        '      .catch((error) => setError(error.message))\n  }}, [])\n\n'
+        '  return (\n    <div className="list">\n'
+        '      {{items.map((item) => <p key={{item.id}}>{{item.name}}</p>)}}\n    </div>\n  )\n}}\n'),
+    'sql': (
+        'CREATE TABLE IF NOT EXISTS {name} (\n    id INTEGER PRIMARY KEY,\n    user_id INTEGER NOT NULL,\n'
+        '    title VARCHAR(255) NOT NULL,\n    created_at TIMESTAMP\n);\n\n'
+        'SELECT u.email, COUNT(*) AS total\nFROM {name} t\nLEFT JOIN users u ON u.id = t.user_id\n'
+        'GROUP BY u.email\nORDER BY total DESC\nLIMIT {n};\n'),
+}
+
+def sample_history(k, created):
+    """A history entry shaped like a real generation: a screen of code plus an explanation"""
+    language = list(SAMPLE_CODE)[k % len(SAMPLE_CODE)]
+    name = f'top_values_{k}'
+    n = k % 20 + 1
+    prompt = f'Write {language} that returns the top {n} values (request {k})'
+    return {
+        'id': k,
+        'user_id': k % 1000 + 1,
+        'conversation_id': f'{k // 4:016x}',
+        'type': 'code',
+        'title': prompt,
+        'content': SAMPLE_CODE[language].format(name=name, n=n),
+        'model_used': 'kiwi-4.5',
+        'metadata': {
+            'prompt': prompt,
+            'explanation': f'This function {name} takes a list of values and returns the {n} largest. '
+                           'It skips missing values and stops early once it has enough.',
+            'language': language
+        },
+        'created_at': created
+    }
+
+def traced(build):
+    """(build(), bytes it left allocated)"""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def storage(args):
+    """Memory and disk footprint of the history table: plain dicts vs compressed HistoryRecords"""
+    sys.path.insert(0, BACKEND_DIR)
+    from history_record import HistoryRecord, compress
+
+    count = parse_count(args.entries)
+    created = datetime.utcnow().isoformat()
+    plain, plain_memory = traced(lambda: [sample_history(k, created) for k in range(1, count + 1)])
+    plain_disk = len(json.dumps(plain, separators=(',', ':')))
+
+    # Built from fresh entries, so nothing is shared with `plain`
+    records, record_memory = traced(
+        lambda: [HistoryRecord.from_value(sample_history(k, created)) for k in range(1, count + 1)])
+    record_disk = len(json.dumps([r.to_stored() for r in records], separators=(',', ':')))
+
+    payload = sum(len(json.dumps([e['content'], e['metadata']], separators=(',', ':'))) for e in plain)
+    without_dict = sum(len(compress(e['content'], e['metadata'], zdict=None)) for e in plain)
+    with_dict = sum(len(r._blob) for r in records)
+
+    def change(old, new):
+        return f'{(new - old) / old * 100:+.1f}%'
+
+    print(f"{count} history entries")
+    print(f"{'':>16}  {'memory':>12}  {'disk':>12}")
+    print(f"{'plain dicts':>16}  {plain_memory:>12,}  {plain_disk:>12,}")
+    print(f"{'HistoryRecord':>16}  {record_memory:>12,}  {record_disk:>12,}")
+    print(f"{'change':>16}  {change(plain_memory, record_memory):>12}  {change(plain_disk, record_disk):>12}")
+    print(f"content + metadata: {payload:,} bytes raw, {without_dict:,} deflated, "
+          f"{with_dict:,} deflated with the preset dictionary ({with_dict / payload:.0%} of raw)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GlobalAssist backend benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='seed data, start the app and measure endpoints')
+    run_parser.add_argument('--scale', default='1k', help='default record count for every table (1k ... 1m)')
+    run_parser.add_argument('--users', help='seeded users (overrides --scale)')
+    run_parser.add_argument('--history', help='seeded history entries (overrides --scale)')
+    run_parser.add_argument('--sessions', help='seeded sessions (overrides --scale)')
+    run_parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    run_parser.add_argument('--latency-ms', type=float, default=100, help='stub provider latency')
+    run_parser.add_argument('--jitter-ms', type=float, default=0, help='stub provider latency jitter')
+    run_parser.add_argument('--fail-rate', type=float, default=0, help='stub provider failure probability')
+    run_parser.add_argument('--scenarios', help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    run_parser.add_argument('--workdir', help='where to seed data (default: a new temp directory)')
+    run_parser.add_argument('--output', help='write JSON results here instead of stdout')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.set_defaults(func=compare)
+
+    storage_parser = commands.add_parser('storage', help='memory and disk size of history entries, compressed or not')
+    storage_parser.add_argument('--entries', default='10k', help='history entries to build')
+    storage_parser.set_defaults(func=storage)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
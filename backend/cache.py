@@ -0,0 +1,122 @@
+"""
+GlobalAssist - Generation Cache
+LRU + TTL cache for model replies, with an optional on-disk tier that survives restarts
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', 1000))
+CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 24 * 3600))
+CACHE_DIR = os.getenv('AI_CACHE_DIR', '')
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace and case so trivially different prompts share an entry"""
+    return ' '.join(prompt.split()).lower()
+
+def cache_key(model_id, prompt, version):
+    raw = f'{version}\0{model_id}\0{normalize_prompt(prompt)}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class GenerationCache:
+    """
+    In-memory LRU with per-entry TTL. If directory is set, entries are also
+    written there (one JSON file per key) and read back on a memory miss.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, directory=CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory or None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, *entry)
+            return entry[1]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, expires_at, value)
+        self._write_disk(key, expires_at, value)
+
+    def _store(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ----- disk tier -----
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data['expires_at'] <= now:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+        return data['expires_at'], data['value']
+
+    def _write_disk(self, key, expires_at, value):
+        if not self.directory:
+            return
+        tmp = f'{self._path(key)}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'expires_at': expires_at, 'value': value}, f)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            print(f"Cache write error: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
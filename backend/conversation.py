@@ -0,0 +1,99 @@
+"""
+GlobalAssist - Conversation Context
+Turns a conversation's history entries into prior turns for the next request,
+kept under a token budget. Older turns are folded into a short summary.
+"""
+
+import os
+import secrets
+
+# Prior turns sent with a follow-up, in estimated tokens (summary excluded)
+CONTEXT_BUDGET = int(os.getenv('AI_CONTEXT_TOKENS', 6000))
+SUMMARY_BUDGET = int(os.getenv('AI_SUMMARY_TOKENS', 500))
+# Turns are dropped from the front this many at a time, so the prefix sent to
+# the provider stays identical (and cacheable) for several follow-ups in a row
+TRIM_STEP = int(os.getenv('AI_CONTEXT_TRIM_STEP', 4))
+
+SUMMARY_LINE_CHARS = 160
+
+
+def new_conversation_id():
+    return secrets.token_hex(8)
+
+def estimate_tokens(text):
+    """Rough count (about 4 characters per token), good enough for budgeting"""
+    return len(text) // 4 + 1
+
+def user_text(prompt, attachments=()):
+    """
+    The user message for a prompt, with the text of any attached files first.
+    Prior turns are re-sent in exactly this form.
+    """
+    files = ''.join(f'<file name="{a["filename"]}">\n{a["text"]}\n</file>\n\n' for a in attachments)
+    return f"{files}Generate clean, production-ready code for: {prompt}\n\nProvide the code and a brief explanation."
+
+def assistant_text(entry):
+    """The assistant reply for a history entry, rebuilt the same way every time"""
+    metadata = entry.get('metadata') or {}
+    explanation = metadata.get('explanation', '')
+    if not entry.get('content'):
+        return explanation
+    return f"```{metadata.get('language', '')}\n{entry['content'].rstrip()}\n```\n\n{explanation}".strip()
+
+def _first_line(text):
+    line = text.strip().split('\n', 1)[0]
+    return line if len(line) <= SUMMARY_LINE_CHARS else line[:SUMMARY_LINE_CHARS - 3] + '...'
+
+def summarize(entries, budget=SUMMARY_BUDGET):
+    """One line per dropped turn (request and the start of the answer), newest kept first"""
+    lines = []
+    used = 0
+    for entry in reversed(entries):
+        metadata = entry.get('metadata') or {}
+        line = f"- Asked: {_first_line(metadata.get('prompt', entry.get('title', '')))}"
+        explanation = metadata.get('explanation', '')
+        if explanation:
+            line += f" | Answered: {_first_line(explanation)}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+
+    omitted = len(entries) - len(lines)
+    lines.reverse()
+    if omitted:
+        lines.insert(0, f"- ({omitted} earlier requests omitted)")
+    return "Summary of earlier turns in this conversation:\n" + '\n'.join(lines)
+
+def build_context(conversation_id, entries, attachments_for=None, budget=CONTEXT_BUDGET, step=TRIM_STEP):
+    """
+    entries: the conversation's history entries, oldest first.
+    attachments_for(entry): the files attached to an entry's prompt, if any.
+    Returns {'conversation_id', 'summary': str or None, 'turns': [(user, assistant), ...],
+    'attachments': []} with the newest turns that fit in `budget` and a summary of the rest.
+    """
+    turns = []
+    for entry in entries:
+        prompt = (entry.get('metadata') or {}).get('prompt', entry.get('title', ''))
+        attachments = attachments_for(entry) if attachments_for else ()
+        turns.append((user_text(prompt, attachments), assistant_text(entry)))
+    costs = [estimate_tokens(u) + estimate_tokens(a) for u, a in turns]
+
+    cut = 0
+    kept = sum(costs)
+    while kept > budget and cut < len(turns):
+        dropped = costs[cut:cut + max(1, step)]
+        kept -= sum(dropped)
+        cut += len(dropped)
+
+    return {
+        'conversation_id': conversation_id,
+        'summary': summarize(entries[:cut]) if cut else None,
+        'turns': turns[cut:],
+        # Files attached to the new prompt, filled in by the caller
+        'attachments': []
+    }
+
+def has_context(context):
+    return bool(context and (context['summary'] or context['turns']))
@@ -0,0 +1,154 @@
+"""
+GlobalAssist - Generation Dispatcher
+Runs provider calls on a background asyncio loop with a concurrency limit and a
+bounded wait queue per provider, so slow generations can't starve other requests
+"""
+
+import asyncio
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PROVIDERS = ['anthropic', 'openai', 'huggingface', 'google']
+
+DEFAULT_CONCURRENCY = int(os.getenv('AI_CONCURRENCY', 8))
+DEFAULT_QUEUE = int(os.getenv('AI_QUEUE_SIZE', 16))
+QUEUE_TIMEOUT = float(os.getenv('AI_QUEUE_TIMEOUT', 30))
+
+
+class Overloaded(Exception):
+    """Raised when a provider's wait queue is full; retry_after is in seconds"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f'{provider} is at capacity')
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class Dispatcher:
+    def __init__(self, providers=PROVIDERS):
+        # Per-provider overrides, e.g. AI_CONCURRENCY_OPENAI=4, AI_QUEUE_SIZE_OPENAI=10
+        self.limits = {p: int(os.getenv(f'AI_CONCURRENCY_{p.upper()}', DEFAULT_CONCURRENCY)) for p in providers}
+        self.queue_limits = {p: int(os.getenv(f'AI_QUEUE_SIZE_{p.upper()}', DEFAULT_QUEUE)) for p in providers}
+        self._lock = threading.Lock()
+        self._pending = {p: 0 for p in providers}
+        self._running = {p: 0 for p in providers}
+        self._avg_seconds = {p: 10.0 for p in providers}
+        self.rejected = {p: 0 for p in providers}
+        self.loop = None
+        self._semaphores = {}
+        self._executor = None
+
+    # ----- event loop -----
+
+    def _ensure_loop(self):
+        if self.loop is not None:
+            return
+        with self._lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix='ai-call')
+            loop.set_default_executor(self._executor)
+            self._semaphores = {p: asyncio.Semaphore(n) for p, n in self.limits.items()}
+            threading.Thread(target=loop.run_forever, name='ai-dispatcher', daemon=True).start()
+            self.loop = loop
+
+    def after_fork(self):
+        """In a forked child: the loop thread didn't survive, start over lazily"""
+        self._lock = threading.Lock()
+        self.loop = None
+        self._semaphores = {}
+        self._executor = None
+        self._pending = {p: 0 for p in self.limits}
+        self._running = {p: 0 for p in self.limits}
+
+    # ----- admission -----
+
+    def _admit(self, provider):
+        with self._lock:
+            limit = self.limits[provider]
+            if self._pending[provider] >= limit + self.queue_limits[provider]:
+                self.rejected[provider] += 1
+                waiting = self._pending[provider] - limit + 1
+                raise Overloaded(provider, max(1, math.ceil(self._avg_seconds[provider] * waiting / limit)))
+            self._pending[provider] += 1
+
+    def _finish(self, provider, seconds=None):
+        with self._lock:
+            self._pending[provider] -= 1
+            if seconds is not None:
+                # Exponentially weighted average, used for Retry-After estimates
+                self._avg_seconds[provider] = 0.8 * self._avg_seconds[provider] + 0.2 * seconds
+
+    async def _call(self, provider, fn, args):
+        async with self._semaphores[provider]:
+            self._running[provider] += 1
+            start = self.loop.time()
+            try:
+                return await self.loop.run_in_executor(None, fn, *args)
+            finally:
+                self._running[provider] -= 1
+                self._finish(provider, self.loop.time() - start)
+
+    async def _acquire(self, provider):
+        await asyncio.wait_for(self._semaphores[provider].acquire(), QUEUE_TIMEOUT)
+        self._running[provider] += 1
+
+    def _release(self, provider):
+        self._running[provider] -= 1
+        self._semaphores[provider].release()
+
+    # ----- public API -----
+
+    def run(self, provider, fn, *args):
+        """Run fn(*args) under the provider's limit and wait for the result"""
+        self._ensure_loop()
+        self._admit(provider)
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._call(provider, fn, args), self.loop)
+        except Exception:
+            self._finish(provider)
+            raise
+        return future.result()
+
+    def acquire(self, provider):
+        """
+        Hold one of the provider's slots (for streaming responses).
+        Returns a release() callable that must be called exactly once.
+        """
+        self._ensure_loop()
+        self._admit(provider)
+        try:
+            asyncio.run_coroutine_threadsafe(self._acquire(provider), self.loop).result()
+        except Exception:
+            self._finish(provider)
+            raise Overloaded(provider, math.ceil(self._avg_seconds[provider]))
+
+        start = self.loop.time()
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.loop.call_soon_threadsafe(self._release, provider)
+                self._finish(provider, self.loop.time() - start)
+        return release
+
+    def stats(self):
+        return {
+            p: {
+                'limit': self.limits[p],
+                'queue_limit': self.queue_limits[p],
+                'running': self._running[p],
+                'waiting': max(0, self._pending[p] - self._running[p]),
+                'rejected': self.rejected[p]
+            }
+            for p in self.limits
+        }
+
+
+dispatcher = Dispatcher()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=dispatcher.after_fork)
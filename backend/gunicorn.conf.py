@@ -0,0 +1,43 @@
+"""
+GlobalAssist - Production Server
+Pre-forks worker processes from one preloaded copy of the app:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Graceful restart of the workers: kill -HUP <master pid>
+Deploying new code (preloaded apps don't re-import on HUP): kill -USR2 <master pid>,
+then kill -QUIT the old master once the new one is up.
+"""
+
+import multiprocessing
+import os
+
+# Read by the app at import, which happens after this file in the master
+os.environ.setdefault('GLOBALASSIST_PREFORK', '1')
+os.environ.setdefault('STORAGE_SHARED', '1')
+os.environ.setdefault('AI_CACHE_DIR', os.path.join('data', 'cache'))
+os.environ.setdefault('QUOTA_SAVE_INTERVAL', '5')
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Threads per worker: streams and provider calls spend most of their time waiting
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# In-flight requests (including streams) get this long to finish on reload/shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_tasks()
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
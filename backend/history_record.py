@@ -0,0 +1,269 @@
+"""
+GlobalAssist - History Records
+Compact in-memory form of a history entry. The bulky fields (the generated code
+and its metadata: prompt, explanation, ...) stay zlib-compressed against a preset
+dictionary of common code, and are only decompressed when read. Listing, paging and filtering work
+on the small fields and a preview that inflates just the start of the code.
+"""
+
+import base64
+import json
+import os
+import zlib
+
+# Stored with every compressed record; bump when ZDICT or the blob layout changes
+# (and keep the old dictionary around to read existing records).
+# 1: JSON [content, metadata]; 2: b'<content bytes>\n', content, metadata as JSON
+CODEC_VERSION = 2
+COMPRESSION_LEVEL = int(os.getenv('HISTORY_COMPRESSION_LEVEL', 6))
+PREVIEW_CHARS = 200
+
+# Preset dictionary: snippets that show up in most generated code and in the
+# explanations around it. Deflate finds matches against it from the first byte,
+# which is what makes small entries compress at all. Most common text goes last
+# (closest to the data, cheapest to reference).
+ZDICT = '\n'.join([
+    # Go, Rust, Java, C#
+    'package main\n\nimport (\n\t"fmt"\n)\n\nfunc main() {\n\tfmt.Println(',
+    'if err != nil {\n\t\treturn nil, err\n\t}\n',
+    'fn main() {\n    println!("{}", ',
+    'let mut result = Vec::new();\n',
+    'pub fn new() -> Self {\n',
+    'public class Main {\n    public static void main(String[] args) {\n        System.out.println(',
+    'private final ', 'public static ', '@Override\n    public String toString() {\n',
+    'using System;\n\nnamespace ',
+    # Shell, SQL, HTML/CSS
+    '#!/bin/bash\nset -euo pipefail\n\n',
+    'SELECT * FROM users WHERE id = ',
+    'CREATE TABLE IF NOT EXISTS ',
+    ' PRIMARY KEY, ', ' NOT NULL', ' VARCHAR(255)', ' ORDER BY ', ' GROUP BY ', ' LEFT JOIN ',
+    '<!DOCTYPE html>\n<html lang="en">\n<head>\n    <meta charset="UTF-8">\n',
+    '<div className="', '</div>\n', 'display: flex;\n', 'margin: 0 auto;\n',
+    # JavaScript / TypeScript / React
+    "import React, { useState, useEffect } from 'react'\n",
+    'export default function ', 'export const ', 'module.exports = ',
+    'const express = require(\'express\')\nconst app = express()\n',
+    'app.get(\'/\', (req, res) => {\n  res.json(',
+    'async function ', 'await fetch(', '.then((response) => response.json())\n',
+    'try {\n  const response = await ', '} catch (error) {\n  console.error(error)\n}\n',
+    'const [', ', set', '] = useState(', 'useEffect(() => {\n', '}, [])\n',
+    'return (\n    <div', 'function ', 'console.log(', 'const ', 'let ', '=> {\n', '};\n',
+    '.map((item) => ', '.filter((', '.length', 'document.getElementById(',
+    'interface ', ': string;\n', ': number;\n', ': boolean;\n',
+    # Python
+    '#!/usr/bin/env python3\n', 'from typing import List, Dict, Optional\n',
+    'from dataclasses import dataclass\n', 'from datetime import datetime\n',
+    'import os\nimport sys\nimport json\n', 'import requests\n',
+    'from flask import Flask, request, jsonify\n\napp = Flask(__name__)\n\n',
+    "@app.route('/api/", "', methods=['GET'])\ndef ", 'return jsonify(',
+    'class ', '(object):\n', 'def __init__(self, ', '        self.',
+    '    def __repr__(self):\n        return f"', '@property\n    def ',
+    '    @staticmethod\n', '    @classmethod\n    def ',
+    'with open(filename, \'r\') as f:\n', 'except Exception as e:\n        print(f"Error: {e}")\n',
+    'raise ValueError(', 'for i in range(', 'for item in items:\n', 'while True:\n',
+    'if not ', ' is None:\n', ' is not None', 'elif ', 'else:\n', 'return None\n',
+    'return result\n', 'result = []\n', 'result.append(', 'print(f"',
+    '    """\n    Args:\n        ', '\n    Returns:\n        ', '\n    Raises:\n        ',
+    'def main():\n    """\n', '\n\nif __name__ == "__main__":\n    main()\n',
+    'def ', '(self):\n', 'return ', 'import ', 'from ', 'self.', 'True', 'False', 'None',
+    # Explanations
+    'Here is a clean, production-ready implementation',
+    'This code ', 'This function ', 'The function ', 'takes a list of ', 'returns a ',
+    ' and returns ', ' the input ', ' the result', 'Key features:\n- ', '\n- Error handling',
+    '\n- Type hints', ' for better readability', 'Time complexity: O(n)', 'Space complexity: O(1)',
+    'Example usage:\n', 'You can ', ' which ', ' with ', ' that ', ' the ',
+    '```python\n', '```javascript\n', '```\n',
+    # The metadata around every payload
+    '",{"prompt":"Write a ', '","explanation":"', '","language":"python"}]',
+]).encode()
+
+
+def compress(content, metadata, zdict=ZDICT):
+    """
+    Raw deflate of the content (length first, so the start of it can be read on
+    its own) followed by the metadata as JSON, primed with the preset
+    dictionary (zdict=None: none)
+    """
+    body = content.encode()
+    raw = b'%d\n' % len(body) + body + json.dumps(metadata, separators=(',', ':')).encode()
+    if zdict:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+    return compressor.compress(raw) + compressor.flush()
+
+def decompress(blob, zdict=ZDICT, version=CODEC_VERSION):
+    """(content, metadata)"""
+    decompressor = zlib.decompressobj(-15, zdict=zdict)
+    raw = decompressor.decompress(blob) + decompressor.flush()
+    if version == 1:
+        content, metadata = json.loads(raw)
+        return content, metadata
+    size, _, raw = raw.partition(b'\n')
+    size = int(size)
+    return raw[:size].decode(), json.loads(raw[size:])
+
+def read_preview(blob, zdict=ZDICT, version=CODEC_VERSION):
+    """The first PREVIEW_CHARS characters of the content, inflating only as much as that takes"""
+    if version == 1:
+        return decompress(blob, zdict, version)[0][:PREVIEW_CHARS]
+    decompressor = zlib.decompressobj(-15, zdict=zdict)
+    # Up to 4 UTF-8 bytes per character, after the length line
+    head = decompressor.decompress(blob, 24 + PREVIEW_CHARS * 4)
+    size, _, head = head.partition(b'\n')
+    return head[:int(size)].decode(errors='ignore')[:PREVIEW_CHARS]
+
+
+_UNSET = object()
+
+
+class HistoryRecord:
+    """
+    Reads like the history dict it replaces (record['title'], record.get(...)),
+    but 'content' and 'metadata' are decompressed on every access rather than
+    held. Use record.preview for listings, and payload() or to_dict() to
+    decompress once when both are needed.
+
+    On disk it is the usual record with those two fields replaced by 'z' (the
+    compressed blob, base64) and 'zv' (its codec version). The preview is not
+    stored: it is read from the start of the blob the first time it's asked
+    for, so loading doesn't decompress anything.
+    """
+    FIELDS = ('id', 'user_id', 'conversation_id', 'type', 'title', 'model_used', 'created_at')
+    __slots__ = FIELDS + ('_preview', '_blob', '_zv', '_extra')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, _UNSET)
+        self._preview = None
+        self._blob = b''
+        self._zv = CODEC_VERSION
+        self._extra = None
+
+    @classmethod
+    def from_value(cls, data):
+        """From a stored record (compressed) or a plain history dict (compressed here)"""
+        record = cls()
+        for key, value in data.items():
+            if key in cls.FIELDS:
+                setattr(record, key, value)
+            elif key not in ('content', 'metadata', 'z', 'zv', 'preview'):
+                record._set_extra(key, value)
+
+        if 'z' not in data:
+            record._set_payload(data.get('content', ''), data.get('metadata') or {})
+        else:
+            record._blob = base64.b64decode(data['z'])
+            record._zv = data.get('zv', 1)
+            # Stored alongside the blob by older versions
+            record._preview = data.get('preview')
+        return record
+
+    def to_stored(self):
+        stored = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not _UNSET}
+        if self._extra:
+            stored.update(self._extra)
+        stored['z'] = base64.b64encode(self._blob).decode('ascii')
+        stored['zv'] = self._zv
+        return stored
+
+    @property
+    def preview(self):
+        """The first PREVIEW_CHARS characters of the content"""
+        if self._preview is None:
+            self._preview = read_preview(self._blob, version=self._zv)
+        return self._preview
+
+    def payload(self):
+        """(content, metadata) with a single decompression"""
+        return decompress(self._blob, version=self._zv)
+
+    def to_dict(self):
+        """The full history entry as a plain dict"""
+        entry = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not _UNSET}
+        if self._extra:
+            entry.update(self._extra)
+        entry['content'], entry['metadata'] = self.payload()
+        return entry
+
+    def _set_extra(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def _set_payload(self, content, metadata):
+        self._blob = compress(content, metadata)
+        self._zv = CODEC_VERSION
+        self._preview = None
+
+    # ----- mapping interface -----
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            return value
+        if key == 'content':
+            return self.payload()[0]
+        if key == 'metadata':
+            return self.payload()[1]
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        elif key == 'content':
+            self._set_payload(value, self.payload()[1])
+        elif key == 'metadata':
+            self._set_payload(self.payload()[0], value)
+        else:
+            self._set_extra(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, changes):
+        changes = dict(changes)
+        if 'content' in changes or 'metadata' in changes:
+            content, metadata = self.payload()
+            self._set_payload(changes.pop('content', content), changes.pop('metadata', metadata))
+        for key, value in changes.items():
+            self[key] = value
+
+    def keys(self):
+        keys = [field for field in self.FIELDS if getattr(self, field) is not _UNSET]
+        keys += ['content', 'metadata']
+        if self._extra:
+            keys += list(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, HistoryRecord):
+            return NotImplemented
+        return (all(getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+                and self._blob == other._blob and self._extra == other._extra)
+
+    def __repr__(self):
+        return f'<HistoryRecord id={self.id!r} user_id={self.user_id!r} title={self.title!r}>'
+
+
+def entry_payload(entry):
+    """(content, metadata) of a history entry, decompressing a HistoryRecord once"""
+    if isinstance(entry, HistoryRecord):
+        return entry.payload()
+    return entry.get('content', ''), entry.get('metadata') or {}
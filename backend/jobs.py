@@ -0,0 +1,239 @@
+"""
+GlobalAssist - Background Jobs
+A persistent queue for generations that outlive an HTTP request. Jobs are rows
+in a table; worker threads claim them with a lease, so a job whose worker died
+goes back to the queue once the lease runs out.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import registry
+from storage import file_lock
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# A running job whose lease isn't renewed for this long is requeued
+JOB_LEASE = float(os.getenv('JOB_LEASE', 60))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 2))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 24 * 3600))
+
+# queued -> running -> succeeded | failed; queued or running -> cancelled
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+job_events = registry.counter('globalassist_jobs_total', 'Background job transitions', ('event',))
+
+
+class JobFailed(Exception):
+    """Raised by a handler for a failure that retrying won't fix"""
+
+
+class JobQueue:
+    """
+    handler(job, last_attempt) does the work and returns a result. Exceptions
+    other than JobFailed are retried up to max_attempts times with exponential
+    backoff (or after the exception's retry_after seconds).
+
+    commit(job, result), if given, runs after the handler unless the job was
+    cancelled meanwhile, and returns what is stored as the job's result.
+    on_finish(job) runs once a job has succeeded, failed or been cancelled.
+    Both run on the worker thread.
+    """
+
+    def __init__(self, table, handler, commit=None, on_finish=None, workers=JOB_WORKERS,
+                 max_attempts=JOB_MAX_ATTEMPTS, lease=JOB_LEASE, retry_delay=JOB_RETRY_DELAY):
+        self.table = table
+        self.handler = handler
+        self.commit = commit
+        self.on_finish = on_finish
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self._reset_state()
+
+    def _reset_state(self):
+        self._changed = threading.Condition()
+        self._running = set()
+        self._started = False
+
+    def after_fork(self):
+        """In a forked child: the worker threads didn't survive"""
+        self._reset_state()
+
+    # ----- workers -----
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+        threading.Thread(target=self._keep_leases, name='job-lease', daemon=True).start()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _lease_until(self):
+        return (datetime.utcnow() + timedelta(seconds=self.lease)).isoformat()
+
+    def _claim(self):
+        """Take the oldest runnable job, or None. The file lock keeps two processes from taking the same one."""
+        now = datetime.utcnow().isoformat()
+        if not self.table.count('status', 'queued'):
+            return None
+        with file_lock(self.table.filename + '.claim'):
+            for job in self.table.group('status', 'queued'):
+                if job.get('run_after', '') <= now:
+                    return self.table.update(
+                        job['id'], status='running', attempts=job['attempts'] + 1,
+                        lease_until=self._lease_until(), worker=os.getpid(), updated_at=now)
+        return None
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Job claim error: {e}")
+                job = None
+            if job is None:
+                with self._changed:
+                    self._changed.wait(timeout=1)
+                continue
+
+            self._running.add(job['id'])
+            try:
+                self._run(job)
+            finally:
+                self._running.discard(job['id'])
+                self._notify()
+
+    def _run(self, job):
+        job_events.inc('started')
+        last_attempt = job['attempts'] >= self.max_attempts
+        try:
+            result = self.handler(job, last_attempt)
+        except JobFailed as e:
+            return self._finish(job['id'], 'failed', error=str(e))
+        except Exception as e:
+            print(f"Job {job['id']} attempt {job['attempts']} failed: {e}")
+            if self._cancelled(job['id']):
+                return self._finish(job['id'], 'cancelled')
+            if last_attempt:
+                return self._finish(job['id'], 'failed', error=str(e) or e.__class__.__name__)
+            delay = getattr(e, 'retry_after', None) or self.retry_delay * 2 ** (job['attempts'] - 1)
+            job_events.inc('retried')
+            self.table.update(
+                job['id'], status='queued', error=str(e),
+                run_after=(datetime.utcnow() + timedelta(seconds=delay)).isoformat(),
+                updated_at=datetime.utcnow().isoformat())
+            return
+
+        if self._cancelled(job['id']):
+            # Cancelled while the provider was working; drop the result
+            return self._finish(job['id'], 'cancelled')
+        if self.commit is not None:
+            try:
+                result = self.commit(job, result)
+            except Exception as e:
+                print(f"Job {job['id']} commit error: {e}")
+                return self._finish(job['id'], 'failed', error='Could not save the result')
+        self._finish(job['id'], 'succeeded', result=result)
+
+    def _cancelled(self, job_id):
+        job = self.table.get(job_id)
+        return job is None or job.get('cancel_requested', False)
+
+    def _finish(self, job_id, status, **changes):
+        job = self.table.update(job_id, status=status, lease_until=None,
+                                finished_at=datetime.utcnow().isoformat(),
+                                updated_at=datetime.utcnow().isoformat(), **changes)
+        job_events.inc(status)
+        if job is not None and self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"Job {job_id} on_finish error: {e}")
+        return job
+
+    def _keep_leases(self):
+        """Renew the leases of our running jobs, and requeue jobs whose worker stopped renewing"""
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                for job_id in list(self._running):
+                    self.table.update(job_id, lease_until=self._lease_until())
+                self.recover()
+            except Exception as e:
+                print(f"Job lease error: {e}")
+
+    def recover(self):
+        """Requeue running jobs with an expired lease (their process crashed or was killed)"""
+        now = datetime.utcnow().isoformat()
+        recovered = 0
+        with file_lock(self.table.filename + '.claim'):
+            for job in self.table.group('status', 'running'):
+                if job['id'] in self._running or (job.get('lease_until') or '') > now:
+                    continue
+                if job.get('cancel_requested'):
+                    self._finish(job['id'], 'cancelled')
+                elif job['attempts'] >= self.max_attempts:
+                    self._finish(job['id'], 'failed', error='Worker stopped while running the job')
+                else:
+                    self.table.update(job['id'], status='queued', run_after=now, lease_until=None, updated_at=now)
+                    job_events.inc('recovered')
+                recovered += 1
+        if recovered:
+            print(f"Requeued {recovered} interrupted jobs")
+            self._notify()
+        return recovered
+
+    # ----- public API -----
+
+    def enqueue(self, user_id, request):
+        now = datetime.utcnow().isoformat()
+        job = self.table.insert({
+            'user_id': user_id,
+            'status': 'queued',
+            'request': request,
+            'attempts': 0,
+            'run_after': now,
+            'created_at': now,
+            'updated_at': now
+        })
+        job_events.inc('queued')
+        self._notify()
+        return job
+
+    def cancel(self, job_id):
+        """Queued jobs are cancelled at once; running ones when their current attempt returns"""
+        with file_lock(self.table.filename + '.claim'):
+            job = self.table.get(job_id)
+            if job is None or job['status'] in FINISHED:
+                return job
+            if job['status'] == 'queued':
+                return self._finish(job_id, 'cancelled', cancel_requested=True)
+            return self.table.update(job_id, cancel_requested=True, updated_at=datetime.utcnow().isoformat())
+
+    def wait(self, job_id, timeout):
+        """The job once it has finished, or as it is after `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.table.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            # Woken by our own workers; jobs run by other processes show up on refresh
+            with self._changed:
+                self._changed.wait(timeout=min(1, remaining))
+
+    def prune(self, retention=JOB_RETENTION):
+        cutoff = (datetime.utcnow() - timedelta(seconds=retention)).isoformat()
+        return self.table.delete_where(lambda j: j['status'] in FINISHED and (j.get('finished_at') or '') < cutoff)
+
+    def stats(self):
+        return {status: self.table.count('status', status) for status in ('queued', 'running')}
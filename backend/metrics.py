@@ -0,0 +1,158 @@
+"""
+GlobalAssist - Metrics
+Counters, gauges and latency histograms rendered in the Prometheus text format.
+Recording is a dict lookup, a bisect and an add under a lock, cheap enough to
+leave on in production.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers in-memory lookups through slow provider calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Values are either recorded as they happen, or computed at scrape time by a
+    callback returning {label_value or (label_values...): value}.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        """[(suffix, label_names, label_values, value), ...]"""
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                print(f"Metrics callback error for {self.name}: {e}")
+                return []
+            return [('', self.labels, key if isinstance(key, tuple) else (key,), value) for key, value in values.items()]
+        with self._lock:
+            return [('', self.labels, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # [count per bucket..., +Inf count], sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - start)
+
+    def samples(self):
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        names = self.labels + ('le',)
+        out = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                out.append(('_bucket', names, key + (_format_value(bound),), cumulative))
+            out.append(('_sum', self.labels, key, total))
+            out.append(('_count', self.labels, key, cumulative))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text, labels=(), callback=None):
+        return self._register(Counter, name, help_text, labels, callback)
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self._register(Gauge, name, help_text, labels, callback)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Shared series recorded from several modules
+storage_seconds = registry.histogram(
+    'globalassist_storage_seconds', 'Time spent reading and writing storage files', ('op', 'file'))
+provider_seconds = registry.histogram(
+    'globalassist_provider_request_seconds', 'Provider call latency', ('provider', 'mode'))
+provider_requests = registry.counter(
+    'globalassist_provider_requests_total', 'Provider calls by outcome', ('provider', 'mode', 'outcome'))
+provider_tokens = registry.counter(
+    'globalassist_provider_tokens_total', 'Tokens sent to and received from providers', ('provider', 'direction'))
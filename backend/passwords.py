@@ -0,0 +1,131 @@
+"""
+GlobalAssist - Password Hashing
+Runs werkzeug's deliberately slow hash/verify in a small process pool, so a burst
+of logins doesn't hold the GIL and stall every other request.
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from metrics import registry
+
+# Any werkzeug method string, e.g. "scrypt", "scrypt:65536:8:1", "pbkdf2:sha256:600000"
+PASSWORD_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 32))
+
+hash_seconds = registry.histogram(
+    'globalassist_password_hash_seconds', 'Password hash/verify latency, including queueing', ('op',))
+hash_rejected = registry.counter(
+    'globalassist_password_hash_rejected_total', 'Hash requests refused because the queue was full', ('op',))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__('Password hashing is at capacity')
+        self.retry_after = retry_after
+
+
+def hash_method(password_hash):
+    """The method part of a werkzeug hash: 'scrypt:32768:8:1$salt$hex' -> 'scrypt:32768:8:1'"""
+    return password_hash.split('$', 1)[0] if password_hash else ''
+
+
+class PasswordHasher:
+    """
+    At most `workers` hashes run at once and `queue_size` more may wait;
+    beyond that callers get HashingBusy instead of piling up. workers=0 hashes
+    on the calling thread (no pool).
+    """
+
+    def __init__(self, method=PASSWORD_METHOD, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE):
+        self.method = method
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(max(1, workers) + queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._current_method = None
+        self._avg_seconds = 0.1
+
+    def start(self):
+        """Start the worker processes now (call before the app starts its own threads)"""
+        if self.workers:
+            self._get_pool().submit(int).result()
+
+    def reset(self):
+        """Drop the pool without waiting on it"""
+        with self._lock:
+            self._pool = None
+
+    def after_fork(self):
+        """In a forked child: the pool's processes and threads belong to the parent"""
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            hash_rejected.inc(op)
+            raise HashingBusy(max(1, math.ceil(self._avg_seconds * self.queue_size / max(1, self.workers))))
+
+        start = time.perf_counter()
+        try:
+            if not self.workers:
+                return fn(*args)
+            try:
+                return self._get_pool().submit(fn, *args).result()
+            except BrokenProcessPool:
+                # A worker died (OOM kill, ...): replace the pool and retry once
+                print("Password hash pool broke, restarting it")
+                self.reset()
+                return self._get_pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            elapsed = time.perf_counter() - start
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            hash_seconds.observe(op, value=elapsed)
+
+    @property
+    def current_method(self):
+        """PASSWORD_METHOD with werkzeug's defaults filled in, as it appears in new hashes"""
+        if self._current_method is None:
+            self._current_method = hash_method(self.hash(''))
+        return self._current_method
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def needs_rehash(self, password_hash):
+        return hash_method(password_hash) != self.current_method
+
+    def verify(self, password_hash, password):
+        """
+        Returns (ok, new_hash). new_hash is set when the password matched but
+        was stored with old parameters; the caller should save it.
+        """
+        if not password_hash:
+            return False, None
+        if not self._run('verify', check_password_hash, password_hash, password):
+            return False, None
+        if self.needs_rehash(password_hash):
+            return True, self.hash(password)
+        return True, None
+
+
+hasher = PasswordHasher()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=hasher.after_fork)
@@ -0,0 +1,114 @@
+"""
+GlobalAssist - Provider Client Registry
+Builds each provider client once per process and reuses its keep-alive connection pool
+"""
+
+import importlib
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POOL_SIZE = int(os.getenv('AI_POOL_SIZE', 20))
+CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', 5))
+REQUEST_TIMEOUT = float(os.getenv('AI_TIMEOUT', 120))
+KEEPALIVE_EXPIRY = float(os.getenv('AI_KEEPALIVE_EXPIRY', 60))
+MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 2))
+
+API_KEYS = {
+    'anthropic': 'ANTHROPIC_API_KEY',
+    'openai': 'OPENAI_API_KEY'
+}
+
+_clients = {}
+_http_clients = {}
+_lock = threading.Lock()
+
+
+def _http_client():
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=POOL_SIZE,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+    )
+
+def _build_anthropic(http_client):
+    from anthropic import Anthropic
+    return Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), http_client=http_client, max_retries=MAX_RETRIES)
+
+def _build_openai(http_client):
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=http_client, max_retries=MAX_RETRIES)
+
+BUILDERS = {
+    'anthropic': _build_anthropic,
+    'openai': _build_openai
+}
+
+
+def get_client(provider):
+    """Return the shared client for a provider, building it on first use"""
+    client = _clients.get(provider)
+    if client is None:
+        with _lock:
+            client = _clients.get(provider)
+            if client is None:
+                http_client = _http_client()
+                client = BUILDERS[provider](http_client)
+                _http_clients[provider] = http_client
+                _clients[provider] = client
+    return client
+
+
+def warm_up(providers=None):
+    """
+    Build clients for every configured provider and open a pooled connection
+    to each API, so the first generation after a deploy skips the TLS handshake.
+    """
+    warmed = []
+    for provider in providers or BUILDERS:
+        if not os.getenv(API_KEYS[provider]):
+            continue
+        try:
+            client = get_client(provider)
+            _http_clients[provider].head(str(client.base_url))
+            warmed.append(provider)
+        except Exception as e:
+            print(f"Warm-up failed for {provider}: {e}")
+    return warmed
+
+
+def preload():
+    """
+    Import the SDKs without opening any connection, so processes forked from
+    this one share the loaded modules copy-on-write.
+    """
+    for module in ('httpx', 'anthropic', 'openai'):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _forget_clients():
+    """In a forked child: the parent's pooled sockets must not be reused, so build fresh clients"""
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+    _http_clients.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_clients)
+
+
+def close_all():
+    with _lock:
+        for http_client in _http_clients.values():
+            http_client.close()
+        _http_clients.clear()
+        _clients.clear()
@@ -0,0 +1,188 @@
+"""
+GlobalAssist - Admission Control
+Per-user token-bucket rate limiting and monthly message quotas, held in memory
+and persisted periodically
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from storage import file_lock
+
+# Monthly messages per tier, as advertised by /api/payment/plans
+MONTHLY_LIMITS = {
+    'free': int(os.getenv('QUOTA_FREE_MONTHLY', 50)),
+    'pro': int(os.getenv('QUOTA_PRO_MONTHLY', 1000))
+}
+
+# Token bucket per tier: (burst size, tokens refilled per second)
+RATE_LIMITS = {
+    'free': (int(os.getenv('RATE_FREE_BURST', 5)), float(os.getenv('RATE_FREE_PER_MINUTE', 10)) / 60),
+    'pro': (int(os.getenv('RATE_PRO_BURST', 20)), float(os.getenv('RATE_PRO_PER_MINUTE', 60)) / 60)
+}
+
+
+def tier_key(subscription_tier):
+    return 'free' if subscription_tier in (None, '', 'free') else 'pro'
+
+def current_month(now=None):
+    return (now or datetime.utcnow()).strftime('%Y-%m')
+
+def month_reset(now=None):
+    """Start of next month (UTC), when monthly counters reset"""
+    now = now or datetime.utcnow()
+    if now.month == 12:
+        return datetime(now.year + 1, 1, 1)
+    return datetime(now.year, now.month + 1, 1)
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity):
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, capacity, rate, count=1):
+        """Returns 0 if taken, otherwise seconds until enough tokens exist"""
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0
+        return (count - self.tokens) / rate
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, message, info, retry_after):
+        super().__init__(message)
+        self.info = info
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class QuotaManager:
+    """
+    acquire() is a dict lookup and some arithmetic under one lock; monthly
+    counters are written to `filename` every `interval` seconds and at exit.
+
+    Each save adds this process's usage since the last save to the counts on
+    disk (under the file lock) and reads back the total, so several worker
+    processes converge on the same counts within one save interval. Token
+    buckets stay per process.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._month = current_month()
+        self._delta = {}
+        self._used = self._read(self._month)
+
+    def _read(self, month):
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Quota load error: {e}")
+            return {}
+        if data.get('month') != month:
+            return {}
+        return {int(user_id): n for user_id, n in data.get('used', {}).items()}
+
+    def save(self):
+        """Merge our usage into the file and pick up everyone else's"""
+        with self._lock:
+            self._roll_month()
+            month = self._month
+            delta, self._delta = self._delta, {}
+
+        try:
+            with file_lock(self.filename):
+                used = self._read(month)
+                if delta:
+                    for user_id, n in delta.items():
+                        used[user_id] = max(0, used.get(user_id, 0) + n)
+                    tmp = f'{self.filename}.{os.getpid()}.tmp'
+                    with open(tmp, 'w') as f:
+                        json.dump({'month': month, 'used': used}, f)
+                    os.replace(tmp, self.filename)
+        except Exception:
+            with self._lock:
+                for user_id, n in delta.items():
+                    self._delta[user_id] = self._delta.get(user_id, 0) + n
+            raise
+
+        with self._lock:
+            if month == self._month:
+                # Disk totals plus whatever we counted while saving
+                users = set(used) | set(self._delta)
+                self._used = {u: used.get(u, 0) + self._delta.get(u, 0) for u in users}
+
+    def start_persistence(self, interval=30):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"Quota save error: {e}")
+
+        threading.Thread(target=run, name='quota-persist', daemon=True).start()
+
+    def _roll_month(self):
+        month = current_month()
+        if month != self._month:
+            self._month = month
+            self._used = {}
+            self._delta = {}
+
+    def _info(self, user_id, tier):
+        limit = MONTHLY_LIMITS[tier]
+        used = self._used.get(user_id, 0)
+        return {
+            'limit': limit,
+            'used': used,
+            'remaining': max(0, limit - used),
+            'reset_at': month_reset().isoformat() + 'Z'
+        }
+
+    def acquire(self, user_id, subscription_tier, count=1):
+        """Consume `count` messages or raise QuotaExceeded; returns quota info"""
+        tier = tier_key(subscription_tier)
+        capacity, rate = RATE_LIMITS[tier]
+        with self._lock:
+            self._roll_month()
+            info = self._info(user_id, tier)
+            if info['remaining'] < count:
+                retry_after = (month_reset() - datetime.utcnow()).total_seconds()
+                raise QuotaExceeded('Monthly message limit reached', info, retry_after)
+
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(capacity)
+            wait = bucket.take(capacity, rate, min(count, capacity))
+            if wait:
+                raise QuotaExceeded('Too many requests, slow down', info, wait)
+
+            self._used[user_id] = info['used'] + count
+            self._delta[user_id] = self._delta.get(user_id, 0) + count
+            return self._info(user_id, tier)
+
+    def refund(self, user_id, count=1):
+        """Give back messages that were admitted but never served"""
+        with self._lock:
+            if self._used.get(user_id, 0) >= count:
+                self._used[user_id] -= count
+                self._delta[user_id] = self._delta.get(user_id, 0) - count
+
+    def usage(self, user_id, subscription_tier):
+        with self._lock:
+            self._roll_month()
+            return self._info(user_id, tier_key(subscription_tier))
@@ -0,0 +1,210 @@
+"""
+GlobalAssist - Provider Resilience
+Latency tracking, circuit breakers, failover chains and hedged requests
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import provider_requests, provider_seconds
+
+FAILURE_THRESHOLD = int(os.getenv('AI_BREAKER_FAILURES', 5))
+RESET_TIMEOUT = float(os.getenv('AI_BREAKER_RESET', 30))
+HEDGE_ENABLED = os.getenv('AI_HEDGE', '0') == '1'
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 95
+
+# model -> models to try next, e.g. AI_FAILOVER="kiwi-4.5:gpt-3.5,gpt-4:kiwi-opus|kiwi-4.5"
+DEFAULT_FAILOVER = 'kiwi-4.5:gpt-3.5,kiwi-opus:gpt-4,gpt-4:kiwi-opus,gpt-3.5:kiwi-4.5'
+
+
+def parse_failover(spec):
+    chains = {}
+    for rule in filter(None, (r.strip() for r in spec.split(','))):
+        model_id, _, fallbacks = rule.partition(':')
+        chains[model_id.strip()] = [f.strip() for f in fallbacks.split('|') if f.strip()]
+    return chains
+
+FAILOVER = parse_failover(os.getenv('AI_FAILOVER', DEFAULT_FAILOVER))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class LatencyTracker:
+    """Rolling window of recent call durations"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    closed:    calls flow; FAILURE_THRESHOLD consecutive failures open it
+    open:      calls are refused until RESET_TIMEOUT has passed
+    half_open: one trial call; success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+
+class ProviderHealth:
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'calls': self.calls,
+            'errors': self.errors,
+            'p50': self.latency.percentile(50),
+            'p95': self.latency.percentile(95)
+        }
+
+
+_health = {}
+_health_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv('AI_HEDGE_WORKERS', 16)), thread_name_prefix='ai-hedge')
+
+
+def health(provider):
+    with _health_lock:
+        if provider not in _health:
+            _health[provider] = ProviderHealth()
+        return _health[provider]
+
+def health_stats():
+    return {provider: h.stats() for provider, h in list(_health.items())}
+
+
+def guarded_call(provider, fn, *args):
+    """Call fn through the provider's circuit breaker, recording latency and outcome"""
+    h = health(provider)
+    if not h.breaker.allow():
+        provider_requests.inc(provider, 'call', 'rejected')
+        raise CircuitOpen(f'{provider} circuit is open')
+
+    h.calls += 1
+    start = time.monotonic()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        print(f"{provider} error: {e}")
+        h.errors += 1
+        h.breaker.record_failure()
+        provider_requests.inc(provider, 'call', 'error')
+        raise
+    elapsed = time.monotonic() - start
+    h.latency.record(elapsed)
+    h.breaker.record_success()
+    provider_seconds.observe(provider, 'call', value=elapsed)
+    provider_requests.inc(provider, 'call', 'ok')
+    return result
+
+
+def hedge_delay(provider):
+    """p95 latency of the provider, once there are enough samples to trust it"""
+    h = health(provider)
+    if len(h.latency) < HEDGE_MIN_SAMPLES:
+        return None
+    return h.latency.percentile(HEDGE_PERCENTILE)
+
+
+def call_with_failover(candidates, hedge=HEDGE_ENABLED):
+    """
+    candidates: [(provider, fn, args), ...] in preference order.
+
+    Tries each candidate in turn, skipping providers whose circuit is open.
+    With hedging, if the first live candidate hasn't answered within its p95
+    latency, the next one is started too and whichever finishes first wins.
+    Raises the last error if every candidate fails.
+    """
+    last_error = CircuitOpen('no provider available')
+    remaining = list(candidates)
+
+    while remaining:
+        provider, fn, args = remaining.pop(0)
+        delay = hedge_delay(provider) if hedge and remaining else None
+
+        if delay is None:
+            try:
+                return guarded_call(provider, fn, *args)
+            except Exception as e:
+                last_error = e
+                continue
+
+        primary = _hedge_pool.submit(guarded_call, provider, fn, *args)
+        done, _ = wait([primary], timeout=delay)
+        if done and primary.exception() is None:
+            return primary.result()
+        if done:
+            last_error = primary.exception()
+            continue
+
+        # Primary is slow: fire the hedge and take whichever finishes first
+        hedge_provider, hedge_fn, hedge_args = remaining.pop(0)
+        backup = _hedge_pool.submit(guarded_call, hedge_provider, hedge_fn, *hedge_args)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                last_error = future.exception()
+
+    raise last_error
@@ -0,0 +1,126 @@
+"""
+GlobalAssist - Response Parser
+Splits a model reply into fenced code blocks (with their language) and the prose
+around them, in one pass, from the whole text or from streamed chunks.
+"""
+
+DEFAULT_EXPLANATION = 'Code generated successfully'
+FENCE_CHARS = ('`', '~')
+
+
+def _fence(line):
+    """(fence_string, info) if the line opens or closes a fence, else None"""
+    stripped = line.lstrip(' ')
+    if len(line) - len(stripped) > 3 or stripped[:1] not in FENCE_CHARS:
+        return None
+    char = stripped[0]
+    length = len(stripped) - len(stripped.lstrip(char))
+    if length < 3:
+        return None
+    info = stripped[length:].strip()
+    if char == '`' and '`' in info:
+        return None
+    return stripped[:length], info
+
+
+class ResponseParser:
+    """
+    Feed text with feed(chunk) as it arrives, then call close() for the result.
+    Only the unfinished last line is buffered, so each character is looked at
+    once no matter how the reply is chunked.
+
+        parser = ResponseParser()
+        for text in stream:
+            for block in parser.feed(text):
+                ...  # a code block just closed
+        result = parser.close()
+    """
+
+    def __init__(self, default_explanation=DEFAULT_EXPLANATION):
+        self.default_explanation = default_explanation
+        self.blocks = []
+        self._prose = []
+        self._partial = []
+        self._open = None
+        self._language = ''
+        self._code = []
+        self._closed = None
+
+    def feed(self, chunk):
+        """Consume a piece of text; returns the code blocks it completed"""
+        if '\n' not in chunk:
+            self._partial.append(chunk)
+            return []
+
+        self._partial.append(chunk)
+        lines = ''.join(self._partial).split('\n')
+        self._partial = [lines.pop()]
+
+        completed = []
+        for line in lines:
+            block = self._line(line[:-1] if line.endswith('\r') else line)
+            if block is not None:
+                completed.append(block)
+        return completed
+
+    def _line(self, line):
+        fence = _fence(line)
+        if self._open is None:
+            if fence is None:
+                self._prose.append(line)
+            else:
+                self._open = fence[0]
+                self._language = fence[1].split()[0].lower() if fence[1] else ''
+            return None
+
+        if fence is not None and not fence[1] and fence[0][0] == self._open[0] and len(fence[0]) >= len(self._open):
+            return self._finish_block()
+        self._code.append(line)
+        return None
+
+    def _finish_block(self):
+        block = {'language': self._language, 'code': '\n'.join(self._code)}
+        self.blocks.append(block)
+        self._open = None
+        self._language = ''
+        self._code = []
+        return block
+
+    def close(self):
+        """
+        Flush the last line and return {'code', 'explanation', 'language', 'blocks'}.
+        An unterminated block (e.g. an interrupted stream) keeps what arrived.
+        Replies without any fence are treated as all code, as before.
+        """
+        if self._closed is not None:
+            return self._closed
+
+        tail = ''.join(self._partial)
+        self._partial = []
+        if tail:
+            self._line(tail)
+        if self._open is not None:
+            self._finish_block()
+
+        prose = '\n'.join(self._prose).strip()
+        if self.blocks:
+            code = '\n\n'.join(block['code'] for block in self.blocks)
+            explanation = prose or self.default_explanation
+        else:
+            code = prose
+            explanation = self.default_explanation
+
+        self._closed = {
+            'code': code,
+            'explanation': explanation,
+            'language': self.blocks[0]['language'] if self.blocks else '',
+            'blocks': self.blocks
+        }
+        return self._closed
+
+
+def parse_response(content, default_explanation=DEFAULT_EXPLANATION):
+    """Parse a complete reply in one go"""
+    parser = ResponseParser(default_explanation)
+    parser.feed(content)
+    return parser.close()
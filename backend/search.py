@@ -0,0 +1,160 @@
+"""
+GlobalAssist - History Search
+Per-user inverted index over history entries, updated incrementally as entries change
+"""
+
+import heapq
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+
+from history_record import entry_payload
+
+TOKEN_RE = re.compile(r'[a-z0-9_]+')
+
+# Matches in the title count more than matches deep in the generated code.
+# Whole numbers, so weighted term frequencies fit the index's integer arrays
+FIELD_WEIGHTS = {
+    'title': 3,
+    'prompt': 2,
+    'explanation': 1,
+    'content': 1
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+def entry_fields(entry):
+    content, metadata = entry_payload(entry)
+    return {
+        'title': entry.get('title', ''),
+        'prompt': metadata.get('prompt', ''),
+        'explanation': metadata.get('explanation', ''),
+        'content': content
+    }
+
+
+class SearchIndex:
+    """
+    Postings are kept per user, so a query only ever touches the caller's own
+    entries, and ranked with BM25. Terms are interned to integer ids; each
+    posting is an array('I') of entry id, field-weighted term frequency pairs,
+    and document lengths live in an array indexed by entry id.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._term_ids = {}
+        # user_id -> {term_id: array('I', [entry_id, tf, entry_id, tf, ...])}
+        self._postings = {}
+        # entry_id -> array('I', [user_id, term_id, term_id, ...])
+        self._docs = {}
+        self._lengths = array('I')
+        self._user_stats = {}
+
+    def _terms(self, entry):
+        counts = Counter()
+        for field, text in entry_fields(entry).items():
+            counts.update(tokenize(text) * FIELD_WEIGHTS[field])
+        return counts
+
+    def add(self, entry):
+        counts = self._terms(entry)
+        entry_id = entry['id']
+        with self._lock:
+            if entry_id in self._docs:
+                self.remove(entry_id)
+
+            user_id = entry['user_id']
+            postings = self._postings.setdefault(user_id, {})
+            term_ids = self._term_ids
+            doc = array('I', [user_id])
+            for term, tf in counts.items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(term_ids)
+                posting = postings.get(term_id)
+                if posting is None:
+                    postings[term_id] = array('I', (entry_id, tf))
+                else:
+                    posting.extend((entry_id, tf))
+                doc.append(term_id)
+
+            length = sum(counts.values())
+            if entry_id >= len(self._lengths):
+                self._lengths.frombytes(bytes(self._lengths.itemsize * (entry_id + 1 - len(self._lengths))))
+            self._lengths[entry_id] = length
+            self._docs[entry_id] = doc
+            docs, total_length = self._user_stats.get(user_id, (0, 0))
+            self._user_stats[user_id] = (docs + 1, total_length + length)
+
+    def remove(self, entry_id):
+        with self._lock:
+            doc = self._docs.pop(entry_id, None)
+            if doc is None:
+                return
+            user_id = doc[0]
+            postings = self._postings[user_id]
+            for term_id in doc[1:]:
+                posting = postings[term_id]
+                # Entry ids sit at even positions, frequencies at odd ones
+                for i in range(0, len(posting), 2):
+                    if posting[i] == entry_id:
+                        del posting[i:i + 2]
+                        break
+                if not posting:
+                    del postings[term_id]
+            if not postings:
+                del self._postings[user_id]
+
+            length = self._lengths[entry_id]
+            self._lengths[entry_id] = 0
+            docs, total_length = self._user_stats[user_id]
+            if docs <= 1:
+                del self._user_stats[user_id]
+            else:
+                self._user_stats[user_id] = (docs - 1, total_length - length)
+
+    def handle(self, op, entry):
+        """Table change listener"""
+        if op == 'put':
+            self.add(entry)
+        else:
+            self.remove(entry['id'])
+
+    def search(self, user_id, query, limit=20, offset=0):
+        """Return ([(entry_id, score), ...], total_matches), best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            docs, total_length = self._user_stats.get(user_id, (0, 0))
+            if not terms or not docs:
+                return [], 0
+            avg_length = total_length / docs
+            postings = self._postings[user_id]
+            lengths = self._lengths
+
+            scores = {}
+            for term in terms:
+                posting = postings.get(self._term_ids.get(term))
+                if not posting:
+                    continue
+                matches = len(posting) // 2
+                idf = math.log(1 + (docs - matches + 0.5) / (matches + 0.5))
+                for i in range(0, len(posting), 2):
+                    entry_id, tf = posting[i], posting[i + 1]
+                    norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[entry_id] / avg_length))
+                    scores[entry_id] = scores.get(entry_id, 0.0) + idf * norm
+
+        # Ties go to the newest entry
+        top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [(entry_id, round(score, 4)) for entry_id, score in top[offset:]], len(scores)
+
+    def __len__(self):
+        return len(self._docs)
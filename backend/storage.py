@@ -0,0 +1,966 @@
+"""
+GlobalAssist - Indexed JSON Storage
+Keeps each JSON file in memory with hash indexes so lookups don't rescan the file.
+Writes from all request threads go through one group-commit writer.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import storage_seconds
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks are only process-local
+    fcntl = None
+
+SCHEMA_VERSION = 2
+COMMIT_WINDOW = float(os.getenv('STORAGE_COMMIT_WINDOW_MS', 5)) / 1000
+# Several processes serve from the same files (prefork): re-check them on reads
+SHARED = os.getenv('STORAGE_SHARED') == '1'
+
+
+def file_label(filename):
+    """Metrics label for a data file: 'data/history.json.123.tmp' -> 'history.json'"""
+    name = os.path.basename(filename)
+    return name[:name.index('.json') + 5] if '.json' in name else name
+
+def read_json(filename):
+    with storage_seconds.time('read', file_label(filename)):
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+def write_json(filename, data):
+    with storage_seconds.time('write', file_label(filename)):
+        with open(filename, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+def read_json_header(filename, size=4096):
+    """
+    The fields a snapshot stores before 'records' (next_id, journal, ...),
+    without reading the records. {} if there's no such file or header.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            head = f.read(size)
+    except FileNotFoundError:
+        return {}
+    end = head.find(b'"records":')
+    if not head.startswith(b'{') or end < 0:
+        return {}
+    try:
+        return json.loads(head[:end] + b'"records":[]}')
+    except ValueError:
+        return {}
+
+def write_json_atomic(filename, data, fsync=False):
+    """Write to a temp file and rename it over the target, so readers never see a partial file"""
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with storage_seconds.time('write', file_label(filename)):
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, filename)
+
+
+@contextmanager
+def file_lock(filename):
+    """Exclusive inter-process lock on <filename>.lock"""
+    with open(filename + '.lock', 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def migrate(filename):
+    """
+    One-shot migration of a legacy file (a bare JSON list) to the indexed
+    format. The original file is kept next to it as <name>.v1.bak.
+    Returns True if the file was migrated.
+    """
+    if not os.path.exists(filename):
+        return False
+
+    data = read_json(filename)
+    if not isinstance(data, list):
+        return False
+
+    if os.path.basename(filename) == 'sessions.json':
+        now = datetime.utcnow()
+        data = [s for s in data if datetime.fromisoformat(s['expires_at']) > now]
+
+    # Legacy ids were len(list) + 1, which repeats after a delete: give every
+    # repeat a fresh id so loading (keyed by id) doesn't drop records
+    next_id = max((r['id'] for r in data if isinstance(r.get('id'), int)), default=0) + 1
+    seen = set()
+    renumbered = 0
+    for record in data:
+        if not isinstance(record.get('id'), int):
+            continue
+        if record['id'] in seen:
+            record['id'] = next_id
+            next_id += 1
+            renumbered += 1
+        seen.add(record['id'])
+    if renumbered:
+        print(f"Migrating {filename}: renumbered {renumbered} records with duplicate ids")
+
+    os.replace(filename, filename + '.v1.bak')
+    write_json(filename, {
+        'schema': SCHEMA_VERSION,
+        'next_id': next_id,
+        'records': data
+    })
+    return True
+
+
+class DuplicateKey(Exception):
+    """An insert or update would give two records the same value of a unique field"""
+
+    def __init__(self, field, value):
+        super().__init__(f'{field} {value!r} already exists')
+        self.field = field
+        self.value = value
+
+
+class GroupCommitWriter:
+    """
+    Single background writer shared by every table in the process.
+
+    Mutations are applied in memory right away and queued here. The writer
+    waits one commit window for more to arrive, then persists each dirty table
+    once for the whole batch. Callers block until their batch is on disk, so
+    a burst of N requests costs one write per table instead of N.
+    """
+
+    def __init__(self, window=COMMIT_WINDOW):
+        self.window = window
+        self._reset_state()
+        self.commits = 0
+        self.ops = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.errors = 0
+
+    def _reset_state(self):
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._pending = {}
+        self._enqueued = 0
+        self._committed = 0
+        self._thread = None
+        self._closed = False
+
+    def after_fork(self):
+        """In a forked child: the writer thread didn't survive and queued work is the parent's"""
+        self._reset_state()
+
+    def pending(self, table):
+        """Mutations queued for table but not yet handed to a commit"""
+        with self._cond:
+            return list(self._pending.get(table, ()))
+
+    def submit(self, table, op, record):
+        """Queue one mutation and return a ticket for wait()"""
+        with self._cond:
+            self._pending.setdefault(table, []).append((op, record))
+            self._enqueued += 1
+            ticket = self._enqueued
+            if not self._closed and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='storage-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        if self._closed:
+            # Shutting down: nobody is left to commit for us
+            self.flush()
+        return ticket
+
+    def wait(self, ticket):
+        with self._cond:
+            while self._committed < ticket:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            # Let concurrent requests join this commit
+            time.sleep(self.window)
+            self.flush()
+
+    def flush(self):
+        """Commit everything queued so far (also used on shutdown)"""
+        with self._commit_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                upto = self._enqueued
+            if not pending:
+                return 0
+
+            batch_size = sum(len(batch) for batch in pending.values())
+            for table, batch in pending.items():
+                try:
+                    with storage_seconds.time('commit', file_label(table.filename)):
+                        table._commit(batch)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Storage commit error for {table.filename}: {e}")
+
+            with self._cond:
+                self._committed = max(self._committed, upto)
+                self.commits += 1
+                self.ops += batch_size
+                self.last_batch = batch_size
+                self.max_batch = max(self.max_batch, batch_size)
+                self._cond.notify_all()
+            return batch_size
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        return {
+            'commits': self.commits,
+            'ops': self.ops,
+            'avg_batch': round(self.ops / self.commits, 2) if self.commits else 0.0,
+            'last_batch': self.last_batch,
+            'max_batch': self.max_batch,
+            'errors': self.errors,
+            'window_ms': self.window * 1000
+        }
+
+
+writer = GroupCommitWriter()
+atexit.register(writer.close)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=writer.after_fork)
+
+
+class Table:
+    """
+    A JSON file held in memory as {key: record} with hash indexes.
+
+    unique: fields with one record per value (e.g. email); insert and update
+            raise DuplicateKey rather than take a value another record has
+    multi:  fields with many records per value (e.g. user_id); each value keeps
+            a sorted list of keys, so per-value pages don't scan the table
+
+    Commits rewrite the file atomically under an inter-process lock. If another
+    process changed the file since we last saw it, its records are merged in
+    and our pending mutations are replayed on top, so neither side loses data.
+    With shared=True, reads and mutations also pick up other processes' commits
+    first (one stat() when nothing changed).
+
+    record_type: optional class holding records in memory in another form;
+    record_type.from_value(dict) builds one, record.to_stored() gives back
+    the dict written to disk. Records must still support [] and get().
+    """
+
+    def __init__(self, filename, key='id', unique=(), multi=(), fsync=False, shared=SHARED, record_type=None):
+        self.filename = filename
+        self.record_type = record_type
+        self.key = key
+        self.fsync = fsync
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.next_id = 1
+        self._records = {}
+        self._unique = {field: {} for field in unique}
+        self._multi = {field: {} for field in multi}
+        self._listeners = []
+        self._stamp = None
+        self.load()
+
+    def on_change(self, listener, replay=True):
+        """
+        Call listener(op, record) with op 'put' or 'del' after every change,
+        including changes merged in from other processes. With replay, the
+        listener first receives a 'put' for every existing record.
+        """
+        with self.lock:
+            self._listeners.append(listener)
+            if replay:
+                for record in self._records.values():
+                    listener('put', record)
+
+    # ----- persistence -----
+
+    def _reset(self, records, batch=()):
+        """
+        Replace every record with `records`, then apply `batch` (pending
+        mutations) on top. Reads take no lock, so the new records and indexes
+        are built off to the side and swapped in whole: a reader sees either
+        the old table or the new one, never a half-built one.
+        """
+        new_records = {}
+        unique = {field: {} for field in self._unique}
+        multi = {field: {} for field in self._multi}
+        for record in records:
+            self._index(self._wrap(record), new_records, unique, multi)
+        for op, record in batch:
+            existing = new_records.get(record[self.key])
+            if existing is not None:
+                self._unindex(existing, new_records, unique, multi)
+            if op == 'put':
+                self._index(record, new_records, unique, multi)
+
+        old = self._records
+        # Records first: a reader holding an old index then still finds its records
+        self._records = new_records
+        self._unique = unique
+        self._multi = multi
+        if not self._listeners:
+            return
+        # Listeners only hear about what actually changed (a reload after
+        # another process's write usually changes a handful of records)
+        for key, record in old.items():
+            if new_records.get(key) != record:
+                for listener in self._listeners:
+                    listener('del', record)
+        for key, record in new_records.items():
+            if old.get(key) != record:
+                for listener in self._listeners:
+                    listener('put', record)
+
+    def _wrap(self, record):
+        if self.record_type and not isinstance(record, self.record_type):
+            return self.record_type.from_value(record)
+        return record
+
+    def _stored(self, record):
+        return record.to_stored() if self.record_type else record
+
+    def _read_snapshot(self):
+        data = read_json(self.filename) if os.path.exists(self.filename) else []
+        if isinstance(data, list):
+            data = {'next_id': 1, 'records': data}
+        return data
+
+    def load(self, batch=()):
+        with self.lock:
+            stamp = _file_stamp(self.filename)
+            self._load_snapshot(stamp, self._read_snapshot(), batch)
+
+    def _load_snapshot(self, stamp, data, batch=()):
+        with self.lock:
+            self._reset(data['records'], batch)
+
+            self.next_id = data.get('next_id', 1)
+            ids = [k for k in self._records if isinstance(k, int)]
+            if ids:
+                self.next_id = max(self.next_id, max(ids) + 1)
+            # Last: until the reload is complete, other threads' refresh() must not skip it
+            self._stamp = stamp
+
+    def _snapshot(self):
+        return {
+            'schema': SCHEMA_VERSION,
+            'next_id': self.next_id,
+            'records': [self._stored(r) for r in self._records.values()]
+        }
+
+    def save(self):
+        with file_lock(self.filename), self.lock:
+            write_json_atomic(self.filename, self._snapshot(), self.fsync)
+            self._stamp = _file_stamp(self.filename)
+
+    def _persist(self, op, record):
+        """Queue one mutation with the group-commit writer"""
+        return writer.submit(self, op, record)
+
+    def _replay(self, batch):
+        for op, record in batch:
+            if op == 'put':
+                self._put(record)
+            else:
+                existing = self._records.get(record[self.key])
+                if existing is not None:
+                    self._remove(existing)
+
+    def refresh(self):
+        """Reload if another process committed since we last looked (shared mode)"""
+        if not self.shared or _file_stamp(self.filename) == self._stamp:
+            return
+        with file_lock(self.filename), self.lock:
+            if _file_stamp(self.filename) != self._stamp:
+                # Plus our own mutations still waiting for the writer
+                self.load(writer.pending(self))
+
+    def _commit(self, batch):
+        """Called by the writer: persist a batch of mutations in one atomic rewrite"""
+        with file_lock(self.filename):
+            with self.lock:
+                if _file_stamp(self.filename) != self._stamp:
+                    # Another process wrote since we loaded: merge, then replay ours
+                    data = self._read_snapshot()
+                    self._reset(data['records'], batch)
+                    self.next_id = max(self.next_id, data.get('next_id', 1))
+                elif self.shared:
+                    # A refresh may have reloaded after this batch left the queue
+                    self._replay(batch)
+                snapshot = json.dumps(self._snapshot(), separators=(',', ':'))
+
+            tmp = f'{self.filename}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(snapshot)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+            self._stamp = _file_stamp(self.filename)
+
+    def _allocate_id(self):
+        """Next id from a sequence shared by every process using this file"""
+        seq_file = self.filename + '.seq'
+        with file_lock(seq_file):
+            try:
+                with open(seq_file) as f:
+                    seq = int(f.read() or 0)
+            except FileNotFoundError:
+                seq = 0
+            new_id = max(seq, self.next_id)
+            with open(seq_file, 'w') as f:
+                f.write(str(new_id + 1))
+        self.next_id = new_id + 1
+        return new_id
+
+    # ----- indexing -----
+
+    @staticmethod
+    def _multi_add(index, value, key):
+        keys = index.setdefault(value, [])
+        if not keys or keys[-1] < key:
+            keys.append(key)
+        else:
+            bisect.insort(keys, key)
+
+    @staticmethod
+    def _multi_remove(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+            if not keys:
+                del index[value]
+
+    def _index(self, record, records, unique, multi):
+        key = record[self.key]
+        records[key] = record
+        for field, index in unique.items():
+            if record.get(field) is not None:
+                index[record[field]] = key
+        for field, index in multi.items():
+            if record.get(field) is not None:
+                self._multi_add(index, record[field], key)
+
+    def _unindex(self, record, records, unique, multi):
+        key = record[self.key]
+        del records[key]
+        for field, index in unique.items():
+            if index.get(record.get(field)) == key:
+                del index[record[field]]
+        for field, index in multi.items():
+            self._multi_remove(index, record.get(field), key)
+
+    def _index_values(self, record):
+        return {field: record.get(field) for field in (*self._unique, *self._multi)}
+
+    def _add(self, record):
+        self._index(record, self._records, self._unique, self._multi)
+        for listener in self._listeners:
+            listener('put', record)
+
+    def _remove(self, record):
+        self._unindex(record, self._records, self._unique, self._multi)
+        for listener in self._listeners:
+            listener('del', record)
+
+    def _put(self, record, old=None):
+        """
+        Add a record, or replace the stored one with the same key without a
+        moment where lookups miss it. old: the stored record's index values,
+        when it was changed in place and no longer has them.
+        """
+        key = record[self.key]
+        existing = self._records.get(key)
+        if existing is None:
+            return self._add(record)
+        if old is None:
+            old = self._index_values(existing)
+        for listener in self._listeners:
+            listener('del', existing)
+
+        self._records[key] = record
+        for field, index in self._unique.items():
+            value = record.get(field)
+            if value is not None:
+                index[value] = key
+            if old[field] != value and index.get(old[field]) == key:
+                del index[old[field]]
+        for field, index in self._multi.items():
+            value = record.get(field)
+            if old[field] != value:
+                if value is not None:
+                    self._multi_add(index, value, key)
+                self._multi_remove(index, old[field], key)
+        for listener in self._listeners:
+            listener('put', record)
+
+    def _check_unique(self, record, key=None):
+        """Raise DuplicateKey if a unique value of record belongs to a record other than `key`"""
+        for field, index in self._unique.items():
+            value = record.get(field)
+            if value is not None and index.get(value, key) != key:
+                raise DuplicateKey(field, value)
+
+    # ----- queries -----
+
+    def get(self, key):
+        self.refresh()
+        return self._records.get(key)
+
+    def find(self, field, value):
+        """Lookup on a unique index"""
+        self.refresh()
+        key = self._unique[field].get(value)
+        return self._records.get(key) if key is not None else None
+
+    def group(self, field, value):
+        """All records sharing a value on a multi index, in key order"""
+        self.refresh()
+        keys = list(self._multi[field].get(value, ()))
+        return [self._records[k] for k in keys if k in self._records]
+
+    def count(self, field, value):
+        self.refresh()
+        return len(self._multi[field].get(value, ()))
+
+    def page(self, field, value, before=None, limit=20, where=None):
+        """
+        Keyset page over a multi index, newest (highest key) first.
+        Returns (records, next_cursor); pass next_cursor back as `before`.
+        """
+        self.refresh()
+        if limit < 1:
+            return [], None
+        keys = self._multi[field].get(value, [])
+        end = len(keys) if before is None else bisect.bisect_left(keys, before)
+
+        records = []
+        i = end - 1
+        # Look one past the page to know whether an older page exists
+        while i >= 0 and len(records) <= limit:
+            record = self._records.get(keys[i])
+            if record is not None and (where is None or where(record)):
+                records.append(record)
+            i -= 1
+
+        if len(records) > limit:
+            records = records[:limit]
+            return records, records[-1][self.key]
+        return records, None
+
+    def all(self):
+        self.refresh()
+        return list(self._records.values())
+
+    def __len__(self):
+        return len(self._records)
+
+    # ----- mutations -----
+    # Each applies the change in memory under the table lock, then waits for
+    # the writer outside it so concurrent requests share one commit.
+
+    def insert(self, record):
+        return self.insert_many([record])[0]
+
+    def insert_many(self, records):
+        """Insert several records; they are persisted in the same commit"""
+        ticket = None
+        self.refresh()
+        with self.lock:
+            if self._unique:
+                batch = {field: set() for field in self._unique}
+                for record in records:
+                    self._check_unique(record, record.get(self.key))
+                    for field, seen in batch.items():
+                        if record.get(field) is not None:
+                            if record[field] in seen:
+                                raise DuplicateKey(field, record[field])
+                            seen.add(record[field])
+            for record in records:
+                if self.key == 'id' and record.get('id') is None:
+                    record['id'] = self._allocate_id()
+                stored = self._wrap(record)
+                self._add(stored)
+                ticket = self._persist('put', stored)
+        if ticket:
+            writer.wait(ticket)
+        return records
+
+    def update(self, key, **changes):
+        self.refresh()
+        with self.lock:
+            record = self._records.get(key)
+            if record is None:
+                return None
+            if self._unique:
+                self._check_unique({field: changes.get(field, record.get(field)) for field in self._unique}, key)
+            old = self._index_values(record)
+            record.update(changes)
+            self._put(record, old)
+            ticket = self._persist('put', record)
+        writer.wait(ticket)
+        return record
+
+    def delete(self, key):
+        self.refresh()
+        with self.lock:
+            record = self._records.get(key)
+            if record is None:
+                return None
+            self._remove(record)
+            ticket = self._persist('del', record)
+        writer.wait(ticket)
+        return record
+
+    def delete_where(self, predicate):
+        ticket = None
+        self.refresh()
+        with self.lock:
+            doomed = [r for r in self._records.values() if predicate(r)]
+            for record in doomed:
+                self._remove(record)
+                ticket = self._persist('del', record)
+        if ticket:
+            writer.wait(ticket)
+        return len(doomed)
+
+
+class JournaledTable(Table):
+    """
+    A Table persisted as a snapshot plus an append-only journal.
+
+    Every mutation appends one JSON line to <file>.journal ("put" with the full
+    record, "del" with a tombstone) instead of rewriting the snapshot. A
+    background compactor periodically folds the journal into a new snapshot.
+    Loading replays snapshot -> rotated journal -> journal; a torn last line
+    from a crash is dropped.
+
+    Several processes may append to the same journal: before each append we
+    replay whatever the others added since our last read.
+    """
+
+    def __init__(self, filename, key='id', unique=(), multi=(), fsync=False, shared=SHARED, record_type=None):
+        self.journal_file = filename + '.journal'
+        self.rotated_file = filename + '.journal.1'
+        self.journal_ops = 0
+        self._journal_ino = None
+        self._journal_handle = None
+        self._journal_offset = 0
+        self._compact_lock = threading.Lock()
+        super().__init__(filename, key=key, unique=unique, multi=multi, fsync=fsync, shared=shared,
+                         record_type=record_type)
+
+    # ----- recovery -----
+
+    def load(self):
+        with file_lock(self.filename), self.lock:
+            super().load()
+            self.journal_ops = self._replay_file(self.rotated_file)
+            self._follow(None)
+            self._journal_offset = 0
+            self._catch_up()
+
+    def refresh(self):
+        """Replay what other processes appended since we last looked (shared mode)"""
+        if not self.shared:
+            return
+        stamp = _file_stamp(self.journal_file)
+        if stamp is not None and stamp[0] == self._journal_ino and stamp[2] == self._journal_offset:
+            return
+        snapshot = None
+        if stamp is not None and self._needs_reload(stamp[0]):
+            # Read the new snapshot before taking the locks, so appends and
+            # other threads aren't held up while it's parsed
+            snapshot = self._prepare_snapshot()
+        with file_lock(self.filename), self.lock:
+            self._catch_up(snapshot)
+            self._replay(writer.pending(self))
+
+    def _replay_file(self, path, offset=0, repair=True):
+        """Apply journal lines from `offset`; returns the number of ops applied"""
+        if not os.path.exists(path):
+            return 0
+
+        ops = 0
+        good_offset = offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(entry)
+                good_offset += len(line)
+                ops += 1
+
+        if path == self.journal_file:
+            self._journal_offset = good_offset
+        if repair and good_offset < os.path.getsize(path):
+            print(f"Recovered {path}: dropped a torn record at byte {good_offset}")
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+        return ops
+
+    def _apply(self, entry):
+        if entry['op'] == 'put':
+            record = self._wrap(entry['record'])
+            self._put(record)
+            if isinstance(record[self.key], int):
+                self.next_id = max(self.next_id, record[self.key] + 1)
+        elif entry['op'] == 'del':
+            existing = self._records.get(entry['key'])
+            if existing is not None:
+                self._remove(existing)
+
+    def _follow(self, path):
+        """
+        Make `path` (None: nothing) the journal we're reading. It stays open:
+        an inode is only reused once no one holds the file, so a new journal
+        can never pass for the one we're comparing against.
+        """
+        if self._journal_handle is not None:
+            self._journal_handle.close()
+        self._journal_handle = open(path, 'rb') if path else None
+        self._journal_ino = os.fstat(self._journal_handle.fileno()).st_ino if path else None
+
+    def _needs_reload(self, journal_ino):
+        """
+        True if another process compacted and the new snapshot holds changes
+        we haven't read. compact() records the journal it folded (inode and
+        size) in the snapshot header: if that's exactly the journal we've
+        read to the end, our records already match the snapshot.
+        """
+        if self._journal_ino is None or journal_ino == self._journal_ino:
+            return False
+        rotated = _file_stamp(self.rotated_file)
+        if rotated and rotated[0] == self._journal_ino:
+            # Still being compacted: we can finish reading the old journal
+            return False
+        folded = read_json_header(self.filename).get('journal')
+        return folded != {'ino': self._journal_ino, 'size': self._journal_offset}
+
+    def _prepare_snapshot(self):
+        """(stamp, snapshot) with the records already wrapped, for _load_snapshot"""
+        stamp = _file_stamp(self.filename)
+        data = self._read_snapshot()
+        data['records'] = [self._wrap(r) for r in data['records']]
+        return stamp, data
+
+    def _catch_up(self, snapshot=None):
+        """
+        Replay lines other processes appended (caller holds the file lock and
+        table lock). snapshot: from _prepare_snapshot, used if a reload is
+        needed and the file hasn't changed since.
+        """
+        stamp = _file_stamp(self.journal_file)
+        if stamp is None:
+            open(self.journal_file, 'a').close()
+            stamp = _file_stamp(self.journal_file)
+
+        if self._journal_ino is not None and stamp[0] != self._journal_ino:
+            # Another process compacted. If the old journal is still around,
+            # finish reading it; if the snapshot folded exactly what we've
+            # read, there's nothing to load; otherwise reload the snapshot.
+            rotated = _file_stamp(self.rotated_file)
+            if rotated and rotated[0] == self._journal_ino:
+                self.journal_ops += self._replay_file(self.rotated_file, self._journal_offset, repair=False)
+            else:
+                if self._needs_reload(stamp[0]):
+                    if snapshot is None or snapshot[0] != _file_stamp(self.filename):
+                        snapshot = self._prepare_snapshot()
+                    self._load_snapshot(*snapshot)
+                else:
+                    self._stamp = _file_stamp(self.filename)
+                # Another compaction may already have rotated the journal after that one
+                self.journal_ops = self._replay_file(self.rotated_file, repair=False)
+            self._journal_offset = 0
+
+        if stamp[0] != self._journal_ino:
+            self._follow(self.journal_file)
+        if stamp[2] > self._journal_offset:
+            self.journal_ops += self._replay_file(self.journal_file, self._journal_offset)
+
+    # ----- journal -----
+
+    def _commit(self, batch):
+        """Called by the writer: append a batch of mutations with one write"""
+        with file_lock(self.filename):
+            with self.lock:
+                self._catch_up()
+                self._replay(batch)
+                lines = []
+                for op, record in batch:
+                    if op == 'put':
+                        entry = {'op': 'put', 'record': self._stored(record)}
+                    else:
+                        entry = {'op': 'del', 'key': record[self.key]}
+                    lines.append(json.dumps(entry, separators=(',', ':')))
+                data = ('\n'.join(lines) + '\n').encode()
+
+            with open(self.journal_file, 'ab') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._journal_offset += len(data)
+            self.journal_ops += len(batch)
+
+    # ----- compaction -----
+
+    def _fold(self, path):
+        """
+        Snapshot + rotated journal, read from disk, as a new snapshot dict.
+        Its 'journal' header names the journal folded in and how much of it,
+        so processes that had read exactly that much can skip reloading.
+        """
+        data = self._read_snapshot()
+        records = {r[self.key]: r for r in data['records']}
+        next_id = data.get('next_id', 1)
+        journal = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                journal = {'ino': os.fstat(f.fileno()).st_ino, 'size': 0}
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    entry = json.loads(line)
+                    journal['size'] += len(line)
+                    if entry['op'] == 'put':
+                        key = entry['record'][self.key]
+                        records[key] = entry['record']
+                        if isinstance(key, int):
+                            next_id = max(next_id, key + 1)
+                    else:
+                        records.pop(entry['key'], None)
+        # Everything before 'records' can be read back with read_json_header()
+        return {'schema': SCHEMA_VERSION, 'next_id': next_id, 'journal': journal, 'records': list(records.values())}
+
+    def compact(self):
+        """
+        Fold the journal into a fresh snapshot. The journal is rotated under
+        the lock; the snapshot is built from disk and written outside it, then
+        swapped in (temp file + rename), so appends are only paused briefly.
+        """
+        with self._compact_lock:
+            with file_lock(self.filename):
+                with self.lock:
+                    self._catch_up()
+                    if os.path.exists(self.rotated_file):
+                        # Left over from an interrupted compaction: fold it first
+                        ops = 0
+                    elif self.journal_ops == 0:
+                        return 0
+                    else:
+                        os.replace(self.journal_file, self.rotated_file)
+                        open(self.journal_file, 'a').close()
+                        ops, self.journal_ops = self.journal_ops, 0
+                        self._follow(self.journal_file)
+                        self._journal_offset = 0
+
+            snapshot = self._fold(self.rotated_file)
+            tmp = f'{self.filename}.{os.getpid()}.tmp'
+            write_json(tmp, snapshot)
+
+            with file_lock(self.filename):
+                os.replace(tmp, self.filename)
+                if os.path.exists(self.rotated_file):
+                    os.remove(self.rotated_file)
+                self._stamp = _file_stamp(self.filename)
+            return ops
+
+    def start_compactor(self, interval=300, min_ops=1000):
+        """Compact in the background every `interval` seconds once `min_ops` have piled up"""
+        def run():
+            while True:
+                time.sleep(interval)
+                if self.journal_ops >= min_ops:
+                    try:
+                        with storage_seconds.time('compact', file_label(self.filename)):
+                            self.compact()
+                    except Exception as e:
+                        print(f"Compaction error for {self.filename}: {e}")
+
+        threading.Thread(target=run, name=f'compactor-{os.path.basename(self.filename)}', daemon=True).start()
+
+
+class VersionCounter:
+    """
+    Table listener counting changes per value of `field` (e.g. per user_id),
+    for ETags. Versions carry a random per-process epoch, so two processes
+    (or a restart) never hand out the same version for different contents.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._new_epoch()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._new_epoch)
+
+    def _new_epoch(self):
+        self.epoch = secrets.token_hex(4)
+
+    def handle(self, op, record):
+        value = record.get(self.field)
+        with self._lock:
+            self._versions[value] = self._versions.get(value, 0) + 1
+
+    def version(self, value):
+        return f'{self.epoch}.{self._versions.get(value, 0)}'
+
+
+if __name__ == '__main__':
+    # python storage.py migrate [data_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python storage.py migrate [data_dir]')
+        sys.exit(1)
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else 'data'
+    for name in ['users.json', 'history.json', 'sessions.json']:
+        path = os.path.join(data_dir, name)
+        print(f"{path}: {'migrated' if migrate(path) else 'already up to date'}")
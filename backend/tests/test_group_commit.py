@@ -0,0 +1,124 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from storage import DuplicateKey, Table, migrate, writer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_records(path):
+    with open(path) as f:
+        return json.load(f)['records']
+
+
+def test_concurrent_inserts_share_commits(tmp_path):
+    table = Table(str(tmp_path / 'users.json'), unique=('email',))
+    commits = writer.commits
+    barrier = threading.Barrier(20)
+
+    def register(i):
+        barrier.wait()
+        table.insert({'email': f'user{i}@example.com'})
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # insert() returned, so every record is already on disk
+    assert len(read_records(table.filename)) == 20
+    assert writer.commits - commits < 20
+
+
+def test_unique_index_rejects_duplicates(tmp_path):
+    table = Table(str(tmp_path / 'users.json'), unique=('email',))
+    first = table.insert({'email': 'a@example.com'})
+    second = table.insert({'email': 'b@example.com'})
+
+    with pytest.raises(DuplicateKey):
+        table.insert({'email': 'a@example.com'})
+    with pytest.raises(DuplicateKey):
+        table.update(second['id'], email='a@example.com')
+    table.update(first['id'], email='a@example.com', full_name='A')
+
+    assert table.find('email', 'b@example.com')['id'] == second['id']
+    assert len(table) == 2
+
+
+def test_writers_on_one_file_merge(tmp_path):
+    # Two tables on the same file stand in for two processes
+    path = str(tmp_path / 'users.json')
+    a = Table(path, unique=('email',))
+    b = Table(path, unique=('email',))
+    first = a.insert({'email': 'a@example.com'})
+    second = b.insert({'email': 'b@example.com'})
+    a.update(first['id'], full_name='A')
+
+    assert first['id'] != second['id']
+    records = {r['email']: r for r in read_records(path)}
+    assert set(records) == {'a@example.com', 'b@example.com'}
+    assert records['a@example.com']['full_name'] == 'A'
+
+
+def test_shared_tables_see_other_writers(tmp_path):
+    path = str(tmp_path / 'users.json')
+    reader = Table(path, unique=('email',), shared=True)
+    other = Table(path, unique=('email',), shared=True)
+    record = other.insert({'email': 'new@example.com'})
+
+    assert reader.find('email', 'new@example.com')['id'] == record['id']
+
+
+def test_processes_appending_to_one_file(tmp_path):
+    script = (
+        'import sys\n'
+        f'sys.path.insert(0, {BACKEND_DIR!r})\n'
+        'from storage import Table\n'
+        'table = Table(sys.argv[1])\n'
+        'for i in range(50):\n'
+        '    table.insert({"owner": sys.argv[2], "n": i})\n'
+    )
+    path = str(tmp_path / 'items.json')
+    processes = [subprocess.Popen([sys.executable, '-c', script, path, str(p)]) for p in range(3)]
+    for process in processes:
+        assert process.wait(timeout=60) == 0
+
+    records = read_records(path)
+    assert len(records) == 150
+    assert len({r['id'] for r in records}) == 150
+
+
+def test_migrate_renumbers_duplicate_ids(tmp_path):
+    path = str(tmp_path / 'history.json')
+    with open(path, 'w') as f:
+        json.dump([{'id': 1, 'title': 'a'}, {'id': 3, 'title': 'b'}, {'id': 3, 'title': 'c'}], f)
+
+    assert migrate(path)
+    table = Table(path)
+    assert sorted(r['title'] for r in table.all()) == ['a', 'b', 'c']
+    assert table.insert({'title': 'd'})['id'] == 5
+
+
+def test_reload_notifies_only_changed_records(tmp_path):
+    path = str(tmp_path / 'users.json')
+    reader = Table(path, shared=True)
+    other = Table(path, shared=True)
+    records = [other.insert({'n': i}) for i in range(5)]
+    reader.refresh()
+
+    events = []
+    reader.on_change(lambda op, record: events.append((op, record['id'])), replay=False)
+    other.update(records[1]['id'], n=10)
+    other.delete(records[2]['id'])
+    added = other.insert({'n': 5})
+    reader.refresh()
+
+    assert sorted(events) == sorted([
+        ('del', records[1]['id']), ('put', records[1]['id']), ('del', records[2]['id']), ('put', added['id'])
+    ])
@@ -0,0 +1,47 @@
+import base64
+import json
+import zlib
+
+from history_record import PREVIEW_CHARS, ZDICT, HistoryRecord
+
+ENTRY = {
+    'id': 1,
+    'user_id': 7,
+    'type': 'code',
+    'title': 'Top values',
+    'content': 'def top(values):\n    return sorted(values)[-3:]  # ünïcode\n' * 10,
+    'metadata': {'prompt': 'Top values', 'explanation': 'Sorts and slices.', 'language': 'python'},
+    'pinned': True,
+}
+
+
+def test_round_trip_through_storage():
+    stored = HistoryRecord.from_value(ENTRY).to_stored()
+    assert 'content' not in stored and 'preview' not in stored
+    record = HistoryRecord.from_value(json.loads(json.dumps(stored)))
+    assert record.to_dict() == ENTRY
+    assert record.preview == ENTRY['content'][:PREVIEW_CHARS]
+
+
+def test_update_recompresses_payload():
+    record = HistoryRecord.from_value(ENTRY)
+    assert record.preview.startswith('def top')
+    record.update({'content': 'print(1)', 'title': 'Changed'})
+    assert record.preview == 'print(1)'
+    assert record['metadata'] == ENTRY['metadata']
+    assert record['title'] == 'Changed'
+
+
+def test_reads_version_1_records():
+    # [content, metadata] as JSON, with the preview stored beside the blob
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=ZDICT)
+    raw = json.dumps([ENTRY['content'], ENTRY['metadata']]).encode()
+    blob = compressor.compress(raw) + compressor.flush()
+    stored = {'id': 1, 'user_id': 7, 'z': base64.b64encode(blob).decode(), 'zv': 1}
+
+    record = HistoryRecord.from_value(stored)
+    assert record.payload() == (ENTRY['content'], ENTRY['metadata'])
+    assert record.preview == ENTRY['content'][:PREVIEW_CHARS]
+    assert HistoryRecord.from_value({**stored, 'preview': 'old'}).preview == 'old'
+    # Written back unchanged until the payload changes
+    assert record.to_stored()['zv'] == 1
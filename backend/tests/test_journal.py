@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+from storage import JournaledTable, writer
+
+
+def new_table(tmp_path):
+    return JournaledTable(str(tmp_path / 'history.json'), multi=('user_id',))
+
+
+def test_reload_replays_journal(tmp_path):
+    table = new_table(tmp_path)
+    first = table.insert({'user_id': 1, 'title': 'a'})
+    second = table.insert({'user_id': 1, 'title': 'b'})
+    table.update(first['id'], title='a2')
+    table.delete(second['id'])
+    writer.flush()
+
+    reloaded = new_table(tmp_path)
+    assert [r['title'] for r in reloaded.group('user_id', 1)] == ['a2']
+    assert reloaded.next_id > second['id']
+
+
+def test_torn_last_line_is_dropped_and_truncated(tmp_path):
+    table = new_table(tmp_path)
+    for i in range(3):
+        table.insert({'user_id': 1, 'title': f'entry {i}'})
+    writer.flush()
+
+    journal = table.journal_file
+    good_size = os.path.getsize(journal)
+    with open(journal, 'ab') as f:
+        # A crash in the middle of an append
+        f.write(b'{"op":"put","record":{"id":99,"user_id":1,"tit')
+
+    reloaded = new_table(tmp_path)
+    assert len(reloaded) == 3
+    assert reloaded.get(99) is None
+    assert os.path.getsize(journal) == good_size
+
+    # Appends after the repair land on a clean line boundary
+    reloaded.insert({'user_id': 1, 'title': 'after crash'})
+    writer.flush()
+    assert len(new_table(tmp_path)) == 4
+
+
+def test_corrupt_line_stops_replay(tmp_path):
+    table = new_table(tmp_path)
+    table.insert({'user_id': 1, 'title': 'kept'})
+    writer.flush()
+    with open(table.journal_file, 'ab') as f:
+        f.write(b'not json\n')
+
+    assert [r['title'] for r in new_table(tmp_path).group('user_id', 1)] == ['kept']
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    table = new_table(tmp_path)
+    for i in range(10):
+        table.insert({'user_id': i % 2, 'title': f'entry {i}'})
+    table.delete(1)
+    writer.flush()
+
+    assert table.compact() == 11
+    assert os.path.getsize(table.journal_file) == 0
+    assert not os.path.exists(table.rotated_file)
+    with open(table.filename) as f:
+        assert len(json.load(f)['records']) == 9
+    assert len(new_table(tmp_path)) == 9
+
+
+def test_compaction_while_appending_loses_nothing(tmp_path):
+    table = new_table(tmp_path)
+    per_thread = 150
+    errors = []
+
+    def append(user_id):
+        try:
+            for i in range(per_thread):
+                record = table.insert({'user_id': user_id, 'title': f'{user_id}-{i}'})
+                if i % 10 == 0:
+                    table.update(record['id'], title=f'{user_id}-{i}-updated')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=append, args=(u,)) for u in range(4)]
+    for t in threads:
+        t.start()
+    compactions = 0
+    while any(t.is_alive() for t in threads):
+        table.compact()
+        compactions += 1
+    for t in threads:
+        t.join()
+    writer.flush()
+    table.compact()
+
+    assert not errors
+    assert compactions > 1
+    expected = {
+        (u, f'{u}-{i}-updated' if i % 10 == 0 else f'{u}-{i}')
+        for u in range(4) for i in range(per_thread)
+    }
+    for reloaded in (table, new_table(tmp_path)):
+        assert {(r['user_id'], r['title']) for r in reloaded.all()} == expected
+
+
+def shared_pair(tmp_path):
+    path = str(tmp_path / 'history.json')
+    return (JournaledTable(path, multi=('user_id',), shared=True),
+            JournaledTable(path, multi=('user_id',), shared=True))
+
+
+def test_caught_up_reader_skips_reload_after_compaction(tmp_path, monkeypatch):
+    compactor, reader = shared_pair(tmp_path)
+    for i in range(5):
+        compactor.insert({'user_id': 1, 'title': f'entry {i}'})
+    writer.flush()
+    reader.refresh()
+
+    compactor.compact()
+    compactor.insert({'user_id': 1, 'title': 'after compaction'})
+    writer.flush()
+
+    def reload(*args):
+        raise AssertionError('reloaded the snapshot')
+    monkeypatch.setattr(reader, '_load_snapshot', reload)
+    reader.refresh()
+    assert len(reader) == 6
+    assert reader.journal_ops == 1
+
+
+def test_lagging_reader_reloads_after_compaction(tmp_path):
+    compactor, reader = shared_pair(tmp_path)
+    compactor.insert({'user_id': 1, 'title': 'seen'})
+    writer.flush()
+    reader.refresh()
+
+    # Folded into the snapshot before the reader ever read it
+    unseen = compactor.insert({'user_id': 1, 'title': 'unseen'})
+    writer.flush()
+    compactor.compact()
+    compactor.insert({'user_id': 2, 'title': 'after compaction'})
+    writer.flush()
+
+    reader.refresh()
+    assert reader.get(unseen['id'])['title'] == 'unseen'
+    assert len(reader) == 3
+
+
+def test_reader_catches_up_while_next_compaction_is_running(tmp_path):
+    compactor, reader = shared_pair(tmp_path)
+    compactor.insert({'user_id': 1, 'title': 'first'})
+    writer.flush()
+    reader.refresh()
+    compactor.compact()
+    compactor.insert({'user_id': 1, 'title': 'second'})
+    writer.flush()
+
+    # The first half of another compaction: the journal is rotated, the
+    # snapshot not yet rewritten
+    os.replace(compactor.journal_file, compactor.rotated_file)
+    open(compactor.journal_file, 'a').close()
+
+    reader.refresh()
+    assert sorted(r['title'] for r in reader.all()) == ['first', 'second']
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from response_parser import DEFAULT_EXPLANATION, ResponseParser, parse_response
+
+REPLIES = [
+    "Here is the function:\n\n```python\ndef add(a, b):\n    return a + b\n```\n\nIt adds two numbers.",
+    "```js\nconsole.log('hi')\n```\nand the styles:\n~~~css\nbody { margin: 0 }\n~~~\nDone.",
+    "Nested fences:\n````markdown\n```python\nprint(1)\n```\n````\nThe outer fence wins.",
+    "print('no fences at all')\nsecond line",
+    "Windows line endings:\r\n```python\r\nx = 1\r\n```\r\nEnd",
+    "Interrupted stream:\n```python\ndef unfinished(",
+    "```\nno language\n```",
+    "Not a fence: `` `inline` `` and ```python inside text``` stays prose.\n\n    ```\n    indented\n    ```",
+    "",
+]
+
+
+def feed_in_chunks(text, sizes):
+    parser = ResponseParser()
+    completed = []
+    start = 0
+    for size in sizes:
+        completed += parser.feed(text[start:start + size])
+        start += size
+    completed += parser.feed(text[start:])
+    return completed, parser.close()
+
+
+@pytest.mark.parametrize('reply', REPLIES)
+def test_chunked_matches_whole(reply):
+    whole_completed, whole = feed_in_chunks(reply, [])
+    assert whole == parse_response(reply)
+    rng = random.Random(reply)
+    for sizes in ([1] * len(reply), [2, 3, 5, 7] * len(reply), [rng.randint(1, 12) for _ in range(len(reply))]):
+        completed, result = feed_in_chunks(reply, sizes)
+        assert result == whole
+        assert completed == whole_completed
+
+
+def test_blocks_and_languages():
+    result = parse_response(REPLIES[1])
+    assert [b['language'] for b in result['blocks']] == ['js', 'css']
+    assert result['code'] == "console.log('hi')\n\nbody { margin: 0 }"
+    assert result['explanation'] == 'and the styles:\nDone.'
+    assert result['language'] == 'js'
+
+
+def test_nested_fence_stays_inside_block():
+    result = parse_response(REPLIES[2])
+    assert len(result['blocks']) == 1
+    assert result['blocks'][0]['code'] == "```python\nprint(1)\n```"
+
+
+def test_reply_without_fences_is_all_code():
+    result = parse_response(REPLIES[3])
+    assert result['code'] == "print('no fences at all')\nsecond line"
+    assert result['explanation'] == DEFAULT_EXPLANATION
+    assert result['blocks'] == []
+
+
+def test_unterminated_block_keeps_what_arrived():
+    result = parse_response(REPLIES[5])
+    assert result['blocks'] == [{'language': 'python', 'code': 'def unfinished('}]
+
+
+def test_feed_reports_blocks_as_they_close():
+    parser = ResponseParser()
+    assert parser.feed("```python\nx = 1\n") == []
+    assert parser.feed("```\n") == [{'language': 'python', 'code': 'x = 1'}]
+    assert parser.close()['code'] == 'x = 1'
@@ -0,0 +1,57 @@
+from search import SearchIndex
+
+
+def entry(entry_id, user_id, title, content='', explanation=''):
+    return {
+        'id': entry_id,
+        'user_id': user_id,
+        'title': title,
+        'content': content,
+        'metadata': {'prompt': title, 'explanation': explanation}
+    }
+
+
+def build(*entries):
+    index = SearchIndex()
+    for e in entries:
+        index.handle('put', e)
+    return index
+
+
+def test_title_matches_rank_first():
+    index = build(
+        entry(1, 1, 'parse a csv file', 'import csv'),
+        entry(2, 1, 'sort a list', 'sorted(items)  # not csv related', 'mentions csv once'),
+        entry(3, 1, 'binary search', 'def search(items, x): ...'),
+    )
+    matches, total = index.search(1, 'csv')
+    assert [entry_id for entry_id, _ in matches] == [1, 2]
+    assert total == 2
+
+
+def test_users_only_see_their_own_entries():
+    index = build(entry(1, 1, 'parse csv'), entry(2, 2, 'parse csv'))
+    assert index.search(1, 'csv')[0][0][0] == 1
+    assert index.search(2, 'csv')[0][0][0] == 2
+    assert index.search(3, 'csv') == ([], 0)
+
+
+def test_updates_and_deletes():
+    index = build(entry(1, 1, 'parse csv'), entry(2, 1, 'parse json'))
+    index.handle('put', entry(1, 1, 'parse yaml'))
+    assert index.search(1, 'csv') == ([], 0)
+    assert [i for i, _ in index.search(1, 'parse')[0]] == [2, 1]
+
+    index.handle('del', {'id': 2})
+    assert index.search(1, 'json') == ([], 0)
+    assert [i for i, _ in index.search(1, 'parse yaml')[0]] == [1]
+    assert len(index) == 1
+
+
+def test_paging():
+    index = build(*(entry(i, 1, f'report {i}') for i in range(1, 8)))
+    first, total = index.search(1, 'report', limit=3)
+    rest, _ = index.search(1, 'report', limit=10, offset=3)
+    assert total == 7
+    # Equal scores: newest first
+    assert [i for i, _ in first + rest] == [7, 6, 5, 4, 3, 2, 1]
@@ -0,0 +1,59 @@
+import pytest
+
+import ai_generator
+import resilience
+from ai_generator import stream_with_ai
+
+
+def chunks(*texts, error=None):
+    def stream(prompt, model_id, context=None):
+        yield from texts
+        if error:
+            raise error
+    return stream
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    # Fresh circuit breakers, so failures in one test don't open them for the next
+    monkeypatch.setattr(resilience, '_health', {})
+    monkeypatch.setitem(ai_generator.PROVIDER_STREAMS, 'anthropic', chunks(error=RuntimeError('down')))
+    monkeypatch.setitem(ai_generator.PROVIDER_STREAMS, 'openai', chunks(error=RuntimeError('down')))
+    return ai_generator.PROVIDER_STREAMS
+
+
+def test_empty_stream_fails_over(streams):
+    streams['anthropic'] = chunks()
+    streams['openai'] = chunks('from ', 'gpt-3.5')
+    served = {}
+    assert ''.join(stream_with_ai('p', 'kiwi-4.5', served=served)) == 'from gpt-3.5'
+    assert served['model'] == 'gpt-3.5'
+
+
+def test_error_before_first_chunk_fails_over(streams):
+    streams['openai'] = chunks('ok')
+    assert list(stream_with_ai('p', 'kiwi-4.5')) == ['ok']
+
+
+def test_error_after_first_chunk_is_raised(streams):
+    streams['anthropic'] = chunks('half a ', error=RuntimeError('connection reset'))
+    streams['openai'] = chunks('never used')
+    received = []
+    with pytest.raises(RuntimeError):
+        for text in stream_with_ai('p', 'kiwi-4.5'):
+            received.append(text)
+    assert received == ['half a ']
+
+
+def test_every_provider_failing_streams_the_demo(streams):
+    reply = ''.join(stream_with_ai('p', 'kiwi-4.5'))
+    assert ai_generator.DEMO_EXPLANATION in reply
+
+
+def test_failover_stays_within_allowed_models(streams, monkeypatch):
+    monkeypatch.setitem(ai_generator.FAILOVER, 'gpt-3.5', ['kiwi-opus', 'kiwi-4.5'])
+    streams['anthropic'] = chunks('from anthropic')
+    served = {}
+    assert ''.join(stream_with_ai('p', 'gpt-3.5', served=served, allowed={'gpt-3.5', 'kiwi-4.5'})) == 'from anthropic'
+    assert served['model'] == 'kiwi-4.5'
+    assert ai_generator.failover_chain('gpt-3.5', {'gpt-3.5'}) == ['gpt-3.5']
@@ -0,0 +1,19 @@
+from tokens import decode_access_token, issue_access_token
+
+SECRET = 'test-secret'
+
+
+def test_round_trip():
+    token = issue_access_token(7, SECRET)
+    assert decode_access_token(token, SECRET)['sub'] == 7
+
+
+def test_tampered_or_malformed_tokens_are_rejected():
+    token = issue_access_token(7, SECRET)
+    body, _, signature = token.partition('.')
+    assert decode_access_token(token, 'other-secret') is None
+    assert decode_access_token(f'{body}.{signature[:-2]}xx', SECRET) is None
+    assert decode_access_token(body, SECRET) is None
+    # Non-ASCII signatures and bodies come straight from the Authorization header
+    assert decode_access_token(f'{body}.sïgnature', SECRET) is None
+    assert decode_access_token(f'bödy.{signature}', SECRET) is None
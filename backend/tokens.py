@@ -0,0 +1,153 @@
+"""
+GlobalAssist - Signed Access Tokens
+Short-lived HMAC-SHA256 tokens verified in memory, plus a compact revocation denylist
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+from storage import file_lock
+
+ACCESS_TOKEN_TTL = int(os.getenv('ACCESS_TOKEN_TTL', 15 * 60))
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(body, secret):
+    return _b64encode(hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest())
+
+
+def session_id(refresh_token):
+    """Short, non-reversible id linking an access token to its refresh session"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+
+
+class Denylist:
+    """
+    Revoked token ids, kept only until the tokens would have expired anyway.
+
+    Once attached to a file, revocations are appended there ("<jti> <exp>" per
+    line) and lookups first read whatever other processes appended, so a
+    logout in one worker is honoured by all of them and survives restarts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.filename = None
+        self._stamp = None
+
+    def attach(self, filename):
+        with self._lock:
+            self.filename = filename
+            self._stamp = None
+            self._offset = 0
+            self._sync()
+
+    def _sync(self):
+        """Read lines appended since the last look (caller holds self._lock)"""
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+        if self._stamp is not None and (st.st_ino, st.st_size) == self._stamp:
+            return
+        if self._stamp is None or st.st_ino != self._stamp[0]:
+            # First read, or rewritten by prune() in some process
+            self._offset = 0
+
+        with open(self.filename, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                jti, _, exp = line.decode().partition(' ')
+                self._entries[jti] = float(exp)
+                self._offset += len(line)
+        self._stamp = (st.st_ino, self._offset)
+
+    def revoke(self, jti, expires_at):
+        with self._lock:
+            self._entries[jti] = expires_at
+            if self.filename:
+                with file_lock(self.filename), open(self.filename, 'a') as f:
+                    f.write(f'{jti} {expires_at}\n')
+
+    def __contains__(self, jti):
+        if self.filename:
+            with self._lock:
+                self._sync()
+        return jti in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def prune(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            if self.filename:
+                with file_lock(self.filename):
+                    self._sync()
+                    expired = self._drop_expired(now)
+                    tmp = f'{self.filename}.{os.getpid()}.tmp'
+                    with open(tmp, 'w') as f:
+                        f.writelines(f'{jti} {exp}\n' for jti, exp in self._entries.items())
+                    os.replace(tmp, self.filename)
+                    self._stamp = None
+                    self._sync()
+                return expired
+            return self._drop_expired(now)
+
+    def _drop_expired(self, now):
+        expired = [jti for jti, exp in self._entries.items() if exp <= now]
+        for jti in expired:
+            del self._entries[jti]
+        return len(expired)
+
+
+denylist = Denylist()
+
+
+def issue_access_token(user_id, secret, sid=None, ttl=ACCESS_TOKEN_TTL):
+    payload = {
+        'sub': user_id,
+        'exp': int(time.time()) + ttl,
+        'jti': secrets.token_urlsafe(8)
+    }
+    if sid:
+        payload['sid'] = sid
+    body = _b64encode(json.dumps(payload, separators=(',', ':')).encode())
+    return f'{body}.{_sign(body, secret)}'
+
+
+def decode_access_token(token, secret):
+    """Return the token payload if the signature is valid and it hasn't expired or been revoked"""
+    body, _, signature = token.partition('.')
+    if not body or not signature:
+        return None
+    # Bytes, not str: compare_digest rejects non-ASCII strings with a TypeError
+    if not hmac.compare_digest(signature.encode(), _sign(body, secret).encode()):
+        return None
+
+    try:
+        payload = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+
+    if payload.get('exp', 0) <= time.time() or payload.get('jti') in denylist:
+        return None
+    return payload
+
+
+def revoke_access_token(payload):
+    denylist.revoke(payload['jti'], payload['exp'])
@@ -0,0 +1,262 @@
+"""
+GlobalAssist - File Uploads
+Multipart uploads are streamed straight to disk while being hashed, stored once
+per content hash, and their text extracted in a background process pool. The
+extracted text is cached next to the file, so it's parsed once no matter how
+many users upload it or how many prompts reference it.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+
+MAX_UPLOAD_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', 10))
+EXTRACT_WORKERS = int(os.getenv('UPLOAD_EXTRACT_WORKERS', 2))
+EXTRACT_TIMEOUT = float(os.getenv('UPLOAD_EXTRACT_TIMEOUT', 30))
+# Text handed to the model per file, in characters
+MAX_TEXT_CHARS = int(os.getenv('UPLOAD_MAX_TEXT_CHARS', 20000))
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.csv', '.json', '.yaml', '.yml', '.xml', '.html', '.css', '.sql', '.log',
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.java', '.c', '.h', '.cpp', '.cs', '.go', '.rs',
+    '.rb', '.php', '.sh', '.swift', '.kt'
+}
+
+
+def file_kind(filename, content_type):
+    """'pdf', 'text', or None for files we can't read text from (images, ...)"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.pdf' or content_type == 'application/pdf':
+        return 'pdf'
+    if ext in TEXT_EXTENSIONS or (content_type or '').startswith('text/'):
+        return 'text'
+    return None
+
+
+# ============================================
+# TEXT EXTRACTION (runs in the worker processes)
+# ============================================
+
+def _extract_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        print("pypdf is not installed; PDF uploads are stored without their text")
+        return None
+    parts = []
+    size = 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        size += len(text)
+        if size >= MAX_TEXT_CHARS:
+            break
+    return '\n\n'.join(parts)
+
+def _extract_text(path):
+    # 4 bytes per character at most, so this always covers MAX_TEXT_CHARS
+    with open(path, 'rb') as f:
+        return f.read(MAX_TEXT_CHARS * 4).decode('utf-8', errors='replace')
+
+def extract_to_cache(path, kind, cache_path):
+    """Extract a file's text into cache_path; returns False if there is none"""
+    text = _extract_pdf(path) if kind == 'pdf' else _extract_text(path)
+    if text is None:
+        return False
+    tmp = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text[:MAX_TEXT_CHARS])
+    os.replace(tmp, cache_path)
+    return True
+
+
+# ============================================
+# STORE
+# ============================================
+
+class HashingFile:
+    """Write side of an upload: a temp file that hashes and counts what it's given"""
+
+    def __init__(self, directory, limit):
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.path = self._file.name
+        self.limit = limit
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestEntityTooLarge(f'Files are limited to {self.limit} bytes')
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadStore:
+    """
+    Files live at <directory>/<sha256[:2]>/<sha256>, extracted text beside them
+    as <sha256>.txt. Upload records (one per user and file) are kept by the app.
+    """
+
+    def __init__(self, directory, workers=EXTRACT_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}
+        self._tmp_dir = os.path.join(directory, 'tmp')
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def text_path(self, digest):
+        return self.path(digest) + '.txt'
+
+    # ----- worker pool -----
+
+    def start(self):
+        """Start the worker processes now (call before the app starts its own threads)"""
+        if self.workers:
+            self._get_pool().submit(int).result()
+
+    def after_fork(self):
+        """In a forked child: the pool's processes and threads belong to the parent"""
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}
+
+    def _submit(self, *args):
+        if not self.workers:
+            # No pool: extract on the calling thread
+            future = Future()
+            try:
+                future.set_result(args[0](*args[1:]))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        try:
+            return self._get_pool().submit(*args)
+        except BrokenProcessPool:
+            print("Text extraction pool broke, restarting it")
+            with self._lock:
+                self._pool = None
+            return self._get_pool().submit(*args)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    # ----- receiving -----
+
+    def receive(self, environ, max_bytes=MAX_UPLOAD_BYTES, max_files=MAX_FILES):
+        """
+        Parse a multipart request body, streaming each file to disk.
+        Returns [(filename, content_type, size, sha256)] for the stored files.
+        """
+        parts = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            if len(parts) >= max_files:
+                raise RequestEntityTooLarge(f'At most {max_files} files per upload')
+            part = HashingFile(self._tmp_dir, max_bytes)
+            parts.append(part)
+            return part
+
+        try:
+            _, _, files = parse_form_data(
+                environ, stream_factory=stream_factory, max_content_length=max_files * max_bytes + 65536, silent=False)
+            stored = []
+            for _, storage in files.items(multi=True):
+                part = storage.stream
+                part.close()
+                digest = part.sha256.hexdigest()
+                self._keep(part.path, digest)
+                stored.append((os.path.basename(storage.filename or 'file'), storage.mimetype, part.size, digest))
+            return stored
+        finally:
+            for part in parts:
+                part.close()
+                if os.path.exists(part.path):
+                    os.remove(part.path)
+
+    def _keep(self, tmp_path, digest):
+        """Move a received file into place, unless the same content is already stored"""
+        path = self.path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def remove(self, digest):
+        """Delete a stored file and its text (once no upload record refers to it)"""
+        for path in (self.path(digest), self.text_path(digest)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ----- text -----
+
+    def text_status(self, digest, kind):
+        """'ready', 'pending', 'failed' or 'unsupported'"""
+        if kind is None:
+            return 'unsupported'
+        if os.path.exists(self.text_path(digest)):
+            return 'ready'
+        future = self._pending.get(digest)
+        if future is not None and future.done() and (future.exception() is not None or not future.result()):
+            return 'failed'
+        return 'pending'
+
+    def extract(self, digest, kind):
+        """Start extracting a file's text in the background (no-op if cached or running)"""
+        if kind is None or os.path.exists(self.text_path(digest)):
+            return None
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+        future = self._submit(extract_to_cache, self.path(digest), kind, self.text_path(digest))
+        with self._lock:
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._forget(digest))
+        return future
+
+    def _forget(self, digest):
+        # Keep failures around for text_status; successes are on disk now
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None and future.exception() is None and future.result():
+                del self._pending[digest]
+
+    def text(self, digest, kind, timeout=EXTRACT_TIMEOUT):
+        """The file's extracted text, waiting up to `timeout` for extraction; None if unavailable"""
+        future = self.extract(digest, kind)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeout:
+                print(f"Text extraction for {digest[:12]} timed out")
+                return None
+            except Exception as e:
+                print(f"Text extraction error for {digest[:12]}: {e}")
+                return None
+        try:
+            with open(self.text_path(digest), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
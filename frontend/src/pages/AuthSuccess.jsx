@@ -10,11 +10,12 @@ const AuthSuccess = () => {
 
   useEffect(() => {
     const token = searchParams.get('token')
+    const refreshToken = searchParams.get('refresh_token')
     
     if (token) {
       // Save token
       localStorage.setItem('access_token', token)
-      localStorage.setItem('refresh_token', token)
+      localStorage.setItem('refresh_token', refreshToken || token)
       
       // Load user and redirect
       setTimeout(() => {
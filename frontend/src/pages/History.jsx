@@ -4,11 +4,13 @@ import Header from '../components/Header'
 import Sidebar from '../components/Sidebar'
 import Loader from '../components/Loader'
 import { historyService } from '../services/historyService'
-import { Trash2 } from 'lucide-react'
+import { Search, Trash2 } from 'lucide-react'
 
 const History = () => {
   const { type } = useParams()
   const [history, setHistory] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [query, setQuery] = useState('')
   const [loading, setLoading] = useState(true)
 
   useEffect(() => {
@@ -19,6 +21,7 @@ const History = () => {
     try {
       const data = await historyService.getHistory(type)
       setHistory(data.history)
+      setNextCursor(data.next_cursor)
     } catch (error) {
       console.error('Failed to load history:', error)
     } finally {
@@ -26,6 +29,31 @@ const History = () => {
     }
   }
 
+  const loadMore = async () => {
+    try {
+      const data = await historyService.getHistory(type, 1, 20, nextCursor)
+      setHistory(prev => [...prev, ...data.history])
+      setNextCursor(data.next_cursor)
+    } catch (error) {
+      console.error('Failed to load history:', error)
+    }
+  }
+
+  const handleSearch = async (e) => {
+    e.preventDefault()
+    if (!query.trim()) {
+      loadHistory()
+      return
+    }
+    try {
+      const data = await historyService.searchHistory(query)
+      setHistory(data.history)
+      setNextCursor(null)
+    } catch (error) {
+      console.error('Failed to search history:', error)
+    }
+  }
+
   const handleDelete = async (id) => {
     if (!confirm('Delete this item?')) return
     try {
@@ -45,6 +73,15 @@ const History = () => {
           <h1 className="text-3xl font-bold text-text-primary mb-8 capitalize">
             {type === 'chat' ? 'Chats' : type === 'project' ? 'Projects' : type === 'artifact' ? 'Artifacts' : 'Code'} History
           </h1>
+          <form onSubmit={handleSearch} className="mb-6 flex items-center gap-2 bg-primary-secondary border border-border rounded-xl px-3 py-2">
+            <Search size={18} className="text-text-secondary" />
+            <input
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              placeholder="Search your history..."
+              className="flex-1 bg-transparent text-text-primary placeholder-text-tertiary outline-none"
+            />
+          </form>
           {loading ? (
             <Loader />
           ) : history.length === 0 ? (
@@ -57,7 +94,7 @@ const History = () => {
                 <div key={item.id} className="card flex items-start justify-between">
                   <div className="flex-1">
                     <h3 className="font-semibold text-text-primary mb-2">{item.title}</h3>
-                    <p className="text-sm text-text-secondary line-clamp-2">{item.content}</p>
+                    <p className="text-sm text-text-secondary line-clamp-2">{item.preview}</p>
                     <div className="flex items-center gap-4 mt-3 text-xs text-text-tertiary">
                       <span>{new Date(item.created_at).toLocaleDateString()}</span>
                       {item.model_used && <span>Model: {item.model_used}</span>}
@@ -68,6 +105,11 @@ const History = () => {
                   </button>
                 </div>
               ))}
+              {nextCursor && (
+                <button onClick={loadMore} className="text-accent hover:text-accent-hover font-semibold py-2">
+                  Load more
+                </button>
+              )}
             </div>
           )}
         </div>
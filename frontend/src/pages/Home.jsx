@@ -6,6 +6,7 @@ import Sidebar from '../components/Sidebar'
 import ChatMessage from '../components/ChatMessage'
 import Loader from '../components/Loader'
 import { aiService } from '../services/aiService'
+import { fileService } from '../services/fileService'
 import { useAuth } from '../context/AuthContext'
 
 const Home = () => {
@@ -17,6 +18,8 @@ const Home = () => {
   const [selectedModel, setSelectedModel] = useState(null)
   const [availableModels, setAvailableModels] = useState([])
   const [uploadedFiles, setUploadedFiles] = useState([])
+  // Follow-ups are sent with the conversation id of the first reply
+  const [conversationId, setConversationId] = useState(null)
   const messagesEndRef = useRef(null)
   const textareaRef = useRef(null)
   const fileInputRef = useRef(null)
@@ -39,15 +42,30 @@ const Home = () => {
     }
   }
 
-  const handleFileSelect = (e) => {
+  const handleFileSelect = async (e) => {
     const files = Array.from(e.target.files)
+    e.target.value = ''
     const newFiles = files.map(file => ({
       name: file.name,
       size: file.size,
       type: file.type,
-      file: file
+      file: file,
+      uploading: Boolean(user)
     }))
     setUploadedFiles(prev => [...prev, ...newFiles])
+    if (!user || files.length === 0) return
+
+    // Upload right away so the server can read the files while the prompt is typed
+    const markUploaded = (update) => setUploadedFiles(prev => prev.map(f => (
+      newFiles.includes(f) ? { ...f, ...update(newFiles.indexOf(f)) } : f
+    )))
+    try {
+      const stored = await fileService.uploadFiles(files)
+      markUploaded(i => ({ id: stored[i]?.id, uploading: false }))
+    } catch (error) {
+      console.error('Failed to upload files:', error)
+      markUploaded(() => ({ uploading: false, failed: true }))
+    }
   }
 
   const removeFile = (index) => {
@@ -65,6 +83,7 @@ const Home = () => {
       return
     }
 
+    const fileIds = uploadedFiles.filter(f => f.id).map(f => f.id)
     const userMessage = { content: prompt, isUser: true }
     setMessages(prev => [...prev, userMessage])
     setPrompt('')
@@ -73,18 +92,24 @@ const Home = () => {
     setLoading(true)
 
     try {
-      // Generate code - works with or without login
-      const result = await aiService.generateCode(prompt, selectedModel.id)
-      
-      const aiMessage = {
-        content: result.code,
-        explanation: result.explanation,
-        model: selectedModel.name,
-        type: 'code',
-        isUser: false
+      // Stream the reply into a placeholder message as tokens arrive
+      setMessages(prev => [...prev, { content: '', model: selectedModel.name, type: 'code', isUser: false, streaming: true }])
+      const updateLast = (update) => setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], ...update(prev[prev.length - 1]) }])
+
+      const result = await aiService.generateCodeStream(prompt, selectedModel.id, (text) => {
+        setLoading(false)
+        updateLast(last => ({ content: last.content + text }))
+      }, conversationId, fileIds)
+
+      if (result?.conversation_id) {
+        setConversationId(result.conversation_id)
       }
-      
-      setMessages(prev => [...prev, aiMessage])
+
+      updateLast(last => ({
+        content: result?.code ?? last.content,
+        explanation: result?.explanation,
+        streaming: false
+      }))
     } catch (error) {
       let errorMsg = 'Failed to generate code. Please try again.'
       
@@ -101,7 +126,8 @@ const Home = () => {
         isUser: false
       }
       
-      setMessages(prev => [...prev, errorMessage])
+      // Replace the streaming placeholder (if any) with the error
+      setMessages(prev => [...prev.filter(m => !m.streaming), errorMessage])
     } finally {
       setLoading(false)
     }
@@ -176,6 +202,8 @@ const Home = () => {
                 {uploadedFiles.map((file, index) => (
                   <div key={index} className="flex items-center gap-2 bg-primary-tertiary border border-border rounded-lg px-3 py-2">
                     <span className="text-sm text-text-primary truncate max-w-[200px]">{file.name}</span>
+                    {file.uploading && <span className="text-xs text-text-tertiary">uploading…</span>}
+                    {file.failed && <span className="text-xs text-red-500">upload failed</span>}
                     <button onClick={() => removeFile(index)} className="text-text-secondary hover:text-text-primary">
                       <X size={16} />
                     </button>
@@ -224,7 +252,7 @@ const Home = () => {
 
                 <button
                   type="submit"
-                  disabled={!prompt.trim() || loading}
+                  disabled={!prompt.trim() || loading || uploadedFiles.some(f => f.uploading)}
                   className="p-2 bg-accent hover:bg-accent-hover rounded-lg transition-all disabled:opacity-50 disabled:cursor-not-allowed"
                 >
                   <Send size={20} className="text-white" />
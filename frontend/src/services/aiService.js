@@ -1,4 +1,4 @@
-import api from './api'
+import api, { API_URL, refreshAccessToken } from './api'
 
 export const aiService = {
   async getModels() {
@@ -6,14 +6,109 @@ export const aiService = {
     return data.models
   },
 
-  async generateCode(prompt, modelId = 'kiwi-4.5') {
+  // Pass the conversation_id of an earlier reply to send a follow-up in the same conversation,
+  // and the ids from fileService.uploadFiles to attach files to the prompt
+  async generateCode(prompt, modelId = 'kiwi-4.5', conversationId = null, fileIds = []) {
     const { data } = await api.post('/ai/generate', {
       prompt,
       model: modelId,
+      ...(conversationId ? { conversation_id: conversationId } : {}),
+      ...(fileIds.length ? { file_ids: fileIds } : {}),
     })
     return data
   },
 
+  // Queues the generation as a background job and long-polls until it finishes, so
+  // slow generations survive proxy and browser timeouts. Resolves with the job's result.
+  async generateCodeJob(prompt, modelId = 'kiwi-4.5', conversationId = null, fileIds = []) {
+    const { data } = await api.post('/ai/generate', {
+      prompt,
+      model: modelId,
+      job: true,
+      ...(conversationId ? { conversation_id: conversationId } : {}),
+      ...(fileIds.length ? { file_ids: fileIds } : {}),
+    })
+
+    let job = data.job
+    while (!['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+      job = await this.getJob(job.id, 25)
+    }
+    if (job.status !== 'succeeded') {
+      throw new Error(job.error || `Generation ${job.status}`)
+    }
+    return job.result
+  },
+
+  async getJob(jobId, wait = 0) {
+    const { data } = await api.get(`/ai/jobs/${jobId}`, { params: { wait } })
+    return data.job
+  },
+
+  async cancelJob(jobId) {
+    const { data } = await api.delete(`/ai/jobs/${jobId}`)
+    return data.job
+  },
+
+  // Streams Server-Sent Events; onDelta receives each text chunk as it arrives.
+  // Resolves with the final { code, explanation, model_used, history_id, conversation_id }.
+  async generateCodeStream(prompt, modelId = 'kiwi-4.5', onDelta = () => {}, conversationId = null, fileIds = []) {
+    // fetch (axios can't stream), so the 401 -> refresh -> retry of api.js is done here
+    const send = (token) => fetch(`${API_URL}/api/ai/generate/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify({
+        prompt,
+        model: modelId,
+        ...(conversationId ? { conversation_id: conversationId } : {}),
+        ...(fileIds.length ? { file_ids: fileIds } : {}),
+      }),
+    })
+
+    let response = await send(localStorage.getItem('access_token'))
+    if (response.status === 401 && localStorage.getItem('refresh_token')) {
+      response = await send(await refreshAccessToken())
+    }
+
+    if (!response.ok) {
+      const error = new Error('Stream request failed')
+      error.response = { status: response.status, data: await response.json().catch(() => ({})) }
+      throw error
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const raw = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+
+        const event = raw.match(/^event: (.*)$/m)?.[1]
+        const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}')
+        if (event === 'delta') onDelta(data.text)
+        else if (event === 'done') result = data
+        else if (event === 'error') throw new Error(data.error)
+      }
+    }
+
+    return result
+  },
+
+  async getConversation(conversationId) {
+    const { data } = await api.get(`/conversations/${conversationId}`)
+    return data
+  },
+
   async explainCode(code, modelId = 'kiwi-4.5') {
     const { data } = await api.post('/ai/explain', {
       code,
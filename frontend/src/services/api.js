@@ -1,14 +1,51 @@
 import axios from 'axios'
 
-const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000'
+export const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000'
 
 const api = axios.create({
   baseURL: `${API_URL}/api`,
   headers: {
     'Content-Type': 'application/json',
   },
+  // 304s are answered from etagCache below
+  validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
 })
 
+// Last ETag and body per GET url, so unchanged responses come back as empty 304s
+const etagCache = new Map()
+
+const cacheKey = (config) => api.getUri(config)
+
+// One refresh at a time: requests that fail together wait for the same new token
+let refreshing = null
+
+// Swaps the refresh token for a new access token (and stores it). If that
+// fails the session is over: tokens are cleared and the user is sent to /login.
+export function refreshAccessToken() {
+  if (!refreshing) {
+    refreshing = (async () => {
+      try {
+        const refreshToken = localStorage.getItem('refresh_token')
+        if (!refreshToken) throw new Error('Not signed in')
+        const { data } = await axios.post(`${API_URL}/api/auth/refresh`, {}, {
+          headers: { Authorization: `Bearer ${refreshToken}` }
+        })
+        localStorage.setItem('access_token', data.access_token)
+        return data.access_token
+      } catch (refreshError) {
+        localStorage.removeItem('access_token')
+        localStorage.removeItem('refresh_token')
+        etagCache.clear()
+        window.location.href = '/login'
+        throw refreshError
+      } finally {
+        refreshing = null
+      }
+    })()
+  }
+  return refreshing
+}
+
 // Request interceptor to add auth token
 api.interceptors.request.use(
   (config) => {
@@ -16,6 +53,12 @@ api.interceptors.request.use(
     if (token) {
       config.headers.Authorization = `Bearer ${token}`
     }
+    if ((config.method || 'get') === 'get') {
+      const cached = etagCache.get(cacheKey(config))
+      if (cached) {
+        config.headers['If-None-Match'] = cached.etag
+      }
+    }
     return config
   },
   (error) => Promise.reject(error)
@@ -23,7 +66,21 @@ api.interceptors.request.use(
 
 // Response interceptor to handle errors
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    if ((response.config.method || 'get') !== 'get') {
+      return response
+    }
+    const key = cacheKey(response.config)
+    if (response.status === 304) {
+      const cached = etagCache.get(key)
+      if (cached) {
+        return { ...response, status: 200, data: cached.data }
+      }
+    } else if (response.headers.etag) {
+      etagCache.set(key, { etag: response.headers.etag, data: response.data })
+    }
+    return response
+  },
   async (error) => {
     const originalRequest = error.config
 
@@ -31,24 +88,15 @@ api.interceptors.response.use(
     if (error.response?.status === 401 && !originalRequest._retry) {
       originalRequest._retry = true
 
-      try {
-        const refreshToken = localStorage.getItem('refresh_token')
-        if (refreshToken) {
-          const { data } = await axios.post(`${API_URL}/api/auth/refresh`, {}, {
-            headers: { Authorization: `Bearer ${refreshToken}` }
-          })
-          
-          localStorage.setItem('access_token', data.access_token)
-          originalRequest.headers.Authorization = `Bearer ${data.access_token}`
-          
+      if (localStorage.getItem('refresh_token')) {
+        try {
+          const token = await refreshAccessToken()
+          originalRequest.headers.Authorization = `Bearer ${token}`
           return api(originalRequest)
+        } catch (refreshError) {
+          // Refresh failed: refreshAccessToken logged the user out
+          return Promise.reject(refreshError)
         }
-      } catch (refreshError) {
-        // Refresh failed, logout user
-        localStorage.removeItem('access_token')
-        localStorage.removeItem('refresh_token')
-        window.location.href = '/login'
-        return Promise.reject(refreshError)
       }
     }
 
@@ -7,6 +7,9 @@ export const authService = {
       password,
       full_name: fullName,
     })
+    if (data.refresh_token) {
+      localStorage.setItem('refresh_token', data.refresh_token)
+    }
     return data
   },
 
@@ -0,0 +1,27 @@
+import api from './api'
+
+export const fileService = {
+  // Uploads files as multipart/form-data; resolves with
+  // [{ id, filename, size, sha256, text_status }] in the same order.
+  async uploadFiles(files, onProgress = () => {}) {
+    const form = new FormData()
+    files.forEach((file) => form.append('file', file))
+    const { data } = await api.post('/uploads', form, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      onUploadProgress: (event) => {
+        if (event.total) onProgress(event.loaded / event.total)
+      },
+    })
+    return data.files
+  },
+
+  async getFile(id) {
+    const { data } = await api.get(`/uploads/${id}`)
+    return data.file
+  },
+
+  async deleteFile(id) {
+    const { data } = await api.delete(`/uploads/${id}`)
+    return data
+  },
+}
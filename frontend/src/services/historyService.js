@@ -1,9 +1,16 @@
 import api from './api'
 
 export const historyService = {
-  async getHistory(type = 'all', page = 1, perPage = 20) {
-    const { data } = await api.get(`/history/${type}`, {
-      params: { page, per_page: perPage },
+  // Returns { history, total, next_cursor }; pass next_cursor back as cursor for the next page
+  async getHistory(type = 'all', page = 1, perPage = 20, cursor = null) {
+    const params = cursor ? { cursor, per_page: perPage } : { page, per_page: perPage }
+    const { data } = await api.get(`/history/${type}`, { params })
+    return data
+  },
+
+  async searchHistory(query, page = 1, perPage = 20) {
+    const { data } = await api.get('/history/search', {
+      params: { q: query, page, per_page: perPage },
     })
     return data
   },